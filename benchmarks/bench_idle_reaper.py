@@ -0,0 +1,73 @@
+"""
+Compare an idle-conversation sweep through the ConversationManager expiry heap with a full
+scan over ``conversations``.
+
+    python -m benchmarks.bench_idle_reaper
+"""
+import json
+import tempfile
+import time
+import timeit
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List
+
+from src.managers import ConversationManager
+from src.storage import JsonStore
+
+CONVERSATIONS = 100_000
+EXPIRED = 1_000
+
+
+def scan_idle(conversations: Dict[str, Dict], older_than: str) -> List[int]:
+    return [
+        int(client_id)
+        for client_id, record in conversations.items()
+        if record["last_activity"] < older_than
+    ]
+
+
+def build_manager(data_dir: Path, now: datetime) -> ConversationManager:
+    conversations = {
+        str(1_000_000 + client): {
+            "operator_id": 1 + client % 200,
+            "client_name": f"client {client}",
+            # The first EXPIRED clients went quiet two days ago, the rest are recent.
+            "last_activity": (
+                now - timedelta(days=2 if client < EXPIRED else 0, seconds=client % 3600)
+            ).isoformat(),
+        }
+        for client in range(CONVERSATIONS)
+    }
+    path = data_dir / "conversations.json"
+    path.write_text(json.dumps({"conversations": conversations}), encoding="utf-8")
+    return ConversationManager(JsonStore(path, {"conversations": {}}))
+
+
+def main() -> None:
+    now = datetime.now(timezone.utc)
+    cutoff = (now - timedelta(days=1)).isoformat()
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = build_manager(Path(tmp), now)
+        conversations = manager.conversation_snapshot()
+
+        scan_seconds = min(
+            timeit.repeat(lambda: scan_idle(conversations, cutoff), number=1, repeat=5)
+        )
+        started = time.perf_counter()
+        idle = manager.idle_clients(cutoff, limit=EXPIRED * 2)
+        sweep_seconds = time.perf_counter() - started
+        assert sorted(idle) == sorted(scan_idle(conversations, cutoff))
+        # Returned clients have already left the heap; the reaper would release them now.
+        empty_seconds = min(
+            timeit.repeat(lambda: manager.idle_clients(cutoff, limit=EXPIRED), number=100, repeat=3)
+        ) / 100
+
+    print(f"{CONVERSATIONS} conversations, {EXPIRED} idle")
+    print(f"      full scan: {scan_seconds * 1000:8.3f} ms per sweep")
+    print(f"     heap sweep: {sweep_seconds * 1000:8.3f} ms ({len(idle)} idle found)")
+    print(f"heap, none idle: {empty_seconds * 1000:8.3f} ms per sweep")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Measure what the metrics instrumentation adds to the hot path: one histogram observation,
+an instrumented handler against the bare coroutine, and a full scrape.
+
+    python -m benchmarks.bench_metrics
+"""
+import asyncio
+import time
+import timeit
+
+from src.metrics import Counter, Histogram, Registry
+
+CALLS = 100_000
+
+
+async def handler(_update, _context) -> None:
+    return None
+
+
+def instrument(histogram: Histogram, errors: Counter, name: str, callback):
+    # Same shape as bot.instrumented, without importing the bot and its settings.
+    async def wrapper(update, context) -> None:
+        started = time.perf_counter()
+        try:
+            await callback(update, context)
+        except Exception:
+            errors.inc(name)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started, name)
+
+    return wrapper
+
+
+async def run_calls(callback) -> float:
+    started = time.perf_counter()
+    for _ in range(CALLS):
+        await callback(None, None)
+    return (time.perf_counter() - started) / CALLS
+
+
+def main() -> None:
+    registry = Registry()
+    histogram = registry.histogram("bench_handler_seconds", "bench", ["handler"])
+    errors = registry.counter("bench_handler_errors_total", "bench", ["handler"])
+
+    observe = min(
+        timeit.repeat(lambda: histogram.observe(0.003, "message"), number=CALLS, repeat=3)
+    ) / CALLS
+    bare = min(asyncio.run(run_calls(handler)) for _ in range(3))
+    wrapped_handler = instrument(histogram, errors, "message", handler)
+    wrapped = min(asyncio.run(run_calls(wrapped_handler)) for _ in range(3))
+
+    for index in range(20):
+        histogram.observe(0.01, f"handler-{index}")
+    render = min(timeit.repeat(registry.render, number=100, repeat=3)) / 100
+
+    print(f"histogram.observe: {observe * 1e6:6.2f} us")
+    print(
+        f"handler call: bare {bare * 1e6:6.2f} us, instrumented {wrapped * 1e6:6.2f} us "
+        f"(+{(wrapped - bare) * 1e6:.2f} us)"
+    )
+    print(f"scrape with 20 series: {render * 1000:6.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compare per-operator client lookups through the ConversationManager index with the
+full scan over ``conversations`` that the manager used before.
+
+    python -m benchmarks.bench_operator_index
+"""
+import json
+import tempfile
+import timeit
+from pathlib import Path
+from typing import Dict, List
+
+from src.managers import ConversationManager, utcnow
+from src.storage import JsonStore
+
+OPERATORS = 200
+CONVERSATIONS = 50_000
+
+
+def scan_clients_for_operator(conversations: Dict[str, Dict], operator_chat_id: int) -> List[int]:
+    result = []
+    for client_id, record in conversations.items():
+        if int(record["operator_id"]) == operator_chat_id:
+            result.append(int(client_id))
+    return result
+
+
+def build_manager(data_dir: Path) -> ConversationManager:
+    now = utcnow()
+    conversations = {
+        str(1_000_000 + client): {
+            "operator_id": 1 + client % OPERATORS,
+            "client_name": f"client {client}",
+            "last_activity": now,
+        }
+        for client in range(CONVERSATIONS)
+    }
+    path = data_dir / "conversations.json"
+    path.write_text(json.dumps({"conversations": conversations}), encoding="utf-8")
+    return ConversationManager(JsonStore(path, {"conversations": {}}))
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        manager = build_manager(Path(tmp))
+    conversations = manager.conversation_snapshot()
+    operator_ids = list(range(1, OPERATORS + 1))
+
+    def pick_with_scan() -> None:
+        min(
+            (len(scan_clients_for_operator(conversations, op)), op)
+            for op in operator_ids
+        )
+
+    def pick_with_index() -> None:
+        min((manager.client_count(op), op) for op in operator_ids)
+
+    def lookup_with_scan() -> None:
+        scan_clients_for_operator(conversations, operator_ids[0])
+
+    def lookup_with_index() -> None:
+        manager.get_clients_for_operator(operator_ids[0])
+
+    print(f"{OPERATORS} operators, {CONVERSATIONS} conversations")
+    for label, scan, indexed, number in (
+        ("least-loaded pick", pick_with_scan, pick_with_index, 3),
+        ("clients for operator", lookup_with_scan, lookup_with_index, 50),
+    ):
+        scan_seconds = min(timeit.repeat(scan, number=number, repeat=3)) / number
+        index_seconds = min(timeit.repeat(indexed, number=number, repeat=3)) / number
+        print(
+            f"{label:>22}: scan {scan_seconds * 1000:10.3f} ms, "
+            f"index {index_seconds * 1000:8.3f} ms, "
+            f"x{scan_seconds / index_seconds:,.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Per-update overhead of operator lookups: the previous dict round-trip through
+``Operator.from_dict`` against the live objects kept by OperatorManager.
+
+    python -m benchmarks.bench_operator_registry
+"""
+import tempfile
+import timeit
+from pathlib import Path
+from typing import Dict, List
+
+from src.managers import Operator, OperatorManager, OperatorStatus
+from src.storage import JournalStore
+
+OPERATORS = 200
+UPDATES = 20_000
+
+
+def display_name_via_dicts(state: Dict[str, Dict], chat_id: int) -> str:
+    operator = Operator.from_dict(state[str(chat_id)])
+    return operator.display_name or operator.username or str(chat_id)
+
+
+def available_via_dicts(state: Dict[str, Dict]) -> List[int]:
+    return [
+        op.chat_id
+        for op in (Operator.from_dict(payload) for payload in state.values())
+        if op.status == OperatorStatus.AVAILABLE
+    ]
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        store = JournalStore(Path(tmp) / "operators.json", {"operators": {}})
+        manager = OperatorManager(store)
+        for chat_id in range(1, OPERATORS + 1):
+            manager.upsert_operator(chat_id, f"op{chat_id}", f"Operator {chat_id}")
+            if chat_id % 3:
+                manager.set_status(chat_id, OperatorStatus.BUSY)
+        state = {
+            str(operator.chat_id): operator.to_dict() for operator in manager.list_operators()
+        }
+
+        # What route_message -> operator_message -> relay costs per update.
+        def update_via_dicts() -> None:
+            for chat_id in range(1, UPDATES + 1):
+                op_id = 1 + chat_id % OPERATORS
+                if str(op_id) in state:
+                    Operator.from_dict(state[str(op_id)])
+                    display_name_via_dicts(state, op_id)
+
+        def update_via_registry() -> None:
+            for chat_id in range(1, UPDATES + 1):
+                op_id = 1 + chat_id % OPERATORS
+                if manager.is_operator(op_id):
+                    operator = manager.get_operator(op_id)
+                    operator.display_name or operator.username
+
+        def available_via_registry() -> None:
+            manager.available_operator_ids()
+
+        before = min(timeit.repeat(update_via_dicts, number=1, repeat=5)) / UPDATES
+        after = min(timeit.repeat(update_via_registry, number=1, repeat=5)) / UPDATES
+        print(f"per update: dicts {before * 1e6:.2f} us, registry {after * 1e6:.2f} us")
+
+        before = min(timeit.repeat(lambda: available_via_dicts(state), number=100, repeat=5)) / 100
+        after = min(timeit.repeat(available_via_registry, number=100, repeat=5)) / 100
+        print(
+            f"available ids ({OPERATORS} operators): dicts {before * 1e6:.1f} us, "
+            f"registry {after * 1e6:.1f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Time picking an operator by skill tags through the scheduler's inverted index against a
+scan over every available operator.
+
+    python -m benchmarks.bench_skill_routing
+"""
+import random
+import timeit
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from src.scheduler import SkillIndex
+
+OPERATORS = 500
+LANGUAGES = [f"lang{index}" for index in range(8)]
+PRODUCTS = [f"product{index}" for index in range(40)]
+TIERS = ["vip", "business"]
+QUERIES = 1_000
+
+
+def scan(
+    operators: Dict[int, Tuple[Sequence[str], Tuple[int, str]]], tags: Sequence[str]
+) -> Optional[int]:
+    wanted = set(tags)
+    matched = [op for op, (skills, _) in operators.items() if wanted.issubset(skills)]
+    if not matched:
+        return None
+    return min(matched, key=lambda op: (operators[op][1], op))
+
+
+def main() -> None:
+    rng = random.Random(1)
+    index = SkillIndex()
+    operators: Dict[int, Tuple[Sequence[str], Tuple[int, str]]] = {}
+    for chat_id in range(1, OPERATORS + 1):
+        skills = rng.sample(LANGUAGES, 2) + rng.sample(PRODUCTS, 6)
+        if rng.random() < 0.2:
+            skills.append(rng.choice(TIERS))
+        key = (rng.randrange(5), f"2026-01-01T00:00:{chat_id % 60:02d}+00:00")
+        operators[chat_id] = (skills, key)
+        index.update(chat_id, skills, *key)
+
+    queries: List[List[str]] = []
+    for _ in range(QUERIES):
+        tags = [rng.choice(LANGUAGES), rng.choice(PRODUCTS)]
+        if rng.random() < 0.2:
+            tags.append(rng.choice(TIERS))
+        queries.append(tags)
+    for tags in queries:
+        expected = scan(operators, tags)
+        assert expected is None or index.best(tags) == expected
+
+    tag_count = len(LANGUAGES) + len(PRODUCTS) + len(TIERS)
+    print(f"{OPERATORS} available operators, {tag_count} tags, {QUERIES} queries of 2-3 tags")
+    for name, pick in (("index", index.best), ("scan", lambda tags: scan(operators, tags))):
+        seconds = min(
+            timeit.repeat(lambda: [pick(tags) for tags in queries], number=1, repeat=5)
+        )
+        print(f"{name:>5}: {seconds / QUERIES * 1e6:8.1f} us per pick")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Compare the JSON state file with the binary snapshot at 100k conversations: file size,
+write time, load time and ConversationManager startup (load plus building its indexes).
+
+    python -m benchmarks.bench_snapshot
+"""
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict
+
+from src.managers import ConversationManager
+from src.snapshot import BinaryStore
+from src.storage import JsonStore
+
+CONVERSATIONS = 100_000
+REPEAT = 5
+
+
+def build_payload(now: datetime) -> Dict[str, Dict]:
+    return {
+        "conversations": {
+            str(1_000_000 + client): {
+                "operator_id": 1 + client % 200,
+                "client_name": f"client {client}",
+                "last_activity": (now - timedelta(seconds=client % 86400)).isoformat(),
+            }
+            for client in range(CONVERSATIONS)
+        }
+    }
+
+
+def best_of(action: Callable[[], object]) -> float:
+    timings = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        action()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main() -> None:
+    payload = build_payload(datetime.now(timezone.utc))
+    with tempfile.TemporaryDirectory() as tmp:
+        stores = {
+            "json": JsonStore(Path(tmp) / "conversations.json", {"conversations": {}}),
+            "binary": BinaryStore(Path(tmp) / "conversations.snap", {"conversations": {}}),
+        }
+        print(f"{CONVERSATIONS:,} conversations, best of {REPEAT}")
+        for name, store in stores.items():
+            write = best_of(lambda: store.persist(payload))
+            assert store.load() == payload
+            load = best_of(store.load)
+            startup = best_of(lambda: ConversationManager(store))
+            print(
+                f"{name:>6}: {store.path.stat().st_size / 1e6:6.2f} MB, "
+                f"write {write * 1000:6.1f} ms, load {load * 1000:6.1f} ms, "
+                f"manager startup {startup * 1000:6.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+In-process stand-ins for the Bot API that record every call and can inject latency
+and RetryAfter errors.
+"""
+import asyncio
+import itertools
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram.error import RetryAfter
+from telegram.request import BaseRequest, RequestData
+
+
+@dataclass
+class FakeMessage:
+    message_id: int
+    chat_id: int
+
+
+@dataclass
+class RecordedCall:
+    method: str
+    kwargs: Dict[str, Any]
+    at: float = field(default_factory=time.monotonic)
+
+
+class FakeBot:
+    def __init__(self, latency: float = 0.0, retry_after_every: int = 0, retry_after: int = 1):
+        self.latency = latency
+        self.retry_after_every = retry_after_every
+        self.retry_after = retry_after
+        self.calls: List[RecordedCall] = []
+        self.flood_errors = 0
+        self._attempts = 0
+        self._message_ids = itertools.count(1)
+
+    async def _call(self, method: str, **kwargs: Any) -> FakeMessage:
+        self._attempts += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.retry_after_every and self._attempts % self.retry_after_every == 0:
+            self.flood_errors += 1
+            raise RetryAfter(self.retry_after)
+        self.calls.append(RecordedCall(method, kwargs))
+        return FakeMessage(next(self._message_ids), kwargs.get("chat_id", 0))
+
+    async def send_message(self, **kwargs: Any) -> FakeMessage:
+        return await self._call("send_message", **kwargs)
+
+    async def copy_message(self, **kwargs: Any) -> FakeMessage:
+        return await self._call("copy_message", **kwargs)
+
+    async def copy_messages(self, **kwargs: Any) -> List[FakeMessage]:
+        message = await self._call("copy_messages", **kwargs)
+        return [message] + [
+            FakeMessage(next(self._message_ids), message.chat_id)
+            for _ in kwargs["message_ids"][1:]
+        ]
+
+    def calls_to(self, chat_id: int) -> List[RecordedCall]:
+        return [call for call in self.calls if call.kwargs.get("chat_id") == chat_id]
+
+
+FAKE_BOT_USER = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "Fake",
+    "username": "fake_bot",
+    "can_join_groups": False,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+
+class FakeRequest(BaseRequest):
+    """Answers Bot API requests in-process: ``ApplicationBuilder().request(FakeRequest())``."""
+
+    def __init__(self, latency: float = 0.0, retry_after_every: int = 0, retry_after: int = 1):
+        self.latency = latency
+        self.retry_after_every = retry_after_every
+        self.retry_after = retry_after
+        self.calls: List[RecordedCall] = []
+        self.flood_errors = 0
+        self._attempts = 0
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def count(self, method: str) -> int:
+        return sum(1 for call in self.calls if call.method == method)
+
+    def _result(self, method: str, parameters: Dict[str, Any]) -> Any:
+        if method == "getMe":
+            return FAKE_BOT_USER
+        if method == "getUpdates":
+            return []
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method == "copyMessages":
+            return [{"message_id": next(self._message_ids)} for _ in parameters["message_ids"]]
+        if method.startswith("send"):
+            return {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(parameters.get("chat_id", 0)), "type": "private"},
+                "from": FAKE_BOT_USER,
+                "text": parameters.get("text", ""),
+            }
+        return True
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout: Any = None,
+        write_timeout: Any = None,
+        connect_timeout: Any = None,
+        pool_timeout: Any = None,
+    ) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        if api_method not in ("getMe", "getUpdates"):
+            self._attempts += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self.retry_after_every and self._attempts % self.retry_after_every == 0:
+                self.flood_errors += 1
+                body = {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }
+                return 429, json.dumps(body).encode()
+            self.calls.append(RecordedCall(api_method, parameters))
+        body = {"ok": True, "result": self._result(api_method, parameters)}
+        return 200, json.dumps(body).encode()
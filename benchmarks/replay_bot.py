@@ -0,0 +1,243 @@
+"""
+Drive the real handlers with a synthetic update stream against an in-process fake Bot API
+and report throughput, handling latency and disk writes.
+
+    python -m benchmarks.replay_bot --operators 20 --clients 500 --updates 5000
+    python -m benchmarks.replay_bot --storage sqlite --rate 300 --latency 0.02 --retry-after-every 200
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import TypeHandler
+
+from src.bot import BotServices, create_application, get_services
+
+from .fake_bot import FakeRequest
+
+SECRET = "bench-secret"
+DEFAULT_MIX = "client=70,reply=15,operator=5,status=5,end=5"
+
+
+def parse_mix(raw: str) -> Dict[str, int]:
+    mix = {}
+    for part in raw.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = int(weight)
+    unknown = set(mix) - {"client", "reply", "operator", "status", "end"}
+    if unknown:
+        raise SystemExit(f"Unknown event kinds in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def io_bytes_written() -> Optional[int]:
+    """Bytes this process passed to write(2), from /proc on Linux."""
+    try:
+        with open("/proc/self/io", encoding="ascii") as handle:
+            for line in handle:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def directory_size(path: Path) -> int:
+    return sum(item.stat().st_size for item in path.rglob("*") if item.is_file())
+
+
+class UpdateFactory:
+    def __init__(self, bot) -> None:
+        self._bot = bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def message(self, chat_id: int, name: str, text: str) -> Update:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": name},
+            "from": {"id": chat_id, "is_bot": False, "first_name": name},
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split(" ", 1)[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return Update.de_json({"update_id": next(self._update_ids), "message": message}, self._bot)
+
+
+class Workload:
+    """Picks the next event from the mix, looking at live state for operator commands."""
+
+    def __init__(self, services: BotServices, factory: UpdateFactory, args: argparse.Namespace):
+        self._services = services
+        self._factory = factory
+        self._random = random.Random(args.seed)
+        self._operators = list(range(1, args.operators + 1))
+        self._clients = list(range(100_000, 100_000 + args.clients))
+        mix = parse_mix(args.mix)
+        self._kinds = list(mix)
+        self._weights = list(mix.values())
+
+    def registrations(self) -> List[Update]:
+        return [
+            self._factory.message(chat_id, f"Operator {chat_id}", f"/register {SECRET}")
+            for chat_id in self._operators
+        ]
+
+    def next_update(self) -> Update:
+        kind = self._random.choices(self._kinds, self._weights)[0]
+        if kind == "client":
+            client_id = self._random.choice(self._clients)
+            return self._factory.message(client_id, f"Client {client_id}", "Где мой заказ?")
+        operator_id = self._random.choice(self._operators)
+        name = f"Operator {operator_id}"
+        clients = self._services.conversation_manager.get_clients_for_operator(operator_id)
+        if kind == "reply" and clients:
+            client_id = self._random.choice(clients)
+            return self._factory.message(operator_id, name, f"/reply {client_id} Уже в пути")
+        if kind == "end" and clients:
+            return self._factory.message(operator_id, name, f"/end {self._random.choice(clients)}")
+        if kind == "operator":
+            return self._factory.message(operator_id, name, "Проверяю, минуту")
+        return self._factory.message(operator_id, name, self._random.choice(["/status", "/clients"]))
+
+
+def configure_environment(args: argparse.Namespace, data_dir: Path) -> None:
+    os.environ.update(
+        {
+            "TELEGRAM_BOT_TOKEN": "1:offline-benchmark",
+            "OPERATOR_SECRET": SECRET,
+            "DATA_DIR": str(data_dir),
+            "STORAGE_MODE": args.storage,
+            "CONCURRENT_UPDATES": str(args.concurrent),
+            # The fake API has no flood limits; pace like Telegram only when asked to.
+            "OUTBOUND_GLOBAL_RATE": str(args.global_rate),
+            "OUTBOUND_CHAT_RATE": str(args.chat_rate),
+            "OUTBOUND_CHAT_BURST": str(max(args.chat_rate, 1.0)),
+            "WEBHOOK_URL": "",
+            "METRICS_PORT": "0",
+        }
+    )
+
+
+async def run(args: argparse.Namespace, data_dir: Path) -> None:
+    configure_environment(args, data_dir)
+    request = FakeRequest(
+        latency=args.latency,
+        retry_after_every=args.retry_after_every,
+        retry_after=args.retry_after,
+    )
+    application = create_application(request=request)
+
+    submitted: Dict[int, float] = {}
+    latencies: List[float] = []
+    finished = asyncio.Event()
+    errors: Counter = Counter()
+
+    async def record_done(update: Update, _context) -> None:
+        latencies.append(time.perf_counter() - submitted.pop(update.update_id))
+        if not submitted and done_submitting:
+            finished.set()
+
+    async def record_error(_update, context) -> None:
+        errors[type(context.error).__name__] += 1
+
+    application.add_handler(TypeHandler(Update, record_done), group=1000)
+    application.add_error_handler(record_error)
+
+    factory = UpdateFactory(application.bot)
+    workload = Workload(get_services(application), factory, args)
+    done_submitting = False
+    written_before = io_bytes_written()
+
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    started = time.perf_counter()
+    stream = itertools.chain(
+        workload.registrations(), (workload.next_update() for _ in range(args.updates))
+    )
+    total = 0
+    for index, update in enumerate(stream):
+        if args.rate:
+            delay = started + index / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        submitted[update.update_id] = time.perf_counter()
+        await application.update_queue.put(update)
+        total += 1
+        if index % 100 == 0:
+            await asyncio.sleep(0)  # let handlers see state before picking operator commands
+    done_submitting = True
+    if submitted:
+        await asyncio.wait_for(finished.wait(), timeout=args.timeout)
+    elapsed = time.perf_counter() - started
+
+    await application.stop()
+    await application.post_stop(application)
+    await application.shutdown()
+    await application.post_shutdown(application)
+    written_after = io_bytes_written()
+
+    latencies.sort()
+    print(
+        f"{total} updates ({args.operators} operators, {args.clients} clients, "
+        f"storage={args.storage}) in {elapsed:.2f} s: {total / elapsed:.0f} updates/s"
+    )
+    print(
+        f"handling latency p50 {statistics.median(latencies) * 1000:.2f} ms, "
+        f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f} ms, "
+        f"max {latencies[-1] * 1000:.2f} ms"
+    )
+    # Replies sent straight through reply_text bypass the outbound sender, so an injected
+    # RetryAfter surfaces here as a handler error.
+    print(
+        "handler errors: "
+        + (", ".join(f"{name} {count}" for name, count in errors.most_common()) or "none")
+    )
+    methods = sorted({call.method for call in request.calls})
+    print(
+        "Bot API calls: "
+        + ", ".join(f"{method} {request.count(method)}" for method in methods)
+        + f"; injected flood errors {request.flood_errors}"
+    )
+    if written_before is not None and written_after is not None:
+        print(f"bytes written: {written_after - written_before:,}", end="; ")
+    print(f"data dir size: {directory_size(data_dir):,} bytes")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--operators", type=int, default=20)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--updates", type=int, default=5000, help="events after registration")
+    parser.add_argument("--rate", type=float, default=0, help="updates/s, 0 = as fast as possible")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="event weights, e.g. " + DEFAULT_MIX)
+    parser.add_argument(
+        "--storage", choices=["json", "journal", "binary", "sqlite"], default="json"
+    )
+    parser.add_argument("--concurrent", type=int, default=32, help="CONCURRENT_UPDATES")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake API latency, seconds")
+    parser.add_argument("--retry-after-every", type=int, default=0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--global-rate", type=float, default=100_000)
+    parser.add_argument("--chat-rate", type=float, default=100_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(args, Path(tmp)))
+
+
+if __name__ == "__main__":
+    main()
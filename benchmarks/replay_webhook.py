@@ -0,0 +1,91 @@
+"""
+POST recorded updates (one JSON update per line) to a webhook server and report latency.
+
+    python -m benchmarks.replay_webhook updates.jsonl --url http://127.0.0.1:8080/telegram
+    python -m benchmarks.replay_webhook --local --count 2000
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Dict, List, Optional
+
+import httpx
+from telegram.ext import ApplicationBuilder
+
+from src.webhook import SECRET_HEADER, WebhookServer
+
+
+def synthetic_updates(count: int) -> List[Dict]:
+    now = int(time.time())
+    return [
+        {
+            "update_id": index,
+            "message": {
+                "message_id": index,
+                "date": now,
+                "chat": {"id": 1000 + index % 50, "type": "private"},
+                "from": {"id": 1000 + index % 50, "is_bot": False, "first_name": "Client"},
+                "text": f"message {index}",
+            },
+        }
+        for index in range(1, count + 1)
+    ]
+
+
+def load_updates(path: Optional[str], count: int) -> List[Dict]:
+    if not path:
+        return synthetic_updates(count)
+    with open(path, encoding="utf-8") as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+async def replay(url: str, updates: List[Dict], secret: str) -> List[float]:
+    headers = {SECRET_HEADER: secret} if secret else {}
+    latencies = []
+    async with httpx.AsyncClient() as client:
+        for update in updates:
+            started = time.perf_counter()
+            response = await client.post(url, json=update, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+    return latencies
+
+
+async def run(args: argparse.Namespace) -> None:
+    updates = load_updates(args.updates, args.count)
+    server = None
+    url = args.url
+    if args.local:
+        application = ApplicationBuilder().token("1:local").build()
+        server = WebhookServer(application, port=0, secret_token=args.secret)
+        await server.start()
+        url = f"http://127.0.0.1:{server.port}/telegram"
+    started = time.perf_counter()
+    latencies = await replay(url, updates, args.secret)
+    elapsed = time.perf_counter() - started
+    if server is not None:
+        await server.stop()
+        queued = application.update_queue.qsize()
+        assert queued == len(updates), f"{queued} of {len(updates)} updates reached the queue"
+    latencies.sort()
+    print(f"{len(updates)} updates in {elapsed:.2f} s ({len(updates) / elapsed:.0f}/s)")
+    print(
+        f"latency p50 {statistics.median(latencies) * 1000:.2f} ms, "
+        f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("updates", nargs="?", help="JSONL file with recorded updates")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/telegram")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--count", type=int, default=1000, help="synthetic updates to send")
+    parser.add_argument("--local", action="store_true", help="replay into an in-process server")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Several processes assign the same clients through one shared SQLite file and the result is
+checked for double assignments.
+
+    python -m benchmarks.shared_state --workers 4 --operators 200 --clients 1000
+"""
+import argparse
+import multiprocessing
+import random
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import List, Tuple
+
+from src.managers import ConversationManager, OperatorManager, OperatorStatus
+from src.scheduler import create_scheduler
+from src.sqlite_storage import SqliteStore
+
+
+def open_managers(db_path: Path) -> Tuple[SqliteStore, OperatorManager, ConversationManager]:
+    store = SqliteStore(db_path, shared=True)
+    return store, OperatorManager(store), ConversationManager(store)
+
+
+def worker(db_path: Path, clients: List[int], seed: int, start, results) -> None:
+    store, operators, conversations = open_managers(db_path)
+    scheduler = create_scheduler(operators, conversations)
+    order = clients[:]
+    random.Random(seed).shuffle(order)
+    assigned = []
+    start.wait()
+    for client_id in order:
+        operator_id, created = scheduler.assign(client_id, f"client {client_id}")
+        if created:
+            assigned.append((client_id, operator_id))
+    store.close()
+    results.put(assigned)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--operators", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "shared.sqlite3"
+        store, operators, _ = open_managers(db_path)
+        for chat_id in range(1, args.operators + 1):
+            operators.upsert_operator(chat_id, f"op{chat_id}", f"Operator {chat_id}")
+            operators.set_status(chat_id, OperatorStatus.AVAILABLE)
+        store.close()
+
+        context = multiprocessing.get_context("spawn")
+        start = context.Event()
+        results = context.Queue()
+        clients = list(range(10_000, 10_000 + args.clients))
+        processes = [
+            context.Process(target=worker, args=(db_path, clients, seed, start, results))
+            for seed in range(args.workers)
+        ]
+        for process in processes:
+            process.start()
+        started = time.perf_counter()
+        start.set()
+        assigned = [pair for _ in processes for pair in results.get()]
+        elapsed = time.perf_counter() - started
+        for process in processes:
+            process.join()
+
+        store, _, conversations = open_managers(db_path)
+        stored = conversations.conversation_snapshot()
+        store.close()
+
+    per_client = Counter(client_id for client_id, _ in assigned)
+    per_operator = Counter(record["operator_id"] for record in stored.values())
+    expected = min(args.operators, args.clients)
+    print(
+        f"{args.workers} workers, {len(assigned)} assignments in {elapsed:.2f} s "
+        f"({args.workers * args.clients / elapsed:.0f} attempts/s)"
+    )
+    assert len(assigned) == expected, f"expected {expected} assignments, got {len(assigned)}"
+    assert max(per_client.values()) == 1, "a client was assigned twice"
+    assert max(per_operator.values()) == 1, "an operator got two clients"
+    assert {str(client_id) for client_id in per_client} == set(stored), "store disagrees"
+    print("OK: every client assigned once, no operator double-booked")
+
+
+if __name__ == "__main__":
+    main()
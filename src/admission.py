@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import statistics
+import time
+from collections import deque
+from enum import Enum
+from typing import Deque, Dict, Optional, Tuple
+
+from .metrics import ADMISSION_LEVEL, RESPONSE_SECONDS
+
+
+class AdmissionLevel(str, Enum):
+    NORMAL = "normal"
+    ELEVATED = "elevated"
+    OVERLOADED = "overloaded"
+
+
+LEVEL_VALUES = {AdmissionLevel.NORMAL: 0, AdmissionLevel.ELEVATED: 1, AdmissionLevel.OVERLOADED: 2}
+
+
+class AdmissionController:
+    """Grades the load from queue length and reply latency, with hysteresis on the way down."""
+
+    def __init__(
+        self,
+        backlog_soft: int = 0,
+        backlog_hard: int = 0,
+        latency_soft: float = 0.0,
+        latency_hard: float = 0.0,
+        samples: int = 50,
+        recovery: float = 0.8,
+    ):
+        self._backlog = (backlog_soft, backlog_hard)
+        self._latency = (latency_soft, latency_hard)
+        self._recovery = recovery
+        self._unanswered: Dict[int, float] = {}
+        self._recent: Deque[float] = deque(maxlen=samples)
+        self._stale_after = 3 * (latency_hard or latency_soft or 1200.0)
+        self.level = AdmissionLevel.NORMAL
+        self.backlog = 0
+        self.latency: Optional[float] = None
+
+    def client_waiting(self, client_chat_id: int) -> None:
+        """The client wrote; the clock runs from its first message since the last reply."""
+        self._unanswered.setdefault(client_chat_id, time.monotonic())
+
+    def operator_replied(self, client_chat_id: int) -> None:
+        since = self._unanswered.pop(client_chat_id, None)
+        if since is not None:
+            seconds = time.monotonic() - since
+            self._recent.append(seconds)
+            RESPONSE_SECONDS.observe(seconds)
+
+    def forget(self, client_chat_id: int) -> None:
+        self._unanswered.pop(client_chat_id, None)
+
+    def response_latency(self) -> Optional[float]:
+        now = time.monotonic()
+        values = list(self._recent)
+        stale = []
+        for client_chat_id, since in self._unanswered.items():
+            if now - since > self._stale_after:
+                stale.append(client_chat_id)
+            else:
+                values.append(now - since)
+        for client_chat_id in stale:
+            del self._unanswered[client_chat_id]
+        return statistics.median(values) if values else None
+
+    def _grade(self, value: float, thresholds: Tuple[float, float], scale: float) -> int:
+        soft, hard = thresholds
+        if hard and value >= hard * scale:
+            return 2
+        if soft and value >= soft * scale:
+            return 1
+        return 0
+
+    def evaluate(self, backlog: int) -> bool:
+        """Recompute the level from the current backlog; returns whether it changed."""
+        self.backlog = backlog
+        self.latency = self.response_latency()
+        latency = self.latency or 0.0
+        grade = max(
+            self._grade(backlog, self._backlog, 1.0), self._grade(latency, self._latency, 1.0)
+        )
+        current = LEVEL_VALUES[self.level]
+        if grade < current:
+            # Step down only as far as the signals allow with the recovery margin.
+            held = max(
+                self._grade(backlog, self._backlog, self._recovery),
+                self._grade(latency, self._latency, self._recovery),
+            )
+            grade = max(grade, min(held, current))
+        level = next(level for level, value in LEVEL_VALUES.items() if value == grade)
+        changed = level != self.level
+        self.level = level
+        ADMISSION_LEVEL.set(grade)
+        return changed
+
+    @property
+    def elevated(self) -> bool:
+        return self.level != AdmissionLevel.NORMAL
+
+    @property
+    def overloaded(self) -> bool:
+        return self.level == AdmissionLevel.OVERLOADED
+
+
+__all__ = ["AdmissionController", "AdmissionLevel"]
@@ -1,7 +1,12 @@
+import asyncio
 import logging
-from typing import Optional
+import signal
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
-from telegram import Update
+from telegram import Message, Update
+from telegram.constants import MessageLimit
 from telegram.error import TelegramError
 from telegram.ext import (
     Application,
@@ -9,13 +14,38 @@ from telegram.ext import (
     CommandHandler,
     ContextTypes,
     MessageHandler,
+    TypeHandler,
     filters,
 )
+from telegram.request import BaseRequest
 
 try:  # normal package import when running via `python -m src.bot`
-    from .config import settings
+    from .admission import AdmissionController
+    from .broadcast import AUDIENCES, Broadcast, BroadcastManager
+    from .concurrency import ChatOrderedUpdateProcessor
+    from .config import Settings, load_settings
     from .managers import ConversationManager, OperatorManager, OperatorStatus
-    from .storage import JsonStore
+    from .metrics import (
+        ADMISSION_DECISIONS,
+        ASSIGNMENT_WAIT_SECONDS,
+        HANDLER_ERRORS,
+        HANDLER_SECONDS,
+        OPERATOR_CONVERSATIONS,
+        QUEUE_DEPTH,
+        MetricsServer,
+    )
+    from .migrate import has_json_state, migrate_json_to_sqlite
+    from .outbound import OutboundSender
+    from .profiling import Profiler
+    from .relay import Relay
+    from .routing import KeywordRules, normalize_tags, tags_from_start_payload
+    from .scheduler import create_scheduler
+    from .snapshot import BinaryStore, import_json_state
+    from .sqlite_storage import SqliteStore
+    from .storage import StateStore, StoreWriter, create_store
+    from .transcripts import TranscriptLog
+    from .waiting import WaitingQueue
+    from .webhook import WebhookServer, run_webhook
 except ImportError:  # fallback for `python src/bot.py`
     import sys
     from pathlib import Path
@@ -26,63 +56,571 @@ except ImportError:  # fallback for `python src/bot.py`
     if str(PACKAGE_DIR.parent) not in sys.path:
         sys.path.append(str(PACKAGE_DIR.parent))
 
-    from config import settings  # type: ignore
+    from admission import AdmissionController  # type: ignore
+    from broadcast import AUDIENCES, Broadcast, BroadcastManager  # type: ignore
+    from concurrency import ChatOrderedUpdateProcessor  # type: ignore
+    from config import Settings, load_settings  # type: ignore
     from managers import ConversationManager, OperatorManager, OperatorStatus  # type: ignore
-    from storage import JsonStore  # type: ignore
+    from metrics import (  # type: ignore
+        ADMISSION_DECISIONS,
+        ASSIGNMENT_WAIT_SECONDS,
+        HANDLER_ERRORS,
+        HANDLER_SECONDS,
+        OPERATOR_CONVERSATIONS,
+        QUEUE_DEPTH,
+        MetricsServer,
+    )
+    from migrate import has_json_state, migrate_json_to_sqlite  # type: ignore
+    from outbound import OutboundSender  # type: ignore
+    from profiling import Profiler  # type: ignore
+    from relay import Relay  # type: ignore
+    from routing import KeywordRules, normalize_tags, tags_from_start_payload  # type: ignore
+    from scheduler import create_scheduler  # type: ignore
+    from snapshot import BinaryStore, import_json_state  # type: ignore
+    from sqlite_storage import SqliteStore  # type: ignore
+    from storage import StateStore, StoreWriter, create_store  # type: ignore
+    from transcripts import TranscriptLog  # type: ignore
+    from waiting import WaitingQueue  # type: ignore
+    from webhook import WebhookServer, run_webhook  # type: ignore
 
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
 logger = logging.getLogger(__name__)
 
-operators_store = JsonStore(
-    settings.data_dir / "operators.json",
-    {"operators": {}},
-)
-conversations_store = JsonStore(
-    settings.data_dir / "conversations.json",
-    {"conversations": {}},
-)
-operator_manager = OperatorManager(operators_store, settings.operators_allowlist)
-conversation_manager = ConversationManager(conversations_store)
+SERVICES_KEY = "services"
+# Clients who opened a deep link but have not written yet; the oldest are forgotten first.
+PENDING_TAGS_LIMIT = 10_000
 
 
-def operator_display_name(chat_id: int) -> str:
-    try:
-        operator = operator_manager.get_operator(chat_id)
-    except KeyError:
-        return str(chat_id)
-    return operator.display_name or operator.username or str(chat_id)
+def assignment_notice(client_chat_id: int, client_name: str) -> str:
+    return (
+        f"🆕 Новый клиент {client_name} ({client_chat_id}). "
+        f"Команда /focus {client_chat_id} или /reply {client_chat_id} <текст>."
+    )
 
 
-def pick_operator_for_new_client() -> Optional[int]:
-    candidates = []
-    for operator in operator_manager.list_operators():
-        if operator.status != OperatorStatus.AVAILABLE:
-            continue
-        load = len(conversation_manager.get_clients_for_operator(operator.chat_id))
-        candidates.append((load, operator.updated_at, operator.chat_id))
-    if not candidates:
+class BotServices:
+    """Stores, managers and senders of one bot instance, kept in ``bot_data``."""
+
+    def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+        settings.data_dir.mkdir(parents=True, exist_ok=True)
+        # A shared store is written synchronously so that other processes see every change.
+        self.store_writer = (
+            StoreWriter() if settings.async_writes and not settings.shared_state else None
+        )
+        operators_store, conversations_store, waiting_store = self._open_stores()
+        self.operator_manager = OperatorManager(
+            operators_store,
+            settings.operators_allowlist,
+            last_seen_persist_interval=settings.operator_presence_interval,
+        )
+        self.conversation_manager = ConversationManager(
+            conversations_store,
+            activity_flush_interval=settings.activity_flush_interval,
+            activity_flush_batch=settings.activity_flush_batch,
+        )
+        self.operator_scheduler = create_scheduler(
+            self.operator_manager,
+            self.conversation_manager,
+            policy=settings.scheduler_policy,
+            max_clients=settings.operator_max_clients,
+        )
+        self.waiting_queue = WaitingQueue(waiting_store)
+        self.routing_rules = KeywordRules(settings.routing_rules)
+        self.admission = AdmissionController(
+            backlog_soft=settings.admission_backlog_soft,
+            backlog_hard=settings.admission_backlog_hard,
+            latency_soft=settings.admission_latency_soft,
+            latency_hard=settings.admission_latency_hard,
+        )
+        # Assignment notices held back while the load is elevated, sent as one digest.
+        self.deferred_notices: Dict[int, List[Tuple[int, str]]] = {}
+        self.pending_tags: Dict[int, List[str]] = {}
+        self.outbound_sender = OutboundSender(
+            global_rate=settings.outbound_global_rate,
+            chat_rate=settings.outbound_chat_rate,
+            chat_burst=settings.outbound_chat_burst,
+            max_queue=settings.outbound_queue_size,
+        )
+        self.relay = Relay(
+            self.outbound_sender,
+            mode=settings.relay_mode,
+            burst_window=settings.relay_burst_window,
+            album_window=settings.relay_album_window,
+        )
+        self.metrics_server = (
+            MetricsServer(listen=settings.metrics_listen, port=settings.metrics_port)
+            if settings.metrics_port
+            else None
+        )
+        self.transcripts = (
+            TranscriptLog(settings.transcript_dir, settings.transcript_segment_bytes)
+            if settings.transcripts
+            else None
+        )
+        self.broadcasts = BroadcastManager(
+            self.outbound_sender,
+            settings.data_dir / "broadcasts",
+            concurrency=settings.broadcast_concurrency,
+            checkpoint_every=settings.broadcast_checkpoint_every,
+            writer=self.store_writer,
+        )
+        self.profiler = Profiler(settings.profile_dir, settings.profile_tracemalloc_frames)
+        self._profile_timer: Optional[asyncio.Task] = None
+
+    def _open_stores(self) -> Tuple[StateStore, StateStore, StateStore]:
+        settings = self.settings
+        if settings.storage_mode == "sqlite":
+            fresh = not settings.sqlite_path.exists()
+            store = SqliteStore(
+                settings.sqlite_path, writer=self.store_writer, shared=settings.shared_state
+            )
+            if fresh and has_json_state(settings.data_dir):
+                counts = migrate_json_to_sqlite(settings.data_dir, store)
+                logger.info("Migrated JSON state into %s: %s", settings.sqlite_path, counts)
+            return store, store, store
+        if settings.storage_mode == "binary":
+            counts = import_json_state(settings.data_dir)
+            if counts:
+                logger.info("Converted JSON state into binary snapshots: %s", counts)
+            operators, conversations, waiting = (
+                BinaryStore(
+                    settings.data_dir / f"{collection}.snap",
+                    {collection: {}},
+                    writer=self.store_writer,
+                )
+                for collection in ("operators", "conversations", "waiting")
+            )
+            return operators, conversations, waiting
+        operators, conversations, waiting = (
+            create_store(
+                settings.data_dir / f"{collection}.json",
+                {collection: {}},
+                mode=settings.storage_mode,
+                compact_after=settings.journal_compact_after,
+                writer=self.store_writer,
+            )
+            for collection in ("operators", "conversations", "waiting")
+        )
+        return operators, conversations, waiting
+
+    def operator_display_name(self, chat_id: int) -> str:
+        try:
+            operator = self.operator_manager.get_operator(chat_id)
+        except KeyError:
+            return str(chat_id)
+        return operator.display_name or operator.username or str(chat_id)
+
+    def record_message(self, client_id: int, role: str, message: Message) -> None:
+        if self.transcripts is not None:
+            self.transcripts.record_message(client_id, role, message)
+
+    def sync(self) -> None:
+        """Pick up what other workers wrote to a shared store."""
+        self.conversation_manager.sync()
+        self.operator_manager.sync()
+        self.waiting_queue.sync()
+
+    def release_conversation(self, operator_chat_id: int, client_id: int) -> None:
+        self.conversation_manager.release_client(client_id)
+        self.admission.forget(client_id)
+        if self.transcripts is not None:
+            self.transcripts.record(client_id, "system", operator_chat_id, None, "ended")
+        operator = self.operator_manager.get_operator(operator_chat_id)
+        if operator.active_client == client_id:
+            self.operator_manager.set_active_client(operator_chat_id, None)
+        if operator.status == OperatorStatus.OFFLINE:
+            return
+        if not self.conversation_manager.client_count(operator_chat_id):
+            self.operator_manager.set_status(operator_chat_id, OperatorStatus.AVAILABLE)
+        else:
+            self.operator_scheduler.reopen(operator_chat_id)
+
+    def remember_start_tags(self, client_chat_id: int, payload: str) -> None:
+        tags = tags_from_start_payload(payload)
+        if not tags:
+            return
+        self.pending_tags.pop(client_chat_id, None)
+        self.pending_tags[client_chat_id] = tags
+        while len(self.pending_tags) > PENDING_TAGS_LIMIT:
+            del self.pending_tags[next(iter(self.pending_tags))]
+
+    def client_tags(self, client_chat_id: int, message: Message) -> List[str]:
+        """Tags from the client's deep link plus the keyword rules that match ``message``."""
+        return normalize_tags(
+            self.pending_tags.pop(client_chat_id, [])
+            + self.routing_rules.tags_for(message.text or message.caption)
+        )
+
+    def assign_client(
+        self,
+        client_chat_id: int,
+        client_name: str,
+        tags: Sequence[str] = (),
+        message_id: Optional[int] = None,
+    ) -> Tuple[Optional[int], bool]:
+        # While anyone is waiting, new clients join the end of the queue instead of overtaking it.
+        with self.conversation_manager.transaction():
+            self.waiting_queue.sync()
+            if not self.waiting_queue:
+                operator_chat_id, created = self.operator_scheduler.assign(
+                    client_chat_id, client_name, tags
+                )
+                if operator_chat_id:
+                    if created:
+                        ASSIGNMENT_WAIT_SECONDS.observe(0.0)
+                    return operator_chat_id, created
+            self.waiting_queue.enqueue(
+                client_chat_id, client_name, tags=tags, message_id=message_id
+            )
+        return None, False
+
+    def assignment_message(
+        self, operator_chat_id: int, client_chat_id: int, client_name: str
+    ) -> Optional[Tuple[int, str]]:
+        """The new-client notice for the operator, or None if it joins the next digest."""
+        ADMISSION_DECISIONS.inc("assigned")
+        if not self.admission.elevated:
+            return operator_chat_id, assignment_notice(client_chat_id, client_name)
+        ADMISSION_DECISIONS.inc("notice_deferred")
+        self.deferred_notices.setdefault(operator_chat_id, []).append(
+            (client_chat_id, client_name)
+        )
         return None
-    candidates.sort()
-    return candidates[0][2]
+
+    async def review_admission(self) -> None:
+        """Re-grade the load, adjust the admission cap and send the deferred notices."""
+        admission = self.admission
+        if admission.evaluate(len(self.waiting_queue)):
+            latency = admission.latency
+            logger.warning(
+                "Admission level %s: %s waiting, response latency %s",
+                admission.level.value,
+                admission.backlog,
+                f"{latency:.0f} s" if latency is not None else "n/a",
+            )
+            self.operator_scheduler.set_admission_cap(
+                self.settings.admission_overload_max_clients if admission.overloaded else 0
+            )
+            if not admission.overloaded:
+                await self.dispatch_waiting_clients()
+        notices, self.deferred_notices = self.deferred_notices, {}
+        messages: List[Tuple[int, str]] = []
+        for operator_chat_id, clients in notices.items():
+            lines = [f"{name} ({client_chat_id})" for client_chat_id, name in clients]
+            messages.append(
+                (
+                    operator_chat_id,
+                    f"🆕 Новые клиенты ({len(clients)}):\n"
+                    + "\n".join(lines)
+                    + "\nСписок диалогов: /clients",
+                )
+            )
+        await self.send_batch(messages)
+
+    def waiting_text(self, position: int) -> str:
+        text = f"Все операторы заняты. Ваше место в очереди: {position}."
+        eta = self.waiting_queue.eta_seconds(position)
+        if eta is not None:
+            text += f" Примерное время ожидания: {max(1, round(eta / 60))} мин."
+        return text
+
+    async def send_batch(self, messages: List[Tuple[int, str]]) -> None:
+        """Queue all messages at once; the outbound sender paces them and failures are logged."""
+        results = await asyncio.gather(
+            *(
+                self.outbound_sender.send_message(chat_id=chat_id, text=text)
+                for chat_id, text in messages
+            ),
+            return_exceptions=True,
+        )
+        for (chat_id, _), result in zip(messages, results):
+            if isinstance(result, Exception):
+                logger.warning("Failed to notify %s: %s", chat_id, result)
+
+    async def dispatch_waiting_clients(self) -> None:
+        """Hand up to ``WAITING_DISPATCH_BATCH`` waiting clients to free operators."""
+        waiting_queue = self.waiting_queue
+        assigned = []
+        with self.conversation_manager.transaction():
+            waiting_queue.sync()
+            while waiting_queue and len(assigned) < self.settings.waiting_dispatch_batch:
+                client_chat_id, client_name = waiting_queue.head()
+                operator_chat_id, created = self.operator_scheduler.assign(
+                    client_chat_id, client_name, waiting_queue.tags(client_chat_id)
+                )
+                if not operator_chat_id:
+                    break
+                record = waiting_queue.remove(client_chat_id)
+                if created:
+                    assigned.append(
+                        (
+                            operator_chat_id,
+                            client_chat_id,
+                            client_name,
+                            record.get("message_ids") or [],
+                        )
+                    )
+                    enqueued_at = datetime.fromisoformat(record["enqueued_at"])
+                    waited = datetime.now(timezone.utc) - enqueued_at
+                    ASSIGNMENT_WAIT_SECONDS.observe(waited.total_seconds())
+            updates = waiting_queue.position_updates() if assigned else []
+        messages: List[Tuple[int, str]] = []
+        for operator_chat_id, client_chat_id, client_name, _ in assigned:
+            notice = self.assignment_message(operator_chat_id, client_chat_id, client_name)
+            if notice is not None:
+                messages.append(notice)
+            messages.append((client_chat_id, "Мы подключили оператора, ожидайте ответа."))
+        messages.extend((chat_id, self.waiting_text(position)) for chat_id, position in updates)
+        await self.send_batch(messages)
+        # What the clients wrote while waiting goes after the notices, in order.
+        await asyncio.gather(
+            *(
+                self.relay_waiting_messages(operator_chat_id, client_chat_id, client_name, ids)
+                for operator_chat_id, client_chat_id, client_name, ids in assigned
+                if ids
+            )
+        )
+
+    async def relay_waiting_messages(
+        self,
+        operator_chat_id: int,
+        client_chat_id: int,
+        client_name: str,
+        message_ids: List[int],
+    ) -> None:
+        failures: List[Exception] = []
+
+        async def report_failure(error: Exception) -> None:
+            failures.append(error)
+
+        await self.relay.relay_messages(
+            client_chat_id, operator_chat_id, message_ids, f"📨 {client_name}", report_failure
+        )
+        if not failures:
+            self.admission.client_waiting(client_chat_id)
+
+    async def reap_idle_conversations(self) -> None:
+        settings = self.settings
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.conversation_idle_ttl)
+        released: Dict[int, List[int]] = {}
+        with self.conversation_manager.transaction():
+            self.operator_manager.sync()
+            idle = self.conversation_manager.idle_clients(
+                cutoff.isoformat(), settings.reaper_batch
+            )
+            for client_id in idle:
+                record = self.conversation_manager.get_client_record(client_id)
+                if not record:
+                    continue
+                operator_chat_id = int(record["operator_id"])
+                self.release_conversation(operator_chat_id, client_id)
+                released.setdefault(operator_chat_id, []).append(client_id)
+        if not released:
+            return
+        logger.info(
+            "Released %s idle conversations", sum(len(clients) for clients in released.values())
+        )
+        messages: List[Tuple[int, str]] = [
+            (
+                operator_chat_id,
+                "⏱ Закрыты диалоги без активности: " + ", ".join(map(str, clients)),
+            )
+            for operator_chat_id, clients in released.items()
+        ]
+        messages.extend(
+            (
+                client_id,
+                "Диалог закрыт из-за отсутствия активности. Напишите нам снова, если нужна помощь.",
+            )
+            for clients in released.values()
+            for client_id in clients
+        )
+        await self.send_batch(messages)
+        await self.dispatch_waiting_clients()
+
+    async def mark_quiet_operators(self) -> None:
+        """Put the unanswered clients of quiet operators back at the front of the queue."""
+        settings = self.settings
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.operator_idle_timeout)
+        offline = settings.operator_idle_status == "offline"
+        idle_status = OperatorStatus.OFFLINE if offline else OperatorStatus.BUSY
+        handed_over: Dict[int, List[int]] = {}
+        with self.conversation_manager.transaction():
+            self.operator_manager.sync()
+            self.waiting_queue.sync()
+            for operator_chat_id in self.operator_manager.quiet_operators(cutoff.isoformat()):
+                operator = self.operator_manager.get_operator(operator_chat_id)
+                records: Dict[int, Dict] = {}
+                for client_id in self.conversation_manager.get_clients_for_operator(
+                    operator_chat_id
+                ):
+                    record = self.conversation_manager.get_client_record(client_id)
+                    if record:
+                        records[client_id] = record
+                unanswered = [
+                    client_id
+                    for client_id, record in records.items()
+                    if record.get("last_activity", "") > operator.last_seen
+                ]
+                # A quiet operator nobody is waiting for is left alone.
+                if not unanswered:
+                    continue
+                moved = list(records) if offline else unanswered
+                for client_id in moved:
+                    record = records[client_id]
+                    self.release_conversation(operator_chat_id, client_id)
+                    self.waiting_queue.enqueue(
+                        client_id,
+                        record.get("client_name", ""),
+                        front=True,
+                        tags=record.get("tags") or (),
+                    )
+                self.operator_manager.set_status(operator_chat_id, idle_status)
+                handed_over[operator_chat_id] = moved
+        if not handed_over:
+            return
+        logger.info(
+            "Marked %s quiet operators %s, handed over %s clients",
+            len(handed_over),
+            idle_status.value,
+            sum(len(clients) for clients in handed_over.values()),
+        )
+        minutes = max(1, round(settings.operator_idle_timeout / 60))
+        label = "офлайн" if offline else "занят"
+        messages: List[Tuple[int, str]] = []
+        for operator_chat_id, clients in handed_over.items():
+            text = (
+                f"⏸ Нет активности {minutes} мин. Статус: {label}. "
+                "Клиенты переданы другим операторам: " + ", ".join(map(str, clients))
+            )
+            messages.append((operator_chat_id, text + "\nЧтобы вернуться, отправьте /available."))
+            messages.extend(
+                (client_id, "Оператор сейчас недоступен. Мы передадим ваш вопрос другому.")
+                for client_id in clients
+            )
+        await self.send_batch(messages)
+        await self.dispatch_waiting_clients()
+
+    def can_broadcast(self, chat_id: int) -> bool:
+        if self.settings.broadcast_admins:
+            return chat_id in self.settings.broadcast_admins
+        return self.operator_manager.is_operator(chat_id)
+
+    def broadcast_recipients(self, audience: str) -> List[int]:
+        recipients: List[int] = []
+        if audience in ("clients", "all"):
+            conversations = self.conversation_manager.conversation_snapshot()
+            recipients.extend(int(key) for key in conversations)
+            recipients.extend(self.waiting_queue.clients())
+        if audience in ("operators", "all"):
+            operators = self.operator_manager.list_operators()
+            recipients.extend(operator.chat_id for operator in operators)
+        return recipients
+
+    def start_broadcast(self, broadcast: Broadcast) -> None:
+        async def report(finished: Broadcast) -> None:
+            verb = "завершена" if finished.status == "done" else "остановлена"
+            text = f"📣 Рассылка #{finished.id} {verb}. " + broadcast_progress(finished)
+            await self.send_batch([(finished.created_by, text)])
+
+        self.broadcasts.start(broadcast, report)
+
+    def can_profile(self, chat_id: int) -> bool:
+        return chat_id in (self.settings.profile_admins or self.settings.broadcast_admins)
+
+    def start_profile(self, updates: int, seconds: float, owner: Optional[int] = None) -> bool:
+        if not self.profiler.start(updates, seconds, owner):
+            return False
+        if seconds:
+            self._profile_timer = asyncio.create_task(self._finish_profile_later(seconds))
+        return True
+
+    async def _finish_profile_later(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+        await self.finish_profile()
+
+    async def finish_profile(self) -> None:
+        """Stop profiling, write the report and tell whoever started it where it is."""
+        timer, self._profile_timer = self._profile_timer, None
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+        owner = self.profiler.owner
+        finished = self.profiler.stop()
+        if finished is None:
+            return
+        # pstats and the file writes would hold up every chat; only stop() needs the loop.
+        report = await asyncio.to_thread(self.profiler.write_report, finished)
+        if owner is None:
+            return
+        lines = [
+            f"📊 Профиль готов: {report.updates} обновлений за {report.seconds:.0f} с.",
+            f"Сводка: {report.summary}",
+            f"Дамп для pstats: {report.dump}",
+        ]
+        handlers = sorted(report.handlers.items(), key=lambda item: -item[1].total)
+        for name, times in handlers[:5]:
+            lines.append(
+                f"{name}: {times.calls} × {times.total / times.calls * 1000:.1f} мс, "
+                f"максимум {times.max * 1000:.0f} мс"
+            )
+        await self.send_batch([(owner, "\n".join(lines))])
+
+    def toggle_profile(self) -> None:
+        """SIGUSR1: start a session with the configured limits, or finish the running one."""
+        if self.profiler.active:
+            if self._profile_timer is not None:
+                self._profile_timer.cancel()
+            self._profile_timer = asyncio.create_task(self.finish_profile())
+        else:
+            self.start_profile(self.settings.profile_updates, self.settings.profile_seconds)
+
+    def queue_depths(self) -> Dict[Tuple[str, ...], float]:
+        depths = {
+            ("outbound",): self.outbound_sender.depth,
+            ("waiting",): len(self.waiting_queue),
+        }
+        if self.store_writer is not None:
+            depths[("store_writer",)] = self.store_writer.depth
+        if self.transcripts is not None:
+            depths[("transcripts",)] = self.transcripts.depth
+        return depths
+
+    def operator_conversations(self) -> Dict[Tuple[str, ...], float]:
+        return {
+            (str(operator.chat_id),): self.conversation_manager.client_count(operator.chat_id)
+            for operator in self.operator_manager.list_operators()
+        }
+
+
+def broadcast_progress(broadcast: Broadcast) -> str:
+    return (
+        f"Доставлено: {broadcast.delivered}, ошибок: {broadcast.failed}, "
+        f"всего получателей: {broadcast.total}."
+    )
+
+
+def get_services(holder: Union[Application, ContextTypes.DEFAULT_TYPE]) -> BotServices:
+    """The instance an application or a handler/job context belongs to."""
+    return holder.bot_data[SERVICES_KEY]
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.effective_message
     if not message:
         return
+    services = get_services(context)
     chat_id = message.chat_id
     user = update.effective_user
-    if operator_manager.is_operator(chat_id):
+    if services.operator_manager.is_operator(chat_id):
         text = (
             "Вы уже зарегистрированы как оператор.\n"
             "Команды: /clients, /focus <id>, /reply <id> <сообщение>, "
-            "/end <id>, /available, /busy, /offline."
+            "/end <id>, /history <id>, /skills, /available, /busy, /offline."
         )
     else:
+        if context.args:
+            services.remember_start_tags(chat_id, context.args[0])
         name = user.full_name if user else "клиент"
         text = (
             f"Здравствуйте, {name}!\n"
@@ -95,20 +633,21 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.effective_message
     if not message:
         return
+    services = get_services(context)
     chat_id = message.chat_id
     if not context.args:
         await message.reply_text("Использование: /register <секретное_слово>")
         return
     provided_secret = context.args[0]
-    if provided_secret != settings.operator_secret:
+    if provided_secret != services.settings.operator_secret:
         await message.reply_text("Неверное секретное слово.")
         return
     user = update.effective_user
     username = (user.username or "").lower() if user else ""
     display_name = user.full_name if user else username or str(chat_id)
     try:
-        operator_manager.upsert_operator(chat_id, username, display_name)
-        operator_manager.set_status(chat_id, OperatorStatus.AVAILABLE)
+        services.operator_manager.upsert_operator(chat_id, username, display_name)
+        services.operator_manager.set_status(chat_id, OperatorStatus.AVAILABLE)
     except PermissionError as error:
         await message.reply_text(str(error))
         return
@@ -116,14 +655,15 @@ async def register(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "Готово! Вы добавлены как оператор. Используйте /available, когда готовы получать новые запросы."
     )
     logger.info("Operator %s registered", chat_id)
+    await services.dispatch_waiting_clients()
 
 
-async def require_operator(update: Update) -> Optional[int]:
+async def require_operator(update: Update, services: BotServices) -> Optional[int]:
     message = update.effective_message
     if not message:
         return None
     chat_id = message.chat_id
-    if not operator_manager.is_operator(chat_id):
+    if not services.operator_manager.is_operator(chat_id):
         await message.reply_text(
             "Вы не зарегистрированы как оператор. Команда /register <секрет>."
         )
@@ -132,12 +672,13 @@ async def require_operator(update: Update) -> Optional[int]:
 
 
 async def set_status(
-    update: Update, _: ContextTypes.DEFAULT_TYPE, status: OperatorStatus
+    update: Update, context: ContextTypes.DEFAULT_TYPE, status: OperatorStatus
 ) -> None:
-    chat_id = await require_operator(update)
+    services = get_services(context)
+    chat_id = await require_operator(update, services)
     if not chat_id:
         return
-    operator_manager.set_status(chat_id, status)
+    services.operator_manager.set_status(chat_id, status)
     if status == OperatorStatus.AVAILABLE:
         text = "Статус: доступен для новых клиентов."
     elif status == OperatorStatus.BUSY:
@@ -145,28 +686,48 @@ async def set_status(
     else:
         text = "Статус: офлайн. На вас не будут назначаться клиенты."
     await update.effective_message.reply_text(text)
+    if status == OperatorStatus.AVAILABLE:
+        await services.dispatch_waiting_clients()
 
 
-async def show_clients(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = await require_operator(update)
+async def show_clients(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    services = get_services(context)
+    chat_id = await require_operator(update, services)
     if not chat_id:
         return
+    conversation_manager = services.conversation_manager
     clients = conversation_manager.get_clients_for_operator(chat_id)
     if not clients:
         await update.effective_message.reply_text("За вами сейчас нет активных клиентов.")
         return
-    snapshot = conversation_manager.conversation_snapshot()
     lines = []
     for client_id in clients:
-        record = snapshot.get(str(client_id), {})
+        record = conversation_manager.get_client_record(client_id) or {}
         name = record.get("client_name", str(client_id))
         last = record.get("last_activity", "n/a")
         lines.append(f"{client_id}: {name} (последняя активность {last})")
     await update.effective_message.reply_text("\n".join(lines))
 
 
+async def skills_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    services = get_services(context)
+    chat_id = await require_operator(update, services)
+    if not chat_id:
+        return
+    operator_manager = services.operator_manager
+    if context.args:
+        skills = [] if context.args == ["-"] else normalize_tags(context.args)
+        operator_manager.set_skills(chat_id, skills)
+    skills = operator_manager.get_operator(chat_id).skills
+    text = "Навыки: " + ", ".join(skills) if skills else "Навыки не заданы."
+    await update.effective_message.reply_text(
+        text + "\nИзменить: /skills <тег> [тег ...], очистить: /skills -"
+    )
+
+
 async def focus_client(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = await require_operator(update)
+    services = get_services(context)
+    chat_id = await require_operator(update, services)
     if not chat_id:
         return
     if not context.args:
@@ -177,18 +738,18 @@ async def focus_client(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     except ValueError:
         await update.effective_message.reply_text("client_id должен быть числом.")
         return
-    assigned_clients = conversation_manager.get_clients_for_operator(chat_id)
-    if client_id not in assigned_clients:
+    if not services.conversation_manager.has_client(chat_id, client_id):
         await update.effective_message.reply_text("Этот клиент не закреплен за вами.")
         return
-    operator_manager.set_active_client(chat_id, client_id)
+    services.operator_manager.set_active_client(chat_id, client_id)
     await update.effective_message.reply_text(
         f"Активный клиент установлен: {client_id}. Теперь можно писать ему напрямую."
     )
 
 
 async def reply_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = await require_operator(update)
+    services = get_services(context)
+    chat_id = await require_operator(update, services)
     if not chat_id:
         return
     if len(context.args) < 2:
@@ -200,21 +761,26 @@ async def reply_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         await update.effective_message.reply_text("client_id должен быть числом.")
         return
     text = " ".join(context.args[1:])
-    record = conversation_manager.get_client_record(client_id)
+    record = services.conversation_manager.get_client_record(client_id)
     if not record or int(record["operator_id"]) != chat_id:
         await update.effective_message.reply_text(
             "Нельзя писать этому клиенту: он не закреплен за вами."
         )
         return
-    await context.bot.send_message(
+    await services.outbound_sender.send_message(
         chat_id=client_id,
-        text=f"💬 {operator_display_name(chat_id)}: {text}",
+        text=f"💬 {services.operator_display_name(chat_id)}: {text}",
     )
+    services.admission.operator_replied(client_id)
+    if services.transcripts is not None:
+        message_id = update.effective_message.message_id
+        services.transcripts.record(client_id, "operator", chat_id, message_id, "text", text)
     await update.effective_message.reply_text("Сообщение отправлено клиенту.")
 
 
 async def end_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = await require_operator(update)
+    services = get_services(context)
+    chat_id = await require_operator(update, services)
     if not chat_id:
         return
     if not context.args:
@@ -225,26 +791,22 @@ async def end_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     except ValueError:
         await update.effective_message.reply_text("client_id должен быть числом.")
         return
-    record = conversation_manager.get_client_record(client_id)
+    record = services.conversation_manager.get_client_record(client_id)
     if not record or int(record["operator_id"]) != chat_id:
         await update.effective_message.reply_text("Этот клиент не найден среди ваших диалогов.")
         return
-    conversation_manager.release_client(client_id)
-    operator = operator_manager.get_operator(chat_id)
-    if operator.active_client == client_id:
-        operator_manager.set_active_client(chat_id, None)
-    remaining_clients = conversation_manager.get_clients_for_operator(chat_id)
-    if not remaining_clients and operator.status != OperatorStatus.OFFLINE:
-        operator_manager.set_status(chat_id, OperatorStatus.AVAILABLE)
-    await context.bot.send_message(
+    services.release_conversation(chat_id, client_id)
+    await services.outbound_sender.send_message(
         chat_id=client_id,
         text="Диалог завершен. Если появятся дополнительные вопросы, напишите нам снова.",
     )
     await update.effective_message.reply_text("Диалог завершен и клиент освобожден.")
+    await services.dispatch_waiting_clients()
 
 
 async def operator_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.effective_message
+    operator_manager = get_services(context).operator_manager
     if not message or not operator_manager.is_operator(message.chat_id):
         return
     operator = operator_manager.get_operator(message.chat_id)
@@ -253,29 +815,24 @@ async def operator_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             "Не выбран активный клиент. Используйте /focus <id> или /reply <id> <текст>."
         )
         return
+    get_services(context).record_message(operator.active_client, "operator", message)
+    get_services(context).admission.operator_replied(operator.active_client)
     await relay_to_client(
         context=context,
-        source_chat_id=message.chat_id,
+        message=message,
         target_chat_id=operator.active_client,
         notice=f"💬 {operator.display_name}",
-        message_id=message.message_id,
     )
 
 
 async def relay_to_client(
     context: ContextTypes.DEFAULT_TYPE,
-    source_chat_id: int,
+    message: Message,
     target_chat_id: int,
     notice: str,
-    message_id: int,
 ) -> None:
     try:
-        await context.bot.send_message(chat_id=target_chat_id, text=notice)
-        await context.bot.copy_message(
-            chat_id=target_chat_id,
-            from_chat_id=source_chat_id,
-            message_id=message_id,
-        )
+        await get_services(context).relay.relay(message, target_chat_id, notice)
     except TelegramError as error:
         logger.error("Failed to relay message: %s", error)
 
@@ -284,36 +841,40 @@ async def client_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     message = update.effective_message
     if not message:
         return
+    services = get_services(context)
     chat_id = message.chat_id
-    if operator_manager.is_operator(chat_id):
+    if services.operator_manager.is_operator(chat_id):
         return
+    services.record_message(chat_id, "client", message)
     user = update.effective_user
     display_name = user.full_name if user else str(chat_id)
-    operator_chat_id = conversation_manager.get_operator_for_client(chat_id)
+    operator_chat_id = services.conversation_manager.get_operator_for_client(chat_id)
     new_assignment = False
     if not operator_chat_id:
-        operator_chat_id = pick_operator_for_new_client()
+        was_waiting = chat_id in services.waiting_queue
+        operator_chat_id, new_assignment = services.assign_client(
+            chat_id, display_name, services.client_tags(chat_id, message), message.message_id
+        )
         if not operator_chat_id:
-            await message.reply_text(
-                "Все операторы офлайн. Мы обязательно ответим, как только кто-то подключится."
-            )
+            position = services.waiting_queue.position(chat_id)
+            # The position is told once per enqueue; position_updates reports the moves.
+            if position is None or was_waiting:
+                return
+            text = services.waiting_text(position)
+            ADMISSION_DECISIONS.inc("queued")
+            auto_reply = services.settings.admission_auto_reply
+            if services.admission.elevated and auto_reply:
+                ADMISSION_DECISIONS.inc("auto_reply")
+                text += "\n\n" + auto_reply
+            await message.reply_text(text)
             return
-        conversation_manager.bind_client(chat_id, operator_chat_id, display_name)
-        operator_manager.set_status(operator_chat_id, OperatorStatus.BUSY)
-        assigned_operator = operator_manager.get_operator(operator_chat_id)
-        if not assigned_operator.active_client:
-            operator_manager.set_active_client(operator_chat_id, chat_id)
-        new_assignment = True
     if new_assignment:
-        await context.bot.send_message(
-            chat_id=operator_chat_id,
-            text=(
-                f"🆕 Новый клиент {display_name} ({chat_id}). "
-                f"Команда /focus {chat_id} или /reply {chat_id} <текст>."
-            ),
-        )
+        notice = services.assignment_message(operator_chat_id, chat_id, display_name)
+        if notice is not None:
+            await services.outbound_sender.send_message(chat_id=notice[0], text=notice[1])
         await message.reply_text("Мы подключили оператора, ожидайте ответа.")
     await relay_to_operator(update, context, operator_chat_id, display_name)
+    services.admission.client_waiting(chat_id)
 
 
 async def relay_to_operator(
@@ -326,26 +887,28 @@ async def relay_to_operator(
     if not message:
         return
     notice = f"📨 {client_name}"
-    try:
-        await context.bot.send_message(chat_id=operator_chat_id, text=notice)
-        await context.bot.copy_message(
-            chat_id=operator_chat_id,
-            from_chat_id=message.chat_id,
-            message_id=message.message_id,
-        )
-    except TelegramError as error:
+
+    async def report_failure(error: Exception) -> None:
         logger.error("Failed to deliver client message: %s", error)
         await message.reply_text(
             "Не удалось связаться с оператором. Попробуйте еще раз чуть позже."
         )
 
+    try:
+        await get_services(context).relay.relay(
+            message, operator_chat_id, notice, on_error=report_failure
+        )
+    except TelegramError as error:
+        await report_failure(error)
 
-async def status_command(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = await require_operator(update)
+
+async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    services = get_services(context)
+    chat_id = await require_operator(update, services)
     if not chat_id:
         return
-    operator = operator_manager.get_operator(chat_id)
-    clients = conversation_manager.get_clients_for_operator(chat_id)
+    operator = services.operator_manager.get_operator(chat_id)
+    clients = services.conversation_manager.get_clients_for_operator(chat_id)
     text = (
         f"Статус: {operator.status.value}\n"
         f"Активный клиент: {operator.active_client or 'не выбран'}\n"
@@ -354,46 +917,467 @@ async def status_command(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
     await update.effective_message.reply_text(text)
 
 
+def format_transcript_entry(services: BotServices, entry: Dict) -> str:
+    at = entry["at"][:19].replace("T", " ")
+    if entry["role"] == "system":
+        return f"{at} ⏹ диалог завершён"
+    if entry["role"] == "client":
+        sender = "📨 клиент"
+    else:
+        sender = f"💬 {services.operator_display_name(entry['from'])}"
+    body = entry.get("text", "")
+    if entry["type"] != "text":
+        body = f"[{entry['type']}] {body}".rstrip()
+    return f"{at} {sender}: {body}"
+
+
+def pack_lines(lines: List[str], limit: int = MessageLimit.MAX_TEXT_LENGTH) -> List[str]:
+    """Join lines into as few messages as fit; a single over-long line is cut."""
+    chunks: List[str] = []
+    current = ""
+    for line in lines:
+        line = line[:limit]
+        if current and len(current) + 1 + len(line) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    services = get_services(context)
+    chat_id = await require_operator(update, services)
+    if not chat_id:
+        return
+    if services.transcripts is None:
+        await update.effective_message.reply_text("История переписки отключена (TRANSCRIPTS=0).")
+        return
+    if not context.args:
+        await update.effective_message.reply_text(
+            "Использование: /history <client_id> [количество]"
+        )
+        return
+    try:
+        client_id = int(context.args[0])
+        limit = int(context.args[1]) if len(context.args) > 1 else services.settings.history_limit
+    except ValueError:
+        await update.effective_message.reply_text("client_id и количество должны быть числами.")
+        return
+    limit = max(1, min(limit, 1000))
+    # Only the newest segments are read, off the event loop.
+    entries = await asyncio.to_thread(services.transcripts.tail, client_id, limit)
+    if not entries:
+        await update.effective_message.reply_text("История для этого клиента пуста.")
+        return
+    lines = [f"История {client_id} (записей: {len(entries)}):"]
+    lines.extend(format_transcript_entry(services, entry) for entry in entries)
+    for chunk in pack_lines(lines):
+        await services.outbound_sender.send_message(chat_id=chat_id, text=chunk)
+
+
+BROADCAST_USAGE = (
+    "Использование:\n"
+    "/broadcast clients|operators|all <текст> — разослать сообщение\n"
+    "/broadcast status — ход последних рассылок\n"
+    "/broadcast cancel <id> — остановить рассылку\n"
+    "/broadcast resume <id> — продолжить прерванную рассылку"
+)
+
+
+PROFILE_USAGE = (
+    "Использование:\n"
+    "/profile — профилировать PROFILE_UPDATES обновлений или PROFILE_SECONDS секунд\n"
+    "/profile <N> — следующие N обновлений\n"
+    "/profile <T>s — следующие T секунд\n"
+    "/profile status — ход профилирования\n"
+    "/profile stop — остановить и записать отчёт"
+)
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    message = update.effective_message
+    if not message:
+        return
+    services = get_services(context)
+    chat_id = message.chat_id
+    if not services.can_profile(chat_id):
+        await message.reply_text("Профилирование доступно только администраторам.")
+        return
+    profiler = services.profiler
+    action = context.args[0].lower() if context.args else ""
+    if action == "status":
+        await message.reply_text(profiler.status())
+        return
+    if action == "stop":
+        if not profiler.active:
+            await message.reply_text("Профилирование не запущено.")
+            return
+        profiler.owner = chat_id
+        await services.finish_profile()
+        return
+    updates, seconds = services.settings.profile_updates, services.settings.profile_seconds
+    if action:
+        try:
+            if action.endswith("s"):
+                updates, seconds = 0, float(action[:-1])
+            else:
+                updates, seconds = int(action), 0.0
+        except ValueError:
+            updates, seconds = 0, 0.0
+        if updates <= 0 and seconds <= 0:
+            await message.reply_text(PROFILE_USAGE)
+            return
+    if not services.start_profile(updates, seconds, chat_id):
+        await message.reply_text("Профилирование уже идёт. " + profiler.status())
+        return
+    await message.reply_text(
+        f"{profiler.status()} Отчёт придёт сюда, файлы — в {services.settings.profile_dir}."
+    )
+
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    message = update.effective_message
+    if not message:
+        return
+    services = get_services(context)
+    chat_id = message.chat_id
+    if not services.can_broadcast(chat_id):
+        await message.reply_text("Рассылки доступны только администраторам.")
+        return
+    broadcasts = services.broadcasts
+    action = context.args[0].lower() if context.args else ""
+    if action == "status":
+        lines = [
+            f"#{broadcast.id} ({broadcast.audience}, {broadcast.status}): "
+            + broadcast_progress(broadcast)
+            for broadcast in broadcasts.recent()
+        ]
+        await message.reply_text("\n".join(lines) or "Рассылок ещё не было.")
+        return
+    if action in ("cancel", "resume"):
+        try:
+            broadcast_id = int(context.args[1])
+        except (IndexError, ValueError):
+            await message.reply_text(BROADCAST_USAGE)
+            return
+        broadcast = broadcasts.get(broadcast_id)
+        if action == "cancel":
+            if broadcasts.cancel(broadcast_id):
+                await message.reply_text(f"Рассылка #{broadcast_id} останавливается.")
+            else:
+                await message.reply_text("Такой активной рассылки нет.")
+        elif (
+            broadcast is None
+            or broadcast.status != "running"
+            or broadcasts.is_running(broadcast_id)
+        ):
+            await message.reply_text("Эту рассылку нельзя продолжить.")
+        else:
+            services.start_broadcast(broadcast)
+            await message.reply_text(f"Рассылка #{broadcast_id} продолжена.")
+        return
+    parts = (message.text or "").split(maxsplit=2)
+    if action not in AUDIENCES or len(parts) < 3:
+        await message.reply_text(BROADCAST_USAGE)
+        return
+    if broadcasts.running():
+        await message.reply_text("Уже идёт рассылка; дождитесь её окончания или отмените её.")
+        return
+    broadcast = broadcasts.create(action, parts[2], chat_id, services.broadcast_recipients(action))
+    services.start_broadcast(broadcast)
+    await message.reply_text(
+        f"📣 Рассылка #{broadcast.id} запущена, получателей: {broadcast.total}. "
+        f"Ход: /broadcast status"
+    )
+
+
 async def route_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message = update.effective_message
     if not message:
         return
     chat_id = message.chat_id
-    if operator_manager.is_operator(chat_id):
+    if get_services(context).operator_manager.is_operator(chat_id):
         await operator_message(update, context)
     else:
         await client_message(update, context)
 
 
+# Only message updates reach the handlers below; everything else would be fetched for nothing.
+ALLOWED_UPDATES = [Update.MESSAGE, Update.EDITED_MESSAGE]
+
+
+HandlerCallback = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]]
+
+
+def instrumented(
+    name: str, callback: HandlerCallback, profiler: Optional[Profiler] = None
+) -> HandlerCallback:
+    """Record the handler's latency and failures under ``name``, and feed ``profiler``."""
+
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        # Only updates that start inside a session count, so /profile is not its own sample.
+        profiled = profiler is not None and profiler.active
+        started = time.perf_counter()
+        try:
+            await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            HANDLER_SECONDS.observe(elapsed, name)
+            if profiled and profiler.active and profiler.record(name, elapsed):
+                await get_services(context).finish_profile()
+
+    return wrapper
+
+
+async def before_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Runs before every handler: see what other workers wrote, then note operator presence.
+    services = get_services(context)
+    if services.settings.shared_state:
+        services.sync()
+    if update.effective_chat is not None:
+        services.operator_manager.touch(update.effective_chat.id)
+
+
 def register_handlers(app: Application) -> None:
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("help", start))
-    app.add_handler(CommandHandler("register", register))
-    app.add_handler(CommandHandler("available", lambda u, c: set_status(u, c, OperatorStatus.AVAILABLE)))
-    app.add_handler(CommandHandler("busy", lambda u, c: set_status(u, c, OperatorStatus.BUSY)))
+    app.add_handler(TypeHandler(Update, before_update), group=-1)
+    commands: Dict[str, HandlerCallback] = {
+        "start": start,
+        "help": start,
+        "register": register,
+        "available": lambda u, c: set_status(u, c, OperatorStatus.AVAILABLE),
+        "busy": lambda u, c: set_status(u, c, OperatorStatus.BUSY),
+        "offline": lambda u, c: set_status(u, c, OperatorStatus.OFFLINE),
+        "clients": show_clients,
+        "focus": focus_client,
+        "reply": reply_command,
+        "end": end_chat,
+        "status": status_command,
+        "history": history_command,
+        "skills": skills_command,
+        "broadcast": broadcast_command,
+        "profile": profile_command,
+    }
+    profiler = get_services(app).profiler
+    for name, callback in commands.items():
+        app.add_handler(CommandHandler(name, instrumented(name, callback, profiler)))
+    relay_filter = filters.ALL & ~filters.COMMAND
     app.add_handler(
-        CommandHandler("offline", lambda u, c: set_status(u, c, OperatorStatus.OFFLINE))
+        MessageHandler(relay_filter, instrumented("message", route_message, profiler))
     )
-    app.add_handler(CommandHandler("clients", show_clients))
-    app.add_handler(CommandHandler("focus", focus_client))
-    app.add_handler(CommandHandler("reply", reply_command))
-    app.add_handler(CommandHandler("end", end_chat))
-    app.add_handler(CommandHandler("status", status_command))
-    relay_filter = filters.ALL & ~filters.COMMAND
-    app.add_handler(MessageHandler(relay_filter, route_message))
 
 
-def build_application() -> Application:
-    return ApplicationBuilder().token(settings.token).build()
+async def flush_activity_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    conversation_manager = get_services(context).conversation_manager
+    written = conversation_manager.flush_activity()
+    if written:
+        stats = conversation_manager.activity_stats
+        logger.debug(
+            "Flushed %s activity records in %.1f ms (flushes: %s)",
+            written,
+            stats.last_seconds * 1000,
+            stats.flushes,
+        )
+
 
+async def reap_idle_conversations(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await get_services(context).reap_idle_conversations()
 
-def main() -> None:
-    application = build_application()
+
+async def mark_quiet_operators(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await get_services(context).mark_quiet_operators()
+
+
+async def review_admission(context: ContextTypes.DEFAULT_TYPE) -> None:
+    await get_services(context).review_admission()
+
+
+def schedule_jobs(app: Application) -> None:
+    if app.job_queue is None:
+        logger.warning("Job queue is unavailable; activity is flushed only on demand.")
+        return
+    settings = get_services(app).settings
+    app.job_queue.run_repeating(
+        flush_activity_job,
+        interval=settings.activity_flush_interval,
+        first=settings.activity_flush_interval,
+        name="flush-activity",
+    )
+    if settings.conversation_idle_ttl > 0:
+        app.job_queue.run_repeating(
+            reap_idle_conversations,
+            interval=settings.reaper_interval,
+            first=settings.reaper_interval,
+            name="reap-idle-conversations",
+        )
+    if settings.operator_idle_timeout > 0:
+        app.job_queue.run_repeating(
+            mark_quiet_operators,
+            interval=settings.operator_presence_interval,
+            first=settings.operator_presence_interval,
+            name="mark-quiet-operators",
+        )
+    if settings.admission_interval > 0:
+        app.job_queue.run_repeating(
+            review_admission,
+            interval=settings.admission_interval,
+            first=settings.admission_interval,
+            name="review-admission",
+        )
+
+
+async def on_startup(application: Application) -> None:
+    services = get_services(application)
+    services.outbound_sender.start(application.bot)
+    if services.metrics_server is not None:
+        # The registry is process-wide; its gauges follow the instance that serves it.
+        QUEUE_DEPTH.set_callback(services.queue_depths)
+        OPERATOR_CONVERSATIONS.set_callback(services.operator_conversations)
+        await services.metrics_server.start()
+    if services.waiting_queue:
+        logger.info("%s clients are waiting for an operator", len(services.waiting_queue))
+        await services.dispatch_waiting_clients()
+    for broadcast in services.broadcasts.unfinished():
+        if services.settings.shared_state:
+            # Every worker would pick it up; someone has to resume it by hand.
+            logger.warning(
+                "Broadcast %s was interrupted; resume it with /broadcast resume", broadcast.id
+            )
+            continue
+        logger.info(
+            "Resuming broadcast %s at %s/%s", broadcast.id, broadcast.cursor, broadcast.total
+        )
+        services.start_broadcast(broadcast)
+    if hasattr(signal, "SIGUSR1"):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, services.toggle_profile)
+        except (NotImplementedError, RuntimeError):
+            logger.debug("SIGUSR1 profiling toggle is unavailable in this event loop")
+
+
+async def on_stop(application: Application) -> None:
+    services = get_services(application)
+    if hasattr(signal, "SIGUSR1"):
+        try:
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+        except (NotImplementedError, RuntimeError):
+            pass
+    await services.finish_profile()
+    await services.broadcasts.stop()
+    await services.relay.flush()
+    if services.metrics_server is not None:
+        await services.metrics_server.stop()
+    await services.outbound_sender.stop()
+    stats = services.outbound_sender.stats
+    logger.info(
+        "Outbound: %s sent, %s failed, %s retries, %s flood waits, "
+        "%s back-pressure waits, max depth %s",
+        stats.sent,
+        stats.failed,
+        stats.retries,
+        stats.flood_waits,
+        stats.backpressure_waits,
+        stats.max_depth,
+    )
+    relay_stats = services.relay.stats
+    logger.info(
+        "Relayed %s messages (%s albums) with %s API calls",
+        relay_stats.messages,
+        relay_stats.albums,
+        relay_stats.api_calls,
+    )
+
+
+async def on_shutdown(application: Application) -> None:
+    services = get_services(application)
+    conversation_manager = services.conversation_manager
+    conversation_manager.flush_activity()
+    stats = conversation_manager.activity_stats
+    logger.info(
+        "Activity flushes: %s, records: %s, total %.1f ms",
+        stats.flushes,
+        stats.records,
+        stats.total_seconds * 1000,
+    )
+    if services.transcripts is not None:
+        services.transcripts.close()
+        logger.info(
+            "Transcripts: %s entries written, %s failed",
+            services.transcripts.written,
+            services.transcripts.failed,
+        )
+    store_writer = services.store_writer
+    if store_writer is not None:
+        store_writer.close()
+        logger.info(
+            "Store writer drained: %s written, %s coalesced, %s failed",
+            store_writer.written,
+            store_writer.coalesced,
+            store_writer.failed,
+        )
+
+
+def create_application(
+    settings: Optional[Settings] = None, request: Optional[BaseRequest] = None
+) -> Application:
+    """Build a bot instance; ``request`` replaces the HTTP transport, e.g. in benchmarks."""
+    if settings is None:
+        settings = load_settings()
+    builder = (
+        ApplicationBuilder()
+        .token(settings.token)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    if settings.concurrent_updates > 1:
+        builder = builder.concurrent_updates(
+            ChatOrderedUpdateProcessor(settings.concurrent_updates)
+        )
+    application = builder.build()
+    application.bot_data[SERVICES_KEY] = BotServices(settings)
     register_handlers(application)
+    schedule_jobs(application)
+    return application
+
+
+def main() -> None:
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    application = create_application()
+    settings = get_services(application).settings
+    if settings.webhook_url:
+        logger.info("Bot starting in webhook mode...")
+        server = WebhookServer(
+            application,
+            listen=settings.webhook_listen,
+            port=settings.webhook_port,
+            path=settings.webhook_path,
+            secret_token=settings.webhook_secret,
+            reuse_port=settings.shared_state,
+        )
+        asyncio.run(
+            run_webhook(
+                application,
+                server,
+                webhook_url=settings.webhook_url,
+                allowed_updates=ALLOWED_UPDATES,
+                secret_token=settings.webhook_secret,
+            )
+        )
+        return
     logger.info("Bot starting...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from dataclasses import asdict, dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from .managers import utcnow
+from .outbound import OutboundSender
+from .storage import JsonStore, StoreWriter
+
+logger = logging.getLogger(__name__)
+
+AUDIENCES = ("clients", "operators", "all")
+
+
+@dataclass
+class Broadcast:
+    id: int
+    audience: str
+    text: str
+    created_by: int
+    created_at: str
+    total: int
+    # Every recipient before ``cursor`` has been sent to (or failed), and so have the
+    # recipients at the indexes in ``done_ahead``.
+    cursor: int = 0
+    done_ahead: List[int] = field(default_factory=list)
+    delivered: int = 0
+    failed: int = 0
+    status: str = "running"  # running, done or cancelled
+    finished_at: Optional[str] = None
+
+
+FinishCallback = Callable[[Broadcast], Awaitable[None]]
+
+
+class BroadcastManager:
+    """Resumable broadcasts through the outbound sender, ``concurrency`` messages at a time."""
+
+    def __init__(
+        self,
+        sender: OutboundSender,
+        root: Path,
+        concurrency: int = 20,
+        checkpoint_every: int = 100,
+        writer: Optional[StoreWriter] = None,
+    ):
+        self._sender = sender
+        self._root = root
+        self._concurrency = max(1, concurrency)
+        self._checkpoint_every = max(1, checkpoint_every)
+        self._writer = writer
+        self._stores: Dict[int, JsonStore] = {}
+        self._broadcasts: Dict[int, Broadcast] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._cancelled: Set[int] = set()
+        root.mkdir(parents=True, exist_ok=True)
+        for path in root.glob("*.json"):
+            if not path.stem.isdigit():
+                continue
+            payload = self._store(int(path.stem)).load()
+            if payload:  # empty if we stopped between creating the file and the first save
+                self._broadcasts[int(path.stem)] = Broadcast(**payload)
+
+    def _store(self, broadcast_id: int) -> JsonStore:
+        store = self._stores.get(broadcast_id)
+        if store is None:
+            store = JsonStore(self._root / f"{broadcast_id}.json", {}, writer=self._writer)
+            self._stores[broadcast_id] = store
+        return store
+
+    def _recipients_path(self, broadcast_id: int) -> Path:
+        return self._root / f"{broadcast_id}.recipients"
+
+    def _save(self, broadcast: Broadcast) -> None:
+        self._store(broadcast.id).commit(partial(asdict, broadcast), [])
+
+    def get(self, broadcast_id: int) -> Optional[Broadcast]:
+        return self._broadcasts.get(broadcast_id)
+
+    def recent(self, limit: int = 5) -> List[Broadcast]:
+        return [self._broadcasts[key] for key in sorted(self._broadcasts)[-limit:]]
+
+    def is_running(self, broadcast_id: int) -> bool:
+        return broadcast_id in self._tasks
+
+    def running(self) -> List[Broadcast]:
+        return [self._broadcasts[key] for key in sorted(self._tasks)]
+
+    def unfinished(self) -> List[Broadcast]:
+        """Broadcasts that were interrupted, e.g. by a restart, and are not running now."""
+        return [
+            broadcast
+            for key, broadcast in sorted(self._broadcasts.items())
+            if broadcast.status == "running" and key not in self._tasks
+        ]
+
+    def _claim_id(self) -> int:
+        # Workers sharing ``root`` may create broadcasts at the same time: the exclusive
+        # create of ``<id>.json`` decides who gets an id.
+        on_disk = (int(path.stem) for path in self._root.glob("*.json") if path.stem.isdigit())
+        broadcast_id = max(max(self._broadcasts, default=0), max(on_disk, default=0))
+        while True:
+            broadcast_id += 1
+            try:
+                with (self._root / f"{broadcast_id}.json").open("x", encoding="utf-8") as handle:
+                    handle.write("{}")
+            except FileExistsError:
+                continue
+            return broadcast_id
+
+    def create(
+        self, audience: str, text: str, created_by: int, recipients: Iterable[int]
+    ) -> Broadcast:
+        broadcast_id = self._claim_id()
+        unique = list(dict.fromkeys(recipients))
+        path = self._recipients_path(broadcast_id)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with tmp_path.open("w", encoding="ascii") as handle:
+            handle.writelines(f"{chat_id}\n" for chat_id in unique)
+        os.replace(tmp_path, path)
+        broadcast = Broadcast(
+            id=broadcast_id,
+            audience=audience,
+            text=text,
+            created_by=created_by,
+            created_at=utcnow(),
+            total=len(unique),
+        )
+        self._broadcasts[broadcast_id] = broadcast
+        self._save(broadcast)
+        return broadcast
+
+    def start(self, broadcast: Broadcast, on_finish: FinishCallback) -> None:
+        if broadcast.id in self._tasks:
+            return
+        self._cancelled.discard(broadcast.id)
+        task = asyncio.create_task(
+            self._run(broadcast, on_finish), name=f"broadcast-{broadcast.id}"
+        )
+        self._tasks[broadcast.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast.id, None))
+
+    def cancel(self, broadcast_id: int) -> bool:
+        """Stop queueing new messages; the ones in flight still complete."""
+        broadcast = self._broadcasts.get(broadcast_id)
+        if broadcast is None or broadcast.status != "running":
+            return False
+        if broadcast_id in self._tasks:
+            self._cancelled.add(broadcast_id)
+        else:
+            broadcast.status = "cancelled"
+            broadcast.finished_at = utcnow()
+            self._save(broadcast)
+        return True
+
+    async def stop(self) -> None:
+        """Interrupt running broadcasts; they stay ``running`` on disk and can be resumed."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, broadcast: Broadcast, on_finish: FinishCallback) -> None:
+        window = asyncio.Semaphore(self._concurrency)
+        in_flight: Set[int] = set()
+        done_ahead = set(broadcast.done_ahead)
+        pending: Set[asyncio.Task] = set()
+        next_index = broadcast.cursor
+        since_checkpoint = 0
+
+        def checkpoint() -> None:
+            broadcast.cursor = min(in_flight) if in_flight else next_index
+            done_ahead.difference_update([i for i in done_ahead if i < broadcast.cursor])
+            broadcast.done_ahead = sorted(done_ahead)
+            self._save(broadcast)
+
+        async def send(index: int, chat_id: int) -> None:
+            nonlocal since_checkpoint
+            try:
+                try:
+                    await self._sender.send_message(chat_id=chat_id, text=broadcast.text)
+                except Exception as error:  # blocked by the user, chat gone, flood retries spent
+                    broadcast.failed += 1
+                    logger.debug("Broadcast %s to %s failed: %s", broadcast.id, chat_id, error)
+                else:
+                    broadcast.delivered += 1
+                # Not reached when cancelled: the message then counts as not sent.
+                in_flight.discard(index)
+                done_ahead.add(index)
+                since_checkpoint += 1
+                if since_checkpoint >= self._checkpoint_every:
+                    since_checkpoint = 0
+                    checkpoint()
+            finally:
+                window.release()
+
+        try:
+            with self._recipients_path(broadcast.id).open(encoding="ascii") as handle:
+                for index, line in enumerate(handle):
+                    if index < broadcast.cursor or index in done_ahead:
+                        continue
+                    if broadcast.id in self._cancelled:
+                        break
+                    await window.acquire()
+                    in_flight.add(index)
+                    next_index = index + 1
+                    task = asyncio.create_task(send(index, int(line)))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+            await asyncio.gather(*pending)
+        except asyncio.CancelledError:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            checkpoint()
+            raise
+        broadcast.status = "cancelled" if broadcast.id in self._cancelled else "done"
+        broadcast.finished_at = utcnow()
+        self._cancelled.discard(broadcast.id)
+        checkpoint()
+        logger.info(
+            "Broadcast %s %s: %s delivered, %s failed of %s",
+            broadcast.id,
+            broadcast.status,
+            broadcast.delivered,
+            broadcast.failed,
+            broadcast.total,
+        )
+        await on_finish(broadcast)
+
+
+__all__ = ["AUDIENCES", "Broadcast", "BroadcastManager"]
@@ -1,12 +1,64 @@
 import os
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Optional
 
 from dotenv import load_dotenv
 
 
-load_dotenv()
+def _int_env(name: str, default: int) -> int:
+    raw = os.getenv(name, str(default))
+    try:
+        return int(raw)
+    except ValueError:
+        raise RuntimeError(f"{name} must be an integer, got: {raw}") from None
+
+
+def _float_env(name: str, default: float) -> float:
+    raw = os.getenv(name, str(default))
+    try:
+        return float(raw)
+    except ValueError:
+        raise RuntimeError(f"{name} must be a number, got: {raw}") from None
+
+
+def _int_list_env(name: str) -> List[int]:
+    values: List[int] = []
+    for chunk in os.getenv(name, "").split(","):
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        try:
+            values.append(int(chunk))
+        except ValueError:
+            raise RuntimeError(f"{name} must contain integers, got: {chunk}") from None
+    return values
+
+
+def _rules_env(name: str) -> Dict[str, List[str]]:
+    """``tag=keyword,keyword;tag=keyword`` -> {tag: [keywords]}."""
+    rules: Dict[str, List[str]] = {}
+    for part in os.getenv(name, "").split(";"):
+        if not part.strip():
+            continue
+        tag, separator, keywords = part.partition("=")
+        if not separator or not tag.strip():
+            raise RuntimeError(f"{name} must look like tag=keyword,keyword;..., got: {part}")
+        words = [keyword.strip() for keyword in keywords.split(",") if keyword.strip()]
+        rules.setdefault(tag.strip().lower(), []).extend(words)
+    return rules
+
+
+def _bool_env(name: str, default: bool) -> bool:
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    value = raw.strip().lower()
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    raise RuntimeError(f"{name} must be a boolean (1/0, true/false), got: {raw}")
 
 
 @dataclass(frozen=True)
@@ -15,6 +67,57 @@ class Settings:
     operator_secret: str
     data_dir: Path
     operators_allowlist: List[int]
+    storage_mode: str
+    journal_compact_after: int
+    sqlite_path: Path
+    shared_state: bool
+    async_writes: bool
+    activity_flush_interval: float
+    activity_flush_batch: int
+    scheduler_policy: str
+    concurrent_updates: int
+    outbound_global_rate: float
+    outbound_chat_rate: float
+    outbound_chat_burst: float
+    outbound_queue_size: int
+    relay_mode: str
+    relay_burst_window: float
+    relay_album_window: float
+    routing_rules: Dict[str, List[str]]
+    admission_backlog_soft: int
+    admission_backlog_hard: int
+    admission_latency_soft: float
+    admission_latency_hard: float
+    admission_interval: float
+    admission_overload_max_clients: int
+    admission_auto_reply: str
+    webhook_url: str
+    webhook_listen: str
+    webhook_port: int
+    webhook_path: str
+    webhook_secret: str
+    operator_max_clients: int
+    waiting_dispatch_batch: int
+    conversation_idle_ttl: float
+    reaper_interval: float
+    reaper_batch: int
+    operator_idle_timeout: float
+    operator_idle_status: str
+    operator_presence_interval: float
+    metrics_listen: str
+    metrics_port: int
+    transcripts: bool
+    transcript_dir: Path
+    transcript_segment_bytes: int
+    history_limit: int
+    broadcast_admins: List[int]
+    broadcast_concurrency: int
+    broadcast_checkpoint_every: int
+    profile_admins: List[int]
+    profile_dir: Path
+    profile_updates: int
+    profile_seconds: float
+    profile_tracemalloc_frames: int
 
     @classmethod
     def from_env(cls) -> "Settings":
@@ -26,31 +129,107 @@ class Settings:
 
         secret = os.getenv("OPERATOR_SECRET", "changeme")
         data_dir = Path(os.getenv("DATA_DIR", "data")).resolve()
-        data_dir.mkdir(parents=True, exist_ok=True)
-
-        allowlist_raw = os.getenv("OPERATORS_ALLOWLIST", "")
-        allowlist: List[int] = []
-        for chunk in allowlist_raw.split(","):
-            chunk = chunk.strip()
-            if not chunk:
-                continue
-            try:
-                allowlist.append(int(chunk))
-            except ValueError:
-                raise RuntimeError(
-                    f"OPERATORS_ALLOWLIST must contain integers, got: {chunk}"
-                ) from None
+
+        storage_mode = os.getenv("STORAGE_MODE", "json").strip().lower()
+        if storage_mode not in ("json", "journal", "binary", "sqlite"):
+            raise RuntimeError(
+                "STORAGE_MODE must be 'json', 'journal', 'binary' or 'sqlite', "
+                f"got: {storage_mode}"
+            )
+
+        shared_state = _bool_env("SHARED_STATE", False)
+        if shared_state and storage_mode != "sqlite":
+            raise RuntimeError("SHARED_STATE requires STORAGE_MODE=sqlite")
+
+        scheduler_policy = os.getenv("SCHEDULER_POLICY", "least_loaded").strip().lower()
+        if scheduler_policy not in ("least_loaded", "round_robin"):
+            raise RuntimeError(
+                "SCHEDULER_POLICY must be 'least_loaded' or 'round_robin', "
+                f"got: {scheduler_policy}"
+            )
+
+        relay_mode = os.getenv("RELAY_MODE", "merged").strip().lower()
+        if relay_mode not in ("merged", "burst", "separate"):
+            raise RuntimeError(
+                f"RELAY_MODE must be 'merged', 'burst' or 'separate', got: {relay_mode}"
+            )
+
+        operator_idle_status = os.getenv("OPERATOR_IDLE_STATUS", "busy").strip().lower()
+        if operator_idle_status not in ("busy", "offline"):
+            raise RuntimeError(
+                f"OPERATOR_IDLE_STATUS must be 'busy' or 'offline', got: {operator_idle_status}"
+            )
 
         return cls(
             token=token,
             operator_secret=secret,
             data_dir=data_dir,
-            operators_allowlist=allowlist,
+            operators_allowlist=_int_list_env("OPERATORS_ALLOWLIST"),
+            storage_mode=storage_mode,
+            journal_compact_after=_int_env("JOURNAL_COMPACT_AFTER", 1000),
+            sqlite_path=Path(os.getenv("SQLITE_PATH", str(data_dir / "bot.sqlite3"))).resolve(),
+            shared_state=shared_state,
+            async_writes=_bool_env("ASYNC_WRITES", True),
+            activity_flush_interval=_float_env("ACTIVITY_FLUSH_INTERVAL", 30.0),
+            activity_flush_batch=_int_env("ACTIVITY_FLUSH_BATCH", 100),
+            scheduler_policy=scheduler_policy,
+            concurrent_updates=_int_env("CONCURRENT_UPDATES", 32),
+            outbound_global_rate=_float_env("OUTBOUND_GLOBAL_RATE", 25.0),
+            outbound_chat_rate=_float_env("OUTBOUND_CHAT_RATE", 1.0),
+            outbound_chat_burst=_float_env("OUTBOUND_CHAT_BURST", 3.0),
+            outbound_queue_size=_int_env("OUTBOUND_QUEUE_SIZE", 1000),
+            relay_mode=relay_mode,
+            relay_burst_window=_float_env("RELAY_BURST_WINDOW", 60.0),
+            relay_album_window=_float_env("RELAY_ALBUM_WINDOW", 1.0),
+            routing_rules=_rules_env("ROUTING_RULES"),
+            admission_backlog_soft=_int_env("ADMISSION_BACKLOG_SOFT", 20),
+            admission_backlog_hard=_int_env("ADMISSION_BACKLOG_HARD", 100),
+            admission_latency_soft=_float_env("ADMISSION_LATENCY_SOFT", 180.0),
+            admission_latency_hard=_float_env("ADMISSION_LATENCY_HARD", 600.0),
+            admission_interval=_float_env("ADMISSION_INTERVAL", 5.0),
+            admission_overload_max_clients=_int_env("ADMISSION_OVERLOAD_MAX_CLIENTS", 1),
+            admission_auto_reply=os.getenv(
+                "ADMISSION_AUTO_REPLY",
+                "Сейчас у нас много обращений. Опишите, пожалуйста, вопрос подробно одним "
+                "сообщением — так оператор сможет ответить быстрее.",
+            ).strip(),
+            webhook_url=os.getenv("WEBHOOK_URL", "").strip(),
+            webhook_listen=os.getenv("WEBHOOK_LISTEN", "127.0.0.1"),
+            webhook_port=_int_env("WEBHOOK_PORT", 8080),
+            webhook_path="/" + os.getenv("WEBHOOK_PATH", "telegram").strip().lstrip("/"),
+            webhook_secret=os.getenv("WEBHOOK_SECRET", ""),
+            operator_max_clients=_int_env("OPERATOR_MAX_CLIENTS", 0),
+            waiting_dispatch_batch=_int_env("WAITING_DISPATCH_BATCH", 50),
+            conversation_idle_ttl=_float_env("CONVERSATION_IDLE_TTL", 86400.0),
+            reaper_interval=_float_env("REAPER_INTERVAL", 300.0),
+            reaper_batch=_int_env("REAPER_BATCH", 500),
+            operator_idle_timeout=_float_env("OPERATOR_IDLE_TIMEOUT", 900.0),
+            operator_idle_status=operator_idle_status,
+            operator_presence_interval=_float_env("OPERATOR_PRESENCE_INTERVAL", 60.0),
+            metrics_listen=os.getenv("METRICS_LISTEN", "127.0.0.1"),
+            metrics_port=_int_env("METRICS_PORT", 0),
+            transcripts=_bool_env("TRANSCRIPTS", True),
+            transcript_dir=Path(
+                os.getenv("TRANSCRIPT_DIR", str(data_dir / "transcripts"))
+            ).resolve(),
+            transcript_segment_bytes=_int_env("TRANSCRIPT_SEGMENT_BYTES", 1048576),
+            history_limit=_int_env("HISTORY_LIMIT", 50),
+            broadcast_admins=_int_list_env("BROADCAST_ADMINS"),
+            broadcast_concurrency=_int_env("BROADCAST_CONCURRENCY", 20),
+            broadcast_checkpoint_every=_int_env("BROADCAST_CHECKPOINT_EVERY", 100),
+            profile_admins=_int_list_env("PROFILE_ADMINS"),
+            profile_dir=Path(os.getenv("PROFILE_DIR", str(data_dir / "profiles"))).resolve(),
+            profile_updates=_int_env("PROFILE_UPDATES", 1000),
+            profile_seconds=_float_env("PROFILE_SECONDS", 60.0),
+            profile_tracemalloc_frames=_int_env("PROFILE_TRACEMALLOC_FRAMES", 1),
         )
 
 
-settings = Settings.from_env()
+def load_settings(env_file: Optional[str] = None) -> Settings:
+    """Read ``.env`` and the environment into Settings; nothing is read on import."""
+    load_dotenv(env_file)
+    return Settings.from_env()
 
 
-__all__ = ["settings"]
+__all__ = ["Settings", "load_settings"]
 
@@ -1,11 +1,17 @@
 from __future__ import annotations
 
+import heapq
+import time
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from enum import Enum
-from typing import Dict, List, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
 
-from .storage import JsonStore
+from .storage import Mutation, StateStore, delete_mutation, set_mutation
+
+
+OperatorListener = Callable[[int], None]
 
 
 def utcnow() -> str:
@@ -18,7 +24,7 @@ class OperatorStatus(str, Enum):
     OFFLINE = "offline"
 
 
-@dataclass
+@dataclass(slots=True)
 class Operator:
     chat_id: int
     username: str
@@ -27,6 +33,10 @@ class Operator:
     active_client: Optional[int]
     registered_at: str
     updated_at: str
+    last_seen: str
+    skills: List[str]
+    # Busy only because the scheduler's per-operator cap was reached, not by choice.
+    capped: bool = False
 
     def to_dict(self) -> Dict:
         return {
@@ -37,6 +47,9 @@ class Operator:
             "active_client": self.active_client,
             "registered_at": self.registered_at,
             "updated_at": self.updated_at,
+            "last_seen": self.last_seen,
+            "skills": list(self.skills),
+            "capped": self.capped,
         }
 
     @classmethod
@@ -49,39 +62,122 @@ class Operator:
             active_client=payload.get("active_client"),
             registered_at=payload.get("registered_at", utcnow()),
             updated_at=payload.get("updated_at", utcnow()),
+            last_seen=payload.get("last_seen") or utcnow(),
+            skills=list(payload.get("skills") or []),
+            capped=bool(payload.get("capped")),
         )
 
 
 class OperatorManager:
-    def __init__(self, store: JsonStore, allowlist: Optional[List[int]] = None):
+    """Live ``Operator`` objects; returned ones are shared, so change them through the manager."""
+
+    def __init__(
+        self,
+        store: StateStore,
+        allowlist: Optional[List[int]] = None,
+        last_seen_persist_interval: float = 60.0,
+    ):
         self._store = store
         self._allowlist = allowlist or []
-        self._state = self._load_state()
+        self._version = store.data_version()
+        self._operators: Dict[int, Operator] = {}
+        self._available: Set[int] = set()
+        # Time spent with the bot down is not operator absence.
+        self._presence_floor = utcnow()
+        self._presence: List[Tuple[str, int]] = []
+        self._presence_stamps: Dict[int, str] = {}
+        self._last_seen_persist_interval = last_seen_persist_interval
+        self._last_seen_persisted: Dict[int, float] = {}
+        self._read_operators()
+        self._listeners: List[OperatorListener] = []
+
+    def subscribe(self, listener: OperatorListener) -> None:
+        """Call ``listener(chat_id)`` after every change to that operator."""
+        self._listeners.append(listener)
 
     def _load_state(self) -> Dict[str, Dict]:
+        if self._store.lazy:
+            return {"operators": dict(self._store.iter_records("operators"))}
         payload = self._store.load()
         if "operators" not in payload:
             payload = {"operators": {}}
             self._store.persist(payload)
         return payload
 
-    def _save(self) -> None:
-        self._store.persist(self._state)
+    def _read_operators(self) -> None:
+        self._operators = {}
+        self._available = set()
+        self._presence_stamps = {}
+        for payload in self._load_state()["operators"].values():
+            operator = Operator.from_dict(payload)
+            self._operators[operator.chat_id] = operator
+            if operator.status == OperatorStatus.AVAILABLE:
+                self._available.add(operator.chat_id)
+            if operator.status != OperatorStatus.OFFLINE:
+                self._presence_stamps[operator.chat_id] = self._seen_stamp(operator)
+        self._presence = [(stamp, chat_id) for chat_id, stamp in self._presence_stamps.items()]
+        heapq.heapify(self._presence)
+
+    def _seen_stamp(self, operator: Operator) -> str:
+        return max(operator.last_seen, self._presence_floor)
+
+    def _track_presence(self, chat_id: int, stamp: str) -> None:
+        self._presence_stamps[chat_id] = stamp
+        heapq.heappush(self._presence, (stamp, chat_id))
+
+    def sync(self) -> None:
+        """Drop the cached records if another process has written to a shared store."""
+        if not self._store.shared:
+            return
+        version = self._store.data_version()
+        if version == self._version:
+            return
+        self._version = version
+        previous = self._operators
+        self._read_operators()
+        for chat_id in previous.keys() | self._operators.keys():
+            if previous.get(chat_id) != self._operators.get(chat_id):
+                for listener in self._listeners:
+                    listener(chat_id)
+
+    def _snapshot(self) -> Dict[str, Dict]:
+        return {
+            "operators": {
+                str(chat_id): operator.to_dict() for chat_id, operator in self._operators.items()
+            }
+        }
+
+    def _store_operator(self, operator: Operator) -> None:
+        self._operators[operator.chat_id] = operator
+        if operator.status == OperatorStatus.AVAILABLE:
+            self._available.add(operator.chat_id)
+        else:
+            self._available.discard(operator.chat_id)
+        if (
+            operator.status != OperatorStatus.OFFLINE
+            and operator.chat_id not in self._presence_stamps
+        ):
+            self._track_presence(operator.chat_id, self._seen_stamp(operator))
+        self._store.commit(
+            self._snapshot,
+            [set_mutation(("operators", str(operator.chat_id)), operator.to_dict())],
+        )
+        for listener in self._listeners:
+            listener(operator.chat_id)
 
     def _ensure_allowed(self, chat_id: int) -> bool:
         return not self._allowlist or chat_id in self._allowlist
 
     def is_operator(self, chat_id: int) -> bool:
-        return str(chat_id) in self._state["operators"]
+        return chat_id in self._operators
 
     def upsert_operator(self, chat_id: int, username: str, display_name: str) -> Operator:
         if not self._ensure_allowed(chat_id):
             raise PermissionError("Нельзя регистрировать оператора без разрешения владельца.")
 
-        key = str(chat_id)
         now = utcnow()
-        if key in self._state["operators"]:
-            operator = Operator.from_dict(self._state["operators"][key])
+        operator = self._operators.get(chat_id)
+        if operator is not None:
             operator.username = username
             operator.display_name = display_name
             operator.updated_at = now
@@ -94,97 +190,326 @@ class OperatorManager:
                 active_client=None,
                 registered_at=now,
                 updated_at=now,
+                last_seen=now,
+                skills=[],
             )
-        self._state["operators"][key] = operator.to_dict()
-        self._save()
+        self._store_operator(operator)
         return operator
 
-    def set_status(self, chat_id: int, status: OperatorStatus) -> Operator:
+    def set_status(self, chat_id: int, status: OperatorStatus, capped: bool = False) -> Operator:
         operator = self.get_operator(chat_id)
         operator.status = status
+        operator.capped = capped
         if status == OperatorStatus.OFFLINE:
             operator.active_client = None
         operator.updated_at = utcnow()
-        self._state["operators"][str(chat_id)] = operator.to_dict()
-        self._save()
+        self._store_operator(operator)
+        return operator
+
+    def set_skills(self, chat_id: int, skills: List[str]) -> Operator:
+        operator = self.get_operator(chat_id)
+        operator.skills = list(skills)
+        operator.updated_at = utcnow()
+        self._store_operator(operator)
         return operator
 
     def set_active_client(self, chat_id: int, client_id: Optional[int]) -> Operator:
         operator = self.get_operator(chat_id)
         operator.active_client = client_id
         operator.updated_at = utcnow()
-        self._state["operators"][str(chat_id)] = operator.to_dict()
-        self._save()
+        self._store_operator(operator)
         return operator
 
+    def touch(self, chat_id: int) -> None:
+        """Note that the operator is around; unknown chats are ignored."""
+        operator = self._operators.get(chat_id)
+        if operator is None:
+            return
+        operator.last_seen = utcnow()
+        if operator.status != OperatorStatus.OFFLINE and chat_id not in self._presence_stamps:
+            self._track_presence(chat_id, operator.last_seen)
+        now = time.monotonic()
+        if now - self._last_seen_persisted.get(chat_id, 0.0) >= self._last_seen_persist_interval:
+            self._last_seen_persisted[chat_id] = now
+            self._store.commit(
+                self._snapshot,
+                [set_mutation(("operators", str(chat_id), "last_seen"), operator.last_seen)],
+            )
+
+    def quiet_operators(self, older_than: str) -> List[int]:
+        """Operators that are not offline and have not been seen since ``older_than``."""
+        quiet: List[int] = []
+        now = utcnow()
+        while self._presence and self._presence[0][0] < older_than:
+            stamp, chat_id = heapq.heappop(self._presence)
+            if self._presence_stamps.get(chat_id) != stamp:
+                continue
+            operator = self._operators.get(chat_id)
+            if operator is None or operator.status == OperatorStatus.OFFLINE:
+                del self._presence_stamps[chat_id]
+                continue
+            seen = self._seen_stamp(operator)
+            if seen >= older_than:
+                self._track_presence(chat_id, seen)
+                continue
+            quiet.append(chat_id)
+            self._track_presence(chat_id, now)
+        return quiet
+
     def get_operator(self, chat_id: int) -> Operator:
-        key = str(chat_id)
-        if key not in self._state["operators"]:
+        operator = self._operators.get(chat_id)
+        if operator is None:
             raise KeyError("Оператор не найден. Сначала выполните регистрацию.")
-        return Operator.from_dict(self._state["operators"][key])
+        return operator
 
     def list_operators(self) -> List[Operator]:
-        return [
-            Operator.from_dict(payload)
-            for payload in self._state["operators"].values()
-        ]
+        return list(self._operators.values())
 
     def available_operator_ids(self) -> List[int]:
-        return [
-            op.chat_id
-            for op in self.list_operators()
-            if op.status == OperatorStatus.AVAILABLE
-        ]
+        return list(self._available)
+
+
+@dataclass
+class ActivityFlushStats:
+    flushes: int = 0
+    records: int = 0
+    total_seconds: float = 0.0
+    last_seconds: float = 0.0
 
 
 class ConversationManager:
-    def __init__(self, store: JsonStore):
+    """Conversations by client chat id plus an operator -> clients index."""
+
+    def __init__(
+        self,
+        store: StateStore,
+        activity_flush_interval: float = 30.0,
+        activity_flush_batch: int = 100,
+    ):
         self._store = store
+        self._version = store.data_version()
         self._state = self._load_state()
+        self._listeners: List[OperatorListener] = []
+        self._clients_by_operator: Dict[int, Set[int]] = {}
+        self._expiry: List[Tuple[str, int]] = []
+        self._expiry_stamps: Dict[int, str] = {}
+        for key, record in self._state["conversations"].items():
+            self._index_client(int(key), int(record["operator_id"]))
+            self._expiry_stamps[int(key)] = record.get("last_activity", "")
+        self._expiry = [(stamp, client) for client, stamp in self._expiry_stamps.items()]
+        heapq.heapify(self._expiry)
+        self._activity_flush_interval = activity_flush_interval
+        self._activity_flush_batch = activity_flush_batch
+        self._dirty_activity: Set[str] = set()
+        self._last_activity_flush = time.monotonic()
+        self.activity_stats = ActivityFlushStats()
+
+    def subscribe(self, listener: OperatorListener) -> None:
+        """Call ``listener(operator_chat_id)`` whenever that operator's client set changes."""
+        self._listeners.append(listener)
+
+    def _notify(self, operator_chat_id: int) -> None:
+        for listener in self._listeners:
+            listener(operator_chat_id)
+
+    def sync(self) -> None:
+        """
+        Drop the cached records and index if another process has written to a shared store.
+        Pending activity is flushed first.
+        """
+        if not self._store.shared:
+            return
+        version = self._store.data_version()
+        if version == self._version:
+            return
+        self._version = version
+        self.flush_activity()
+        self._state["conversations"].clear()
+        stale = list(self._clients_by_operator)
+        self._clients_by_operator.clear()
+        for operator_chat_id in stale:
+            self._notify(operator_chat_id)
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Hold the store's transaction and start from state no older than its beginning."""
+        with self._store.transaction():
+            self.sync()
+            yield
 
     def _load_state(self) -> Dict[str, Dict]:
+        if self._store.lazy:
+            return {"conversations": {}}
         payload = self._store.load()
         if "conversations" not in payload:
             payload = {"conversations": {}}
             self._store.persist(payload)
         return payload
 
-    def _save(self) -> None:
-        self._store.persist(self._state)
-
-    def bind_client(self, client_chat_id: int, operator_chat_id: int, client_name: str) -> None:
+    def _snapshot(self) -> Dict[str, Dict]:
+        return self._state
+
+    def _commit(self, *mutations: Mutation) -> None:
+        self._store.commit(self._snapshot, mutations)
+
+    def _record(self, key: str) -> Optional[Dict]:
+        record = self._state["conversations"].get(key)
+        if record is None and self._store.lazy:
+            record = self._store.get_record("conversations", key)
+            if record is not None:
+                self._state["conversations"][key] = record
+        return record
+
+    def _clients(self, operator_chat_id: int) -> Set[int]:
+        clients = self._clients_by_operator.get(operator_chat_id)
+        if clients is None:
+            clients = set()
+            if self._store.lazy:
+                clients.update(
+                    int(key)
+                    for key in self._store.keys_where(
+                        "conversations", "operator_id", operator_chat_id
+                    )
+                )
+            self._clients_by_operator[operator_chat_id] = clients
+        return clients
+
+    def _index_client(self, client_chat_id: int, operator_chat_id: int) -> None:
+        self._clients(operator_chat_id).add(client_chat_id)
+        self._notify(operator_chat_id)
+
+    def _unindex_client(self, client_chat_id: int, operator_chat_id: int) -> None:
+        clients = self._clients_by_operator.get(operator_chat_id)
+        if clients is None:
+            return
+        clients.discard(client_chat_id)
+        if not clients:
+            del self._clients_by_operator[operator_chat_id]
+        self._notify(operator_chat_id)
+
+    def _track_expiry(self, client_chat_id: int, stamp: str) -> None:
+        if self._store.lazy:
+            return
+        self._expiry_stamps[client_chat_id] = stamp
+        heapq.heappush(self._expiry, (stamp, client_chat_id))
+        if len(self._expiry) > 2 * len(self._expiry_stamps) + 64:
+            self._expiry = [(at, client) for client, at in self._expiry_stamps.items()]
+            heapq.heapify(self._expiry)
+
+    def bind_client(
+        self,
+        client_chat_id: int,
+        operator_chat_id: int,
+        client_name: str,
+        tags: Sequence[str] = (),
+    ) -> None:
         key = str(client_chat_id)
-        self._state["conversations"][key] = {
+        previous = self._record(key)
+        if previous:
+            self._unindex_client(client_chat_id, int(previous["operator_id"]))
+        self._index_client(client_chat_id, operator_chat_id)
+        record = {
             "operator_id": operator_chat_id,
             "client_name": client_name,
             "last_activity": utcnow(),
         }
-        self._save()
+        if tags:
+            record["tags"] = list(tags)
+        self._state["conversations"][key] = record
+        self._dirty_activity.discard(key)
+        self._track_expiry(client_chat_id, self._state["conversations"][key]["last_activity"])
+        self._commit(set_mutation(("conversations", key), self._state["conversations"][key]))
 
     def release_client(self, client_chat_id: int) -> None:
         key = str(client_chat_id)
-        if key in self._state["conversations"]:
+        record = self._record(key)
+        if record:
             del self._state["conversations"][key]
-            self._save()
+            self._unindex_client(client_chat_id, int(record["operator_id"]))
+            self._dirty_activity.discard(key)
+            self._expiry_stamps.pop(client_chat_id, None)
+            self._commit(delete_mutation(("conversations", key)))
 
     def get_operator_for_client(self, client_chat_id: int) -> Optional[int]:
-        record = self._state["conversations"].get(str(client_chat_id))
+        key = str(client_chat_id)
+        record = self._record(key)
         if not record:
             return None
         record["last_activity"] = utcnow()
-        self._save()
+        self._dirty_activity.add(key)
+        if self._activity_flush_due():
+            self.flush_activity()
         return int(record["operator_id"])
 
+    def idle_clients(self, older_than: str, limit: int) -> List[int]:
+        """Up to ``limit`` clients idle since before ``older_than``, oldest first."""
+        if self._store.lazy:
+            # Flush first so that the store's index reflects activity buffered in memory.
+            self.flush_activity()
+            keys = self._store.keys_below("conversations", "last_activity", older_than, limit)
+            return [
+                int(key)
+                for key in keys
+                if (record := self._record(key)) and record["last_activity"] < older_than
+            ]
+        idle: List[int] = []
+        while self._expiry and self._expiry[0][0] < older_than and len(idle) < limit:
+            stamp, client_chat_id = heapq.heappop(self._expiry)
+            if self._expiry_stamps.get(client_chat_id) != stamp:
+                continue
+            record = self._state["conversations"].get(str(client_chat_id))
+            if record is None:
+                del self._expiry_stamps[client_chat_id]
+            elif record["last_activity"] >= older_than:
+                self._track_expiry(client_chat_id, record["last_activity"])
+            else:
+                del self._expiry_stamps[client_chat_id]
+                idle.append(client_chat_id)
+        return idle
+
+    def _activity_flush_due(self) -> bool:
+        return (
+            len(self._dirty_activity) >= self._activity_flush_batch
+            or time.monotonic() - self._last_activity_flush >= self._activity_flush_interval
+        )
+
+    def flush_activity(self) -> int:
+        """Persist pending ``last_activity`` updates in one commit; returns the count."""
+        self._last_activity_flush = time.monotonic()
+        if not self._dirty_activity:
+            return 0
+        conversations = self._state["conversations"]
+        mutations = [
+            set_mutation(("conversations", key, "last_activity"), conversations[key]["last_activity"])
+            for key in self._dirty_activity
+            if key in conversations
+        ]
+        self._dirty_activity.clear()
+        started = time.perf_counter()
+        self._commit(*mutations)
+        elapsed = time.perf_counter() - started
+        self.activity_stats.flushes += 1
+        self.activity_stats.records += len(mutations)
+        self.activity_stats.total_seconds += elapsed
+        self.activity_stats.last_seconds = elapsed
+        return len(mutations)
+
     def get_clients_for_operator(self, operator_chat_id: int) -> List[int]:
-        result = []
-        for client_id, record in self._state["conversations"].items():
-            if int(record["operator_id"]) == operator_chat_id:
-                result.append(int(client_id))
-        return result
+        return sorted(self._clients(operator_chat_id))
+
+    def client_count(self, operator_chat_id: int) -> int:
+        return len(self._clients(operator_chat_id))
+
+    def has_client(self, operator_chat_id: int, client_chat_id: int) -> bool:
+        return client_chat_id in self._clients(operator_chat_id)
 
     def conversation_snapshot(self) -> Dict[str, Dict]:
+        if self._store.lazy:
+            snapshot = dict(self._store.iter_records("conversations"))
+            snapshot.update(self._state["conversations"])
+            return snapshot
         return self._state["conversations"].copy()
 
     def get_client_record(self, client_chat_id: int) -> Optional[Dict]:
-        return self._state["conversations"].get(str(client_chat_id))
+        return self._record(str(client_chat_id))
 
@@ -0,0 +1,51 @@
+"""
+Copy the JSON state into a SQLite database.
+
+    python -m src.migrate --data-dir data --db data/bot.sqlite3
+"""
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+from typing import Dict
+
+from .sqlite_storage import SqliteStore
+from .storage import JournalStore
+
+COLLECTIONS = ("operators", "conversations", "waiting")
+
+
+def has_json_state(data_dir: Path) -> bool:
+    return any((data_dir / f"{name}.json").exists() for name in COLLECTIONS)
+
+
+def migrate_json_to_sqlite(data_dir: Path, target: SqliteStore) -> Dict[str, int]:
+    payload: Dict[str, Dict] = {}
+    for name in COLLECTIONS:
+        path = data_dir / f"{name}.json"
+        if not path.exists():
+            continue
+        # JournalStore also replays a journal left by STORAGE_MODE=journal; for a plain
+        # JSON file it just reads it.
+        payload[name] = JournalStore(path, {name: {}}).load().get(name, {})
+    target.persist(payload)
+    return {name: len(records) for name, records in payload.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Copy JSON bot state into SQLite.")
+    parser.add_argument("--data-dir", type=Path, default=Path("data"))
+    parser.add_argument("--db", type=Path, default=None, help="default: <data-dir>/bot.sqlite3")
+    args = parser.parse_args()
+    db_path = args.db or args.data_dir / "bot.sqlite3"
+    store = SqliteStore(db_path)
+    try:
+        counts = migrate_json_to_sqlite(args.data_dir, store)
+    finally:
+        store.close()
+    for name, count in counts.items():
+        print(f"{name}: {count} records -> {db_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Sequence
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+from .metrics import API_ERRORS, API_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# A timed out call may still have been delivered; repeating these would post a duplicate.
+NON_IDEMPOTENT_METHODS = frozenset({"send_message", "copy_message", "copy_messages"})
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available; zero means ``take`` may be called now."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill(now)
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self._rate
+
+    def take(self) -> None:
+        self._tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def is_full(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return now >= self._paused_until and self._tokens >= self._burst
+
+
+@dataclass
+class OutboundStats:
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    flood_waits: int = 0
+    backpressure_waits: int = 0
+    max_depth: int = 0
+
+
+@dataclass
+class _SendJob:
+    chat_id: int
+    method: str
+    kwargs: Dict[str, Any]
+    future: asyncio.Future
+    attempts: int = 0
+
+
+class OutboundSender:
+    """Rate-limited queue for Bot API calls, executed in order within a chat."""
+
+    def __init__(
+        self,
+        global_rate: float = 25.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        max_queue: int = 1000,
+        max_retries: int = 3,
+        workers: int = 8,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+    ):
+        self._global = TokenBucket(global_rate, max(1.0, global_rate))
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._max_retries = max_retries
+        self._workers_count = workers
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._slots = asyncio.Semaphore(max_queue)
+        self._chat_jobs: Dict[int, Deque[_SendJob]] = {}
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._ready: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._bot: Any = None
+        self._pending = 0
+        self.stats = OutboundStats()
+
+    @property
+    def depth(self) -> int:
+        return self._pending
+
+    def start(self, bot: Any) -> None:
+        self._bot = bot
+        self._ready = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._work(), name=f"outbound-{index}")
+            for index in range(self._workers_count)
+        ]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Wait up to ``timeout`` seconds for pending calls, then stop the workers."""
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        for jobs in self._chat_jobs.values():
+            for job in jobs:
+                if not job.future.done():
+                    job.future.cancel()
+        self._chat_jobs.clear()
+
+    async def call(self, method: str, **kwargs: Any) -> Any:
+        """Queue ``bot.<method>(**kwargs)`` behind earlier calls to ``kwargs["chat_id"]``."""
+        chat_id = kwargs["chat_id"]
+        if self._slots.locked():
+            self.stats.backpressure_waits += 1
+        await self._slots.acquire()
+        job = _SendJob(chat_id, method, kwargs, asyncio.get_running_loop().create_future())
+        self._pending += 1
+        self.stats.max_depth = max(self.stats.max_depth, self._pending)
+        jobs = self._chat_jobs.get(chat_id)
+        if jobs is None:
+            self._chat_jobs[chat_id] = deque([job])
+            self._ready.put_nowait(chat_id)
+        else:
+            jobs.append(job)
+        return await job.future
+
+    async def send_message(self, chat_id: int, text: str, **kwargs: Any) -> Any:
+        return await self.call("send_message", chat_id=chat_id, text=text, **kwargs)
+
+    async def copy_message(
+        self, chat_id: int, from_chat_id: int, message_id: int, **kwargs: Any
+    ) -> Any:
+        return await self.call(
+            "copy_message",
+            chat_id=chat_id,
+            from_chat_id=from_chat_id,
+            message_id=message_id,
+            **kwargs,
+        )
+
+    async def copy_messages(
+        self, chat_id: int, from_chat_id: int, message_ids: Sequence[int], **kwargs: Any
+    ) -> Any:
+        return await self.call(
+            "copy_messages",
+            chat_id=chat_id,
+            from_chat_id=from_chat_id,
+            message_ids=message_ids,
+            **kwargs,
+        )
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        return bucket
+
+    def _reschedule(self, chat_id: int, delay: float) -> None:
+        asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+
+    def _finish(self, chat_id: int) -> None:
+        jobs = self._chat_jobs[chat_id]
+        jobs.popleft()
+        self._pending -= 1
+        self._slots.release()
+        if jobs:
+            self._ready.put_nowait(chat_id)
+            return
+        del self._chat_jobs[chat_id]
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is not None and bucket.is_full():
+            del self._chat_buckets[chat_id]
+
+    async def _work(self) -> None:
+        while True:
+            chat_id = await self._ready.get()
+            # A chat id is in the ready queue at most once, so one worker owns the chat here.
+            job = self._chat_jobs[chat_id][0]
+            if job.future.cancelled():
+                self._finish(chat_id)
+                continue
+            bucket = self._bucket(chat_id)
+            wait = bucket.delay()
+            if wait > 0:
+                self._reschedule(chat_id, wait)
+                continue
+            while (wait := self._global.delay()) > 0:
+                await asyncio.sleep(wait)
+            self._global.take()
+            bucket.take()
+            started = time.perf_counter()
+            try:
+                result = await getattr(self._bot, job.method)(**job.kwargs)
+            except RetryAfter as error:
+                self._observe(job, started, "RetryAfter")
+                self.stats.flood_waits += 1
+                if self._retry(job, error):
+                    self._global.pause(float(error.retry_after))
+                    bucket.pause(float(error.retry_after))
+                    self._reschedule(chat_id, float(error.retry_after))
+                    continue
+                self._fail(job, error)
+            except NetworkError as error:
+                self._observe(job, started, type(error).__name__)
+                if self._retryable(job, error) and self._retry(job, error):
+                    delay = min(self._backoff_max, self._backoff_base * 2 ** (job.attempts - 1))
+                    self._reschedule(chat_id, delay)
+                    continue
+                self._fail(job, error)
+            except Exception as error:
+                self._observe(job, started, type(error).__name__)
+                self._fail(job, error)
+            else:
+                self._observe(job, started)
+                self.stats.sent += 1
+                if not job.future.done():
+                    job.future.set_result(result)
+            self._finish(chat_id)
+
+    def _observe(self, job: _SendJob, started: float, error: str = "") -> None:
+        API_SECONDS.observe(time.perf_counter() - started, job.method)
+        if error:
+            API_ERRORS.inc(job.method, error)
+
+    def _fail(self, job: _SendJob, error: Exception) -> None:
+        self.stats.failed += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def _retryable(self, job: _SendJob, error: NetworkError) -> bool:
+        if isinstance(error, BadRequest):
+            return False
+        return not (isinstance(error, TimedOut) and job.method in NON_IDEMPOTENT_METHODS)
+
+    def _retry(self, job: _SendJob, error: Exception) -> bool:
+        job.attempts += 1
+        if job.attempts > self._max_retries:
+            logger.warning(
+                "Giving up on %s to %s after %s attempts: %s",
+                job.method,
+                job.chat_id,
+                job.attempts,
+                error,
+            )
+            return False
+        self.stats.retries += 1
+        return True
@@ -0,0 +1,203 @@
+"""
+On-demand cProfile and tracemalloc profiling of live handlers.
+
+    python -m pstats data/profiles/profile-20260101-120000.prof
+"""
+from __future__ import annotations
+
+import cProfile
+import io
+import logging
+import pstats
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from pstats import SortKey
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+# tracemalloc's own bookkeeping and the import machinery only add noise to the growth list.
+ALLOCATION_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+@dataclass
+class HandlerTimes:
+    calls: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+
+@dataclass
+class FinishedProfile:
+    profile: cProfile.Profile
+    handlers: Dict[str, HandlerTimes]
+    updates: int
+    seconds: float
+    snapshot: Optional[tracemalloc.Snapshot]
+    stop_tracemalloc: bool
+
+
+@dataclass
+class ProfileReport:
+    dump: Path
+    summary: Path
+    updates: int
+    seconds: float
+    handlers: Dict[str, HandlerTimes]
+
+
+class Profiler:
+    """One session at a time; ``stop`` runs on the loop, ``write_report`` may run in a thread."""
+
+    def __init__(self, directory: Path, tracemalloc_frames: int = 1):
+        self.directory = directory
+        self.tracemalloc_frames = tracemalloc_frames
+        self.active = False
+        self.owner: Optional[int] = None
+        self._profile: Optional[cProfile.Profile] = None
+        self._handlers: Dict[str, HandlerTimes] = {}
+        self._updates = 0
+        self._limit_updates = 0
+        self._deadline = 0.0
+        self._started = 0.0
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._own_tracemalloc = False
+
+    def start(self, updates: int = 0, seconds: float = 0.0, owner: Optional[int] = None) -> bool:
+        """Begin a session limited by ``updates`` and ``seconds`` (0: no limit); False if busy."""
+        if self.active:
+            return False
+        self.owner = owner
+        self._handlers = {}
+        self._updates = 0
+        self._limit_updates = updates
+        self._started = time.monotonic()
+        self._deadline = self._started + seconds if seconds else 0.0
+        if self.tracemalloc_frames:
+            self._own_tracemalloc = not tracemalloc.is_tracing()
+            if self._own_tracemalloc:
+                tracemalloc.start(self.tracemalloc_frames)
+            self._snapshot = tracemalloc.take_snapshot().filter_traces(ALLOCATION_FILTERS)
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        self.active = True
+        logger.info("Profiling started (updates: %s, seconds: %s)", updates, seconds)
+        return True
+
+    def record(self, name: str, seconds: float) -> bool:
+        """Account one handled update; True once the session has reached its limits."""
+        times = self._handlers.get(name)
+        if times is None:
+            times = self._handlers[name] = HandlerTimes()
+        times.calls += 1
+        times.total += seconds
+        times.max = max(times.max, seconds)
+        self._updates += 1
+        return bool(
+            (self._limit_updates and self._updates >= self._limit_updates)
+            or (self._deadline and time.monotonic() >= self._deadline)
+        )
+
+    @property
+    def remaining_seconds(self) -> Optional[float]:
+        if not self.active or not self._deadline:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
+
+    def status(self) -> str:
+        if not self.active:
+            return "Профилирование выключено."
+        limits = []
+        if self._limit_updates:
+            limits.append(f"{self._updates}/{self._limit_updates} обновлений")
+        else:
+            limits.append(f"{self._updates} обновлений")
+        remaining = self.remaining_seconds
+        if remaining is not None:
+            limits.append(f"осталось {remaining:.0f} с")
+        return "Идёт профилирование: " + ", ".join(limits) + "."
+
+    def stop(self) -> Optional[FinishedProfile]:
+        """End the session; None if nothing was running. Cheap, so it can run on the loop."""
+        if not self.active or self._profile is None:
+            return None
+        self._profile.disable()
+        self.active = False
+        finished = FinishedProfile(
+            self._profile,
+            self._handlers,
+            self._updates,
+            time.monotonic() - self._started,
+            self._snapshot,
+            self._own_tracemalloc,
+        )
+        self._profile = None
+        self._snapshot = None
+        return finished
+
+    def write_report(self, finished: FinishedProfile) -> ProfileReport:
+        """Take the allocation snapshot, run pstats and write both files."""
+        allocations = self._allocation_lines(finished)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stem = f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        dump = self.directory / f"{stem}.prof"
+        summary = self.directory / f"{stem}.txt"
+        finished.profile.dump_stats(dump)
+        lines = [
+            f"{finished.updates} updates in {finished.seconds:.1f} s",
+            "",
+            "Handlers (wall time):",
+        ]
+        lines.extend(self._handler_lines(finished.handlers))
+        for title, sort in (("cumulative", SortKey.CUMULATIVE), ("own", SortKey.TIME)):
+            stream = io.StringIO()
+            stats = pstats.Stats(finished.profile, stream=stream)
+            stats.strip_dirs().sort_stats(sort).print_stats(TOP_FUNCTIONS)
+            lines.extend(["", f"Top functions by {title} time:", stream.getvalue().strip()])
+        if allocations:
+            lines.extend(["", "Memory growth by allocation site (tracemalloc):"])
+            lines.extend(allocations)
+        summary.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        logger.info("Profile of %s updates written to %s", finished.updates, summary)
+        return ProfileReport(dump, summary, finished.updates, finished.seconds, finished.handlers)
+
+    def _handler_lines(self, handlers: Dict[str, HandlerTimes]) -> List[str]:
+        total = sum(times.total for times in handlers.values()) or 1.0
+        lines = [f"{'handler':<12} {'calls':>7} {'total s':>9} {'mean ms':>9} {'max ms':>9} share"]
+        for name, times in sorted(handlers.items(), key=lambda item: -item[1].total):
+            lines.append(
+                f"{name:<12} {times.calls:>7} {times.total:>9.3f} "
+                f"{times.total / times.calls * 1000:>9.2f} {times.max * 1000:>9.2f} "
+                f"{times.total / total:>5.0%}"
+            )
+        return lines
+
+    def _allocation_lines(self, finished: FinishedProfile) -> List[str]:
+        if finished.snapshot is None:
+            return []
+        snapshot = tracemalloc.take_snapshot().filter_traces(ALLOCATION_FILTERS)
+        current, peak = tracemalloc.get_traced_memory()
+        if finished.stop_tracemalloc:
+            tracemalloc.stop()
+        key = "lineno" if self.tracemalloc_frames == 1 else "traceback"
+        lines = [f"traced: {current / 2**20:.1f} MiB now, {peak / 2**20:.1f} MiB peak"]
+        for stat in snapshot.compare_to(finished.snapshot, key)[:TOP_ALLOCATIONS]:
+            frame = stat.traceback[0]
+            lines.append(
+                f"{stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8} blocks "
+                f"{stat.size / 1024:10.1f} KiB  {frame.filename}:{frame.lineno}"
+            )
+        return lines
+
+
+__all__ = ["FinishedProfile", "HandlerTimes", "ProfileReport", "Profiler"]
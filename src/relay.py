@@ -0,0 +1,291 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from telegram import Message, MessageEntity
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest
+
+from .concurrency import KeyedLocks
+from .outbound import OutboundSender
+
+logger = logging.getLogger(__name__)
+
+RELAY_MODES = ("merged", "burst", "separate")
+# Telegram albums hold 2-10 items.
+ALBUM_MAX_ITEMS = 10
+
+ErrorCallback = Callable[[Exception], Awaitable[None]]
+AlbumKey = Tuple[int, int, str]
+
+
+def utf16_length(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def shift_entities(entities: Sequence[MessageEntity], by: int) -> List[MessageEntity]:
+    return [
+        MessageEntity(
+            type=entity.type,
+            offset=entity.offset + by,
+            length=entity.length,
+            url=entity.url,
+            user=entity.user,
+            language=entity.language,
+            custom_emoji_id=entity.custom_emoji_id,
+        )
+        for entity in entities
+    ]
+
+
+def can_carry_caption(message: Message) -> bool:
+    return bool(
+        message.photo
+        or message.video
+        or message.document
+        or message.audio
+        or message.animation
+        or message.voice
+    )
+
+
+@dataclass
+class RelayStats:
+    messages: int = 0
+    api_calls: int = 0
+    albums: int = 0
+
+
+@dataclass
+class _Album:
+    source_chat_id: int
+    target_chat_id: int
+    header: str
+    on_error: Optional[ErrorCallback]
+    deadline: float
+    message_ids: List[int] = field(default_factory=list)
+    task: Optional[asyncio.Task] = None
+    album: bool = True
+
+
+class Relay:
+    """Delivers a message to another chat with a sender header such as "📨 name"."""
+
+    def __init__(
+        self,
+        sender: OutboundSender,
+        mode: str = "merged",
+        burst_window: float = 60.0,
+        album_window: float = 1.0,
+    ):
+        if mode not in RELAY_MODES:
+            raise ValueError(f"Unknown relay mode: {mode}")
+        self._sender = sender
+        self._mode = mode
+        self._burst_window = burst_window
+        self._album_window = album_window
+        self._locks = KeyedLocks()
+        self._last_sender: Dict[int, Tuple[int, float]] = {}
+        self._albums: Dict[AlbumKey, _Album] = {}
+        self._flushing: Set[asyncio.Task] = set()
+        self.stats = RelayStats()
+
+    def _continues_burst(self, source_chat_id: int, target_chat_id: int) -> bool:
+        last = self._last_sender.get(target_chat_id)
+        return (
+            last is not None
+            and last[0] == source_chat_id
+            and time.monotonic() - last[1] < self._burst_window
+        )
+
+    async def relay(
+        self,
+        message: Message,
+        target_chat_id: int,
+        header: str,
+        on_error: Optional[ErrorCallback] = None,
+    ) -> None:
+        if message.media_group_id and self._album_window > 0:
+            await self._add_to_album(message, target_chat_id, header, on_error)
+            return
+        await self._flush_albums(message.chat_id, target_chat_id)
+        # Holding the target lock keeps a separate notice next to its copy.
+        async with self._locks.hold(target_chat_id):
+            self.stats.messages += 1
+            if self._mode == "burst" and self._continues_burst(message.chat_id, target_chat_id):
+                await self._copy(message, target_chat_id)
+            elif self._mode == "separate":
+                await self._send_separately(message, target_chat_id, header)
+            else:
+                await self._send_attributed(message, target_chat_id, header)
+            self._last_sender[target_chat_id] = (message.chat_id, time.monotonic())
+
+    async def _add_to_album(
+        self,
+        message: Message,
+        target_chat_id: int,
+        header: str,
+        on_error: Optional[ErrorCallback],
+    ) -> None:
+        key = (message.chat_id, target_chat_id, message.media_group_id)
+        album = self._albums.get(key)
+        if album is None:
+            await self._flush_albums(message.chat_id, target_chat_id)
+            album = _Album(message.chat_id, target_chat_id, header, on_error, 0.0)
+            self._albums[key] = album
+            album.task = self._track(self._send_album_later(key, album))
+        album.message_ids.append(message.message_id)
+        album.deadline = time.monotonic() + self._album_window
+        if len(album.message_ids) >= ALBUM_MAX_ITEMS:
+            self._start_flush(key)
+
+    async def _send_album_later(self, key: AlbumKey, album: _Album) -> None:
+        while (delay := album.deadline - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+        if self._albums.get(key) is album:
+            del self._albums[key]
+            await self._send_album(album)
+
+    def _track(self, coroutine: Awaitable[None]) -> asyncio.Task:
+        task = asyncio.ensure_future(coroutine)
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+        return task
+
+    def _start_flush(self, key: AlbumKey) -> asyncio.Task:
+        album = self._albums.pop(key)
+        if album.task is not None:
+            album.task.cancel()
+            self._flushing.discard(album.task)
+        return self._track(self._send_album(album))
+
+    async def _flush_albums(self, source_chat_id: int, target_chat_id: int) -> None:
+        keys = [key for key in self._albums if key[:2] == (source_chat_id, target_chat_id)]
+        if keys:
+            await asyncio.gather(*(self._start_flush(key) for key in keys))
+
+    async def flush(self) -> None:
+        """Send every buffered album now, e.g. before stopping the outbound sender."""
+        for key in list(self._albums):
+            self._start_flush(key)
+        if self._flushing:
+            await asyncio.gather(*self._flushing)
+
+    async def relay_messages(
+        self,
+        source_chat_id: int,
+        target_chat_id: int,
+        message_ids: Sequence[int],
+        header: str,
+        on_error: Optional[ErrorCallback] = None,
+    ) -> None:
+        """Relay earlier messages of one sender, e.g. those written while queued, in one call."""
+        await self._flush_albums(source_chat_id, target_chat_id)
+        await self._send_album(
+            _Album(
+                source_chat_id,
+                target_chat_id,
+                header,
+                on_error,
+                0.0,
+                list(message_ids),
+                album=False,
+            )
+        )
+
+    async def _send_album(self, album: _Album) -> None:
+        # copy_messages needs strictly increasing ids; a repeated item would fail the call.
+        message_ids = sorted(set(album.message_ids))
+        try:
+            async with self._locks.hold(album.target_chat_id):
+                self.stats.messages += len(message_ids)
+                self.stats.albums += album.album
+                if not (
+                    self._mode == "burst"
+                    and self._continues_burst(album.source_chat_id, album.target_chat_id)
+                ):
+                    self.stats.api_calls += 1
+                    await self._sender.send_message(
+                        chat_id=album.target_chat_id, text=album.header
+                    )
+                self.stats.api_calls += 1
+                try:
+                    await self._sender.copy_messages(
+                        chat_id=album.target_chat_id,
+                        from_chat_id=album.source_chat_id,
+                        message_ids=message_ids,
+                    )
+                except BadRequest as error:
+                    logger.warning(
+                        "copy_messages to %s failed, copying one by one: %s",
+                        album.target_chat_id,
+                        error,
+                    )
+                    await self._copy_one_by_one(album, message_ids)
+                self._last_sender[album.target_chat_id] = (album.source_chat_id, time.monotonic())
+        except Exception as error:
+            logger.error("Failed to relay an album to %s: %s", album.target_chat_id, error)
+            if album.on_error is None:
+                return
+            try:
+                await album.on_error(error)
+            except Exception:
+                logger.exception("Album error callback failed for %s", album.target_chat_id)
+
+    async def _copy_one_by_one(self, album: _Album, message_ids: List[int]) -> None:
+        """Copy what still can be, e.g. when one message was deleted; re-raise the last error."""
+        failure: Optional[BadRequest] = None
+        for message_id in message_ids:
+            self.stats.api_calls += 1
+            try:
+                await self._sender.copy_message(
+                    chat_id=album.target_chat_id,
+                    from_chat_id=album.source_chat_id,
+                    message_id=message_id,
+                )
+            except BadRequest as error:
+                failure = error
+        if failure is not None:
+            raise failure
+
+    async def _copy(self, message: Message, target_chat_id: int, **kwargs: Any) -> None:
+        self.stats.api_calls += 1
+        await self._sender.copy_message(
+            chat_id=target_chat_id,
+            from_chat_id=message.chat_id,
+            message_id=message.message_id,
+            **kwargs,
+        )
+
+    async def _send_separately(self, message: Message, target_chat_id: int, header: str) -> None:
+        self.stats.api_calls += 1
+        await self._sender.send_message(chat_id=target_chat_id, text=header)
+        await self._copy(message, target_chat_id)
+
+    async def _send_attributed(self, message: Message, target_chat_id: int, header: str) -> None:
+        shift = utf16_length(header) + 1
+        if message.text is not None:
+            text = f"{header}\n{message.text}"
+            if len(text) <= MessageLimit.MAX_TEXT_LENGTH:
+                self.stats.api_calls += 1
+                await self._sender.send_message(
+                    chat_id=target_chat_id,
+                    text=text,
+                    entities=shift_entities(message.entities, shift),
+                )
+                return
+        elif can_carry_caption(message):
+            caption = f"{header}\n{message.caption}" if message.caption else header
+            if len(caption) <= MessageLimit.CAPTION_LENGTH:
+                await self._copy(
+                    message,
+                    target_chat_id,
+                    caption=caption,
+                    caption_entities=shift_entities(message.caption_entities, shift),
+                )
+                return
+        await self._send_separately(message, target_chat_id, header)
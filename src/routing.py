@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import re
+from typing import Dict, Iterable, List, Optional
+
+TAG_PATTERN = re.compile(r"\w+")
+
+
+def normalize_tags(words: Iterable[str]) -> List[str]:
+    """Lowercase tags without duplicates, in the order given; other characters are dropped."""
+    tags: Dict[str, None] = {}
+    for word in words:
+        for tag in TAG_PATTERN.findall(word.lower()):
+            tags[tag] = None
+    return list(tags)
+
+
+def tags_from_start_payload(payload: str) -> List[str]:
+    """Tags from a deep link such as ``t.me/<bot>?start=ru-cards-vip``."""
+    return normalize_tags(payload.split("-"))
+
+
+class KeywordRules:
+    """Client tags from message text, configured as ``tag=keyword,keyword;...``."""
+
+    def __init__(self, rules: Dict[str, List[str]]):
+        tags: Dict[str, List[str]] = {}
+        spelling: Dict[str, str] = {}
+        for tag, keywords in rules.items():
+            for keyword in keywords:
+                spelling.setdefault(keyword.casefold(), keyword)
+                tags.setdefault(keyword.casefold(), []).extend(normalize_tags([tag]))
+        # A case-insensitive match need not casefold back to the keyword (İ -> i̇), so each
+        # keyword gets a group and the match is mapped back through its name.
+        keys = sorted(tags, key=len, reverse=True)
+        self._tags: List[List[str]] = [tags[key] for key in keys]
+        self._pattern: Optional[re.Pattern] = None
+        if keys:
+            alternatives = "|".join(
+                f"(?P<k{index}>{re.escape(spelling[key])})" for index, key in enumerate(keys)
+            )
+            self._pattern = re.compile(rf"(?<!\w)(?:{alternatives})(?!\w)", re.IGNORECASE)
+
+    def __bool__(self) -> bool:
+        return self._pattern is not None
+
+    def tags_for(self, text: Optional[str]) -> List[str]:
+        if not text or self._pattern is None:
+            return []
+        return normalize_tags(
+            tag
+            for match in self._pattern.finditer(text)
+            for tag in self._tags[int(match.lastgroup[1:])]
+        )
+
+__all__ = ["KeywordRules", "normalize_tags", "tags_from_start_payload"]
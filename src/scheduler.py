@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import heapq
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Set, Tuple
+
+from .managers import ConversationManager, OperatorManager, OperatorStatus
+
+
+class SchedulingPolicy:
+    """Orders available operators. ``update``/``remove`` are called on every change."""
+
+    def update(self, chat_id: int, load: int, updated_at: str) -> None:
+        raise NotImplementedError
+
+    def remove(self, chat_id: int) -> None:
+        raise NotImplementedError
+
+    def pick(self, max_clients: int = 0) -> Optional[int]:
+        raise NotImplementedError
+
+
+class LeastLoadedPolicy(SchedulingPolicy):
+    """Min-heap by (load, updated_at); stale entries are dropped when they reach the top."""
+
+    def __init__(self) -> None:
+        self._heap: List[Tuple[int, str, int]] = []
+        self._keys: Dict[int, Tuple[int, str]] = {}
+
+    def update(self, chat_id: int, load: int, updated_at: str) -> None:
+        key = (load, updated_at)
+        if self._keys.get(chat_id) == key:
+            return
+        self._keys[chat_id] = key
+        heapq.heappush(self._heap, (load, updated_at, chat_id))
+        if len(self._heap) > 2 * len(self._keys) + 64:
+            self._heap = [(load, at, op) for op, (load, at) in self._keys.items()]
+            heapq.heapify(self._heap)
+
+    def remove(self, chat_id: int) -> None:
+        self._keys.pop(chat_id, None)
+
+    def pick(self, max_clients: int = 0) -> Optional[int]:
+        while self._heap:
+            load, updated_at, chat_id = self._heap[0]
+            if self._keys.get(chat_id) != (load, updated_at):
+                heapq.heappop(self._heap)
+                continue
+            if max_clients and load >= max_clients:
+                return None
+            return chat_id
+        return None
+
+
+class RoundRobinPolicy(SchedulingPolicy):
+    """Hands new clients to available operators in turn, skipping those at the cap."""
+
+    def __init__(self) -> None:
+        self._order: Deque[int] = deque()
+        self._queued: Set[int] = set()
+        self._loads: Dict[int, int] = {}
+
+    def update(self, chat_id: int, load: int, updated_at: str) -> None:
+        self._loads[chat_id] = load
+        if chat_id not in self._queued:
+            self._queued.add(chat_id)
+            self._order.append(chat_id)
+
+    def remove(self, chat_id: int) -> None:
+        self._loads.pop(chat_id, None)
+
+    def pick(self, max_clients: int = 0) -> Optional[int]:
+        for _ in range(len(self._order)):
+            chat_id = self._order[0]
+            if chat_id not in self._loads:
+                self._order.popleft()
+                self._queued.discard(chat_id)
+                continue
+            self._order.rotate(-1)
+            if max_clients and self._loads[chat_id] >= max_clients:
+                continue
+            return chat_id
+        return None
+
+
+class SkillIndex:
+    """Skill tag -> available operators with that tag."""
+
+    def __init__(self) -> None:
+        self._by_tag: Dict[str, Set[int]] = {}
+        self._tags: Dict[int, Tuple[str, ...]] = {}
+        self._keys: Dict[int, Tuple[int, str]] = {}
+
+    def update(self, chat_id: int, tags: Sequence[str], load: int, updated_at: str) -> None:
+        self._keys[chat_id] = (load, updated_at)
+        tags = tuple(tags)
+        if self._tags.get(chat_id) == tags:
+            return
+        self.remove(chat_id)
+        self._keys[chat_id] = (load, updated_at)
+        self._tags[chat_id] = tags
+        for tag in tags:
+            self._by_tag.setdefault(tag, set()).add(chat_id)
+
+    def remove(self, chat_id: int) -> None:
+        self._keys.pop(chat_id, None)
+        for tag in self._tags.pop(chat_id, ()):
+            operators = self._by_tag[tag]
+            operators.discard(chat_id)
+            if not operators:
+                del self._by_tag[tag]
+
+    def match(self, tags: Sequence[str]) -> Set[int]:
+        """Operators that have every tag in ``tags``; empty if ``tags`` is."""
+        sets = sorted((self._by_tag.get(tag, set()) for tag in set(tags)), key=len)
+        if not sets or not sets[0]:
+            return set()
+        matched = set(sets[0])
+        for operators in sets[1:]:
+            matched &= operators
+            if not matched:
+                break
+        return matched
+
+    def best(self, tags: Sequence[str], max_clients: int = 0) -> Optional[int]:
+        """The least-loaded operator with all ``tags``, else the one with the most of them."""
+        candidates = self.match(tags)
+        if max_clients:
+            candidates = {op for op in candidates if self._keys[op][0] < max_clients}
+        if not candidates:
+            counts: Dict[int, int] = {}
+            for tag in set(tags):
+                for op in self._by_tag.get(tag, ()):
+                    if not max_clients or self._keys[op][0] < max_clients:
+                        counts[op] = counts.get(op, 0) + 1
+            if not counts:
+                return None
+            most = max(counts.values())
+            candidates = {op for op, count in counts.items() if count == most}
+        return min(candidates, key=lambda op: (self._keys[op], op))
+
+
+POLICIES = {
+    "least_loaded": LeastLoadedPolicy,
+    "round_robin": RoundRobinPolicy,
+}
+
+
+class OperatorScheduler:
+    """Available operators in a policy, kept up to date from manager notifications."""
+
+    def __init__(
+        self,
+        operators: OperatorManager,
+        conversations: ConversationManager,
+        policy: Optional[SchedulingPolicy] = None,
+        max_clients: int = 0,
+    ):
+        self._operators = operators
+        self._conversations = conversations
+        self._policy = policy or LeastLoadedPolicy()
+        self._skills = SkillIndex()
+        self._max_clients = max_clients
+        self._admission_cap = 0
+        for operator in operators.list_operators():
+            self.refresh(operator.chat_id)
+        operators.subscribe(self.refresh)
+        conversations.subscribe(self.refresh)
+
+    def refresh(self, chat_id: int) -> None:
+        try:
+            operator = self._operators.get_operator(chat_id)
+        except KeyError:
+            self._policy.remove(chat_id)
+            self._skills.remove(chat_id)
+            return
+        if operator.status != OperatorStatus.AVAILABLE:
+            self._policy.remove(chat_id)
+            self._skills.remove(chat_id)
+            return
+        load = self._conversations.client_count(chat_id)
+        self._policy.update(chat_id, load, operator.updated_at)
+        self._skills.update(chat_id, operator.skills, load, operator.updated_at)
+
+    def pick(self, tags: Sequence[str] = ()) -> Optional[int]:
+        """The best skill match for ``tags``, else the policy's pick."""
+        cap = self.max_clients
+        if tags:
+            operator_chat_id = self._skills.best(tags, cap)
+            if operator_chat_id is not None:
+                return operator_chat_id
+        return self._policy.pick(cap)
+
+    @property
+    def max_clients(self) -> int:
+        """The cap in force: the configured one or the admission cap, whichever is lower."""
+        caps = [cap for cap in (self._max_clients, self._admission_cap) if cap]
+        return min(caps) if caps else 0
+
+    def set_admission_cap(self, cap: int) -> None:
+        """Hand no new clients to operators who already have ``cap``; 0 lifts the limit."""
+        self._admission_cap = cap
+        for operator in self._operators.list_operators():
+            if operator.capped:
+                self.reopen(operator.chat_id)
+
+    def reopen(self, chat_id: int) -> None:
+        """Mark an operator available again if only the cap made them busy."""
+        cap = self.max_clients
+        operator = self._operators.get_operator(chat_id)
+        if operator.capped and cap and self._conversations.client_count(chat_id) < cap:
+            self._operators.set_status(chat_id, OperatorStatus.AVAILABLE)
+
+    def assign(
+        self, client_chat_id: int, client_name: str, tags: Sequence[str] = ()
+    ) -> Tuple[Optional[int], bool]:
+        """Bind a client to the picked operator; returns (operator, assigned by this call)."""
+        with self._conversations.transaction():
+            self._operators.sync()
+            record = self._conversations.get_client_record(client_chat_id)
+            if record:
+                return int(record["operator_id"]), False
+            operator_chat_id = self.pick(tags)
+            if not operator_chat_id:
+                return None, False
+            self._conversations.bind_client(client_chat_id, operator_chat_id, client_name, tags)
+            cap = self.max_clients
+            if not cap:
+                self._operators.set_status(operator_chat_id, OperatorStatus.BUSY)
+            elif self._conversations.client_count(operator_chat_id) >= cap:
+                self._operators.set_status(operator_chat_id, OperatorStatus.BUSY, capped=True)
+            if not self._operators.get_operator(operator_chat_id).active_client:
+                self._operators.set_active_client(operator_chat_id, client_chat_id)
+        return operator_chat_id, True
+
+
+def create_scheduler(
+    operators: OperatorManager,
+    conversations: ConversationManager,
+    policy: str = "least_loaded",
+    max_clients: int = 0,
+) -> OperatorScheduler:
+    try:
+        policy_cls = POLICIES[policy]
+    except KeyError:
+        raise ValueError(f"Unknown scheduling policy: {policy}") from None
+    return OperatorScheduler(operators, conversations, policy_cls(), max_clients)
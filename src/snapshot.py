@@ -0,0 +1,406 @@
+"""
+Compact binary snapshots of the bot state and a converter to and from the JSON files.
+
+    python -m src.snapshot data/conversations.json data/conversations.snap
+    python -m src.snapshot --data-dir data --to binary
+
+Each top-level key is a section: a JSON blob, or a table stored column by column with
+chat ids as int64 and ``utcnow`` timestamps as int64 microseconds since the epoch.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .metrics import STORE_SECONDS
+from .storage import JournalStore, JsonStore
+
+MAGIC = b"TGSNAP"
+VERSION = 1
+COLLECTIONS = ("operators", "conversations", "waiting")
+# Splitting one string is much cheaper than slicing it by offsets; strings holding the
+# separator are stored as JSON, which escapes it.
+SEPARATOR = "\0"
+
+SECTION_JSON = 0
+SECTION_TABLE = 1
+
+COLUMN_INT = 1
+COLUMN_FLOAT = 2
+COLUMN_TIME = 3
+COLUMN_STR = 4
+COLUMN_JSON = 5
+
+TAG_MISSING = 0
+TAG_NONE = 1
+TAG_VALUE = 2
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+# Pieces of the "HH:MM:SS.ffffff" part of a timestamp, so formatting one is a few lookups.
+CLOCK_MINUTES = [f"{hour:02d}:{minute:02d}:" for hour in range(24) for minute in range(60)]
+CLOCK_SECONDS = [f"{second:02d}" for second in range(60)]
+MILLIS = [f".{value:03d}" for value in range(1000)]
+MICROS = [f"{value:03d}" for value in range(1000)]
+_MISSING = object()
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def is_snapshot(path: Path) -> bool:
+    with path.open("rb") as handle:
+        return handle.read(len(MAGIC)) == MAGIC
+
+
+def _is_int(value: Any) -> bool:
+    return type(value) is int and INT64_MIN <= value <= INT64_MAX
+
+
+def _timestamp(value: str) -> Optional[int]:
+    """Microseconds since the epoch if ``value`` reads back exactly as ``utcnow`` wrote it."""
+    if len(value) < 25 or value[10] != "T" or not value.endswith("+00:00"):
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if moment.isoformat() != value:
+        return None
+    return (moment - EPOCH) // MICROSECOND
+
+
+def _format_timestamps(stamps: List[int]) -> List[str]:
+    """The ``utcnow`` strings back from microseconds since the epoch."""
+    days: Dict[int, str] = {}
+    formatted = []
+    append = formatted.append
+    for stamp in stamps:
+        second, micros = divmod(stamp, 1_000_000)
+        day, second = divmod(second, 86400)
+        minute, second = divmod(second, 60)
+        prefix = days.get(day)
+        if prefix is None:
+            prefix = days[day] = (EPOCH + timedelta(days=day)).isoformat()[:11]
+        clock = CLOCK_MINUTES[minute]
+        if micros:
+            millis, micros = divmod(micros, 1000)
+            append(f"{prefix}{clock}{CLOCK_SECONDS[second]}{MILLIS[millis]}{MICROS[micros]}+00:00")
+        else:
+            append(f"{prefix}{clock}{CLOCK_SECONDS[second]}+00:00")
+    return formatted
+
+
+def _int_array(values: List[int]) -> bytes:
+    column = array("q", values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tobytes()
+
+
+class _Writer:
+    def __init__(self) -> None:
+        self.parts: List[bytes] = []
+
+    def pack(self, fmt: str, *values: Any) -> None:
+        self.parts.append(struct.pack("<" + fmt, *values))
+
+    def blob(self, data: bytes) -> None:
+        self.pack("Q", len(data))
+        self.parts.append(data)
+
+    def text(self, value: str) -> None:
+        self.blob(value.encode("utf-8"))
+
+    def strings(self, values: List[str]) -> None:
+        """The unique values joined with ``SEPARATOR`` and compressed, then the row indexes."""
+        table: Dict[str, int] = {}
+        indexes = array("I", [table.setdefault(value, len(table)) for value in values])
+        indexed = len(table) < len(values)
+        if sys.byteorder == "big":
+            indexes.byteswap()
+        self.pack("IB", len(table), indexed)
+        self.blob(zlib.compress(SEPARATOR.join(table).encode("utf-8"), 1))
+        if indexed:
+            self.parts.append(indexes.tobytes())
+
+
+def _classify(values: List[Any]) -> Tuple[int, Optional[List[int]]]:
+    """Column type for the present, non-null values, plus their timestamps if any."""
+    if all(_is_int(value) for value in values):
+        return COLUMN_INT, None
+    if all(type(value) is float for value in values):
+        return COLUMN_FLOAT, None
+    if all(type(value) is str and SEPARATOR not in value for value in values):
+        stamps = [_timestamp(value) for value in values]
+        if None not in stamps:
+            return COLUMN_TIME, stamps  # type: ignore[return-value]
+        return COLUMN_STR, None
+    return COLUMN_JSON, None
+
+
+def _write_column(out: _Writer, name: str, cells: List[Any]) -> None:
+    tags = bytes(
+        TAG_MISSING if cell is _MISSING else TAG_NONE if cell is None else TAG_VALUE
+        for cell in cells
+    )
+    present = [cell for cell in cells if cell is not _MISSING and cell is not None]
+    kind, stamps = _classify(present)
+    out.text(name)
+    tagged = len(present) != len(cells)
+    out.pack("BB", kind, tagged)
+    if tagged:
+        out.parts.append(tags)
+    if kind == COLUMN_TIME:
+        stamp_iter = iter(stamps or [])
+        out.parts.append(_int_array([next(stamp_iter) if tag == TAG_VALUE else 0 for tag in tags]))
+        return
+    filler = {COLUMN_INT: 0, COLUMN_FLOAT: 0.0}.get(kind, "")
+    full = [cell if tag == TAG_VALUE else filler for cell, tag in zip(cells, tags)]
+    if kind == COLUMN_INT:
+        out.parts.append(_int_array(full))
+    elif kind == COLUMN_FLOAT:
+        out.parts.append(struct.pack(f"<{len(full)}d", *full))
+    elif kind == COLUMN_STR:
+        out.strings(full)
+    else:
+        out.strings(
+            [
+                json.dumps(cell, ensure_ascii=False, separators=(",", ":"))
+                if tag == TAG_VALUE
+                else ""
+                for cell, tag in zip(cells, tags)
+            ]
+        )
+
+
+def _is_table(value: Any) -> bool:
+    return isinstance(value, dict) and all(isinstance(record, dict) for record in value.values())
+
+
+def encode_snapshot(payload: Dict[str, Any]) -> bytes:
+    out = _Writer()
+    out.parts.append(MAGIC)
+    out.pack("HI", VERSION, len(payload))
+    for section, value in payload.items():
+        out.text(section)
+        if not _is_table(value) or any(SEPARATOR in key for key in value):
+            out.pack("B", SECTION_JSON)
+            out.text(json.dumps(value, ensure_ascii=False))
+            continue
+        out.pack("B", SECTION_TABLE)
+        keys = list(value)
+        records = list(value.values())
+        int_keys = all(
+            key.lstrip("-").isdecimal() and str(int(key)) == key and _is_int(int(key))
+            for key in keys
+        )
+        out.pack("IB", len(keys), int_keys)
+        if int_keys:
+            out.parts.append(_int_array([int(key) for key in keys]))
+        else:
+            out.strings(keys)
+        fields = list(dict.fromkeys(name for record in records for name in record))
+        out.pack("I", len(fields))
+        for name in fields:
+            _write_column(out, name, [record.get(name, _MISSING) for record in records])
+    return b"".join(out.parts)
+
+
+class _Reader:
+    def __init__(self, buffer: Any) -> None:
+        self.buffer = buffer
+        self.offset = 0
+
+    def unpack(self, fmt: str) -> Tuple[Any, ...]:
+        values = struct.unpack_from("<" + fmt, self.buffer, self.offset)
+        self.offset += struct.calcsize("<" + fmt)
+        return values
+
+    def take(self, size: int) -> bytes:
+        data = self.buffer[self.offset : self.offset + size]
+        if len(data) != size:
+            raise SnapshotError("Snapshot is truncated")
+        self.offset += size
+        return data
+
+    def blob(self) -> bytes:
+        (size,) = self.unpack("Q")
+        return self.take(size)
+
+    def text(self) -> str:
+        return self.blob().decode("utf-8")
+
+    def array(self, typecode: str, count: int) -> List[Any]:
+        column = array(typecode)
+        column.frombytes(self.take(column.itemsize * count))
+        if sys.byteorder == "big":
+            column.byteswap()
+        return column.tolist()
+
+    def strings(self, count: int) -> List[str]:
+        unique, indexed = self.unpack("IB")
+        joined = zlib.decompress(self.blob()).decode("utf-8")
+        table = joined.split(SEPARATOR) if unique else []
+        if not indexed:
+            return table
+        return [table[index] for index in self.array("I", count)]
+
+
+def _read_column(reader: _Reader, count: int) -> Tuple[str, List[Any], Optional[bytes]]:
+    name = reader.text()
+    kind, tagged = reader.unpack("BB")
+    tags = reader.take(count) if tagged else None
+    if kind == COLUMN_INT:
+        cells: List[Any] = reader.array("q", count)
+    elif kind == COLUMN_FLOAT:
+        cells = reader.array("d", count)
+    elif kind == COLUMN_TIME:
+        cells = _format_timestamps(reader.array("q", count))
+    elif kind == COLUMN_STR:
+        cells = reader.strings(count)
+    elif kind == COLUMN_JSON:
+        cells = [json.loads(cell) if cell else None for cell in reader.strings(count)]
+    else:
+        raise SnapshotError(f"Unknown column type {kind} in field {name!r}")
+    if tags is not None:
+        cells = [
+            cell if tag == TAG_VALUE else None if tag == TAG_NONE else _MISSING
+            for cell, tag in zip(cells, tags)
+        ]
+    return name, cells, tags
+
+
+def decode_snapshot(buffer: Any) -> Dict[str, Any]:
+    """Decode from anything that supports the buffer protocol and slicing, e.g. an mmap."""
+    reader = _Reader(buffer)
+    if reader.take(len(MAGIC)) != MAGIC:
+        raise SnapshotError("Not a bot state snapshot")
+    version, sections = reader.unpack("HI")
+    if version != VERSION:
+        raise SnapshotError(f"Unsupported snapshot version {version}")
+    payload: Dict[str, Any] = {}
+    for _ in range(sections):
+        section = reader.text()
+        (kind,) = reader.unpack("B")
+        if kind == SECTION_JSON:
+            payload[section] = json.loads(reader.text())
+            continue
+        count, int_keys = reader.unpack("IB")
+        keys = list(map(str, reader.array("q", count))) if int_keys else reader.strings(count)
+        (field_count,) = reader.unpack("I")
+        records: List[Dict[str, Any]] = [{} for _ in range(count)]
+        # Filling the records column by column is cheaper than building each from a row.
+        for _ in range(field_count):
+            name, cells, tags = _read_column(reader, count)
+            if tags is None or TAG_MISSING not in tags:
+                for record, cell in zip(records, cells):
+                    record[name] = cell
+                continue
+            for record, cell in zip(records, cells):
+                if cell is not _MISSING:
+                    record[name] = cell
+        payload[section] = dict(zip(keys, records))
+    return payload
+
+
+def read_snapshot(path: Path) -> Dict[str, Any]:
+    """Map the file and decode it; columns are copied straight out of the page cache."""
+    with path.open("rb") as handle:
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return decode_snapshot(mapped)
+
+
+class BinaryStore(JsonStore):
+    """``JsonStore`` with the state kept in the binary snapshot format instead of JSON."""
+
+    def _read_unlocked(self) -> Dict[str, Any]:
+        return read_snapshot(self._path)
+
+    def _encode(self, payload: Dict[str, Any]) -> bytes:  # type: ignore[override]
+        return encode_snapshot(payload)
+
+    def _write_encoded(self, data: bytes) -> None:  # type: ignore[override]
+        tmp_path = self._path.with_name(self._path.name + ".tmp")
+        with STORE_SECONDS.time("binary", "write"):
+            with tmp_path.open("wb") as handle:
+                handle.write(data)
+                handle.flush()
+                os.fsync(handle.fileno())
+            os.replace(tmp_path, self._path)
+
+    def load(self) -> Dict[str, Any]:
+        with self._lock, STORE_SECONDS.time("binary", "load"):
+            return self._read_unlocked()
+
+
+def read_state_file(path: Path) -> Dict[str, Any]:
+    """A snapshot, or a JSON state file with its journal (if any) replayed."""
+    if is_snapshot(path):
+        return read_snapshot(path)
+    # JournalStore also replays a journal left by STORAGE_MODE=journal; for a plain JSON
+    # file it just reads it.
+    return JournalStore(path, {}).load()
+
+
+def convert_file(source: Path, target: Path, to_binary: Optional[bool] = None) -> Dict[str, Any]:
+    """Convert to the other format (or as ``to_binary`` says) and return the state."""
+    payload = read_state_file(source)
+    if to_binary is None:
+        to_binary = not is_snapshot(source)
+    existed = target.exists()
+    store = (BinaryStore if to_binary else JsonStore)(target, payload)
+    if existed:
+        store.persist(payload)
+    return payload
+
+
+def import_json_state(data_dir: Path) -> Dict[str, int]:
+    """Create missing ``<collection>.snap`` files from the JSON state in ``data_dir``."""
+    counts: Dict[str, int] = {}
+    for name in COLLECTIONS:
+        source = data_dir / f"{name}.json"
+        target = data_dir / f"{name}.snap"
+        if source.exists() and not target.exists():
+            counts[name] = len(convert_file(source, target, to_binary=True).get(name, {}))
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert bot state between JSON and binary.")
+    parser.add_argument("source", type=Path, nargs="?")
+    parser.add_argument("target", type=Path, nargs="?")
+    parser.add_argument("--data-dir", type=Path, help="convert every state file in this folder")
+    parser.add_argument("--to", choices=["binary", "json"], help="required with --data-dir")
+    args = parser.parse_args()
+    if args.data_dir:
+        if not args.to:
+            parser.error("--data-dir needs --to binary or --to json")
+        to_binary = args.to == "binary"
+        for name in COLLECTIONS:
+            source = args.data_dir / f"{name}.{'json' if to_binary else 'snap'}"
+            target = args.data_dir / f"{name}.{'snap' if to_binary else 'json'}"
+            if source.exists():
+                convert_file(source, target, to_binary)
+                print(f"{source} -> {target}")
+        return
+    if not args.source or not args.target:
+        parser.error("give SOURCE and TARGET, or --data-dir")
+    convert_file(args.source, args.target)
+    print(f"{args.source} -> {args.target}")
+
+
+if __name__ == "__main__":
+    main()
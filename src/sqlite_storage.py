@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import itertools
+import json
+import sqlite3
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from threading import Lock, RLock
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .metrics import STORE_SECONDS
+from .storage import Mutation, Snapshot, StateStore, StoreWriter
+
+
+@dataclass(frozen=True)
+class TableSpec:
+    name: str
+    key: str
+    columns: Tuple[str, ...]
+    indexes: Tuple[str, ...] = ()
+    # Operators repeat their key inside the record ("chat_id"); conversations do not.
+    key_in_record: bool = False
+
+
+TABLES: Dict[str, TableSpec] = {
+    "operators": TableSpec(
+        name="operators",
+        key="chat_id",
+        columns=(
+            "username",
+            "display_name",
+            "status",
+            "active_client",
+            "registered_at",
+            "updated_at",
+        ),
+        indexes=("status",),
+        key_in_record=True,
+    ),
+    "conversations": TableSpec(
+        name="conversations",
+        key="client_id",
+        columns=("operator_id", "client_name", "last_activity"),
+        indexes=("operator_id", "last_activity"),
+    ),
+    "waiting": TableSpec(
+        name="waiting",
+        key="client_id",
+        columns=("client_name", "ticket", "enqueued_at", "notified_position"),
+        indexes=("ticket",),
+    ),
+}
+
+Statement = Tuple[str, Sequence[Any]]
+
+
+def _schema(spec: TableSpec) -> List[str]:
+    columns = ", ".join(spec.columns)
+    statements = [
+        f"CREATE TABLE IF NOT EXISTS {spec.name} "
+        f"({spec.key} INTEGER PRIMARY KEY, {columns}, extra TEXT)"
+    ]
+    statements.extend(
+        f"CREATE INDEX IF NOT EXISTS {spec.name}_{column} ON {spec.name} ({column})"
+        for column in spec.indexes
+    )
+    return statements
+
+
+class SqliteStore(StateStore):
+    """Lazy SQLite store in WAL mode; ``shared=True`` lets several processes use one file."""
+
+    lazy = True
+
+    def __init__(self, path: Path, writer: Optional[StoreWriter] = None, shared: bool = False):
+        if shared and writer is not None:
+            raise ValueError("A shared store writes synchronously and cannot use a StoreWriter")
+        self._path = path
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._writer = writer
+        self.shared = shared
+        self._write_lock = RLock()
+        self._write_conn = self._connect()
+        self._read_conn = self._connect()
+        with self._write_lock:
+            for spec in TABLES.values():
+                for statement in _schema(spec):
+                    self._write_conn.execute(statement)
+        self._overlay_lock = Lock()
+        self._overlay: Dict[Tuple[str, str], Tuple[int, Optional[Dict[str, Any]]]] = {}
+        self._sequence = itertools.count(1)
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def close(self) -> None:
+        self._read_conn.close()
+        with self._write_lock:
+            self._write_conn.close()
+
+    def _spec(self, collection: str) -> TableSpec:
+        try:
+            return TABLES[collection]
+        except KeyError:
+            raise ValueError(f"Unknown collection: {collection}") from None
+
+    def _row_to_record(self, spec: TableSpec, row: Sequence[Any]) -> Tuple[str, Dict[str, Any]]:
+        key, *values, extra = row
+        record: Dict[str, Any] = {spec.key: key} if spec.key_in_record else {}
+        record.update(zip(spec.columns, values))
+        if extra:
+            record.update(json.loads(extra))
+        return str(key), record
+
+    def _upsert(self, spec: TableSpec, key: str, record: Dict[str, Any]) -> Statement:
+        known = set(spec.columns) | {spec.key}
+        extra = {name: value for name, value in record.items() if name not in known}
+        columns = (spec.key, *spec.columns, "extra")
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+        return (
+            f"INSERT INTO {spec.name} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT({spec.key}) DO UPDATE SET {updates}",
+            (
+                int(key),
+                *(record.get(column) for column in spec.columns),
+                json.dumps(extra, ensure_ascii=False) if extra else None,
+            ),
+        )
+
+    def _statement(self, mutation: Mutation) -> Statement:
+        collection, key, *field = mutation["path"]
+        spec = self._spec(collection)
+        if not field:
+            if mutation["op"] == "del":
+                return f"DELETE FROM {spec.name} WHERE {spec.key} = ?", (int(key),)
+            return self._upsert(spec, key, mutation["value"])
+        if mutation["op"] != "set" or len(field) != 1:
+            raise ValueError(f"Unsupported mutation: {mutation}")
+        (name,) = field
+        if name in spec.columns:
+            return (
+                f"UPDATE {spec.name} SET {name} = ? WHERE {spec.key} = ?",
+                (mutation["value"], int(key)),
+            )
+        return (
+            f"UPDATE {spec.name} SET extra = json_set(COALESCE(extra, '{{}}'), ?, json(?)) "
+            f"WHERE {spec.key} = ?",
+            (f'$."{name}"', json.dumps(mutation["value"], ensure_ascii=False), int(key)),
+        )
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        # Only other processes can interleave with the loop thread, so only shared stores
+        # need the write lock held across the block.
+        if not self.shared:
+            yield
+            return
+        with self._write_transaction():
+            yield
+
+    @contextmanager
+    def _write_transaction(self) -> Iterator[None]:
+        # Re-entrant: commits issued inside the block join the outer transaction.
+        with self._write_lock:
+            if self._write_conn.in_transaction:
+                yield
+                return
+            self._write_conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._write_conn.execute("ROLLBACK")
+                raise
+            self._write_conn.execute("COMMIT")
+
+    def data_version(self) -> int:
+        # Asked on the write connection so that this store's own commits do not count.
+        with self._write_lock:
+            return self._write_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _execute(
+        self, statements: List[Statement], tokens: List[Tuple[Tuple[str, str], int]]
+    ) -> None:
+        with self._write_transaction(), STORE_SECONDS.time("sqlite", "write"):
+            for sql, params in statements:
+                self._write_conn.execute(sql, params)
+        with self._overlay_lock:
+            for overlay_key, sequence in tokens:
+                if self._overlay.get(overlay_key, (None,))[0] == sequence:
+                    del self._overlay[overlay_key]
+
+    def commit(self, snapshot: Snapshot, mutations: Iterable[Mutation]) -> None:
+        statements: List[Statement] = []
+        tokens: List[Tuple[Tuple[str, str], int]] = []
+        with self._overlay_lock:
+            for mutation in mutations:
+                statements.append(self._statement(mutation))
+                collection, key, *field = mutation["path"]
+                if field:
+                    continue
+                sequence = next(self._sequence)
+                value = mutation["value"] if mutation["op"] == "set" else None
+                self._overlay[(collection, key)] = (sequence, value)
+                tokens.append(((collection, key), sequence))
+        if not statements:
+            return
+        if self._writer is not None:
+            self._writer.submit(partial(self._execute, statements, tokens))
+        else:
+            self._execute(statements, tokens)
+
+    def _pending(self, collection: str) -> Dict[str, Optional[Dict[str, Any]]]:
+        with self._overlay_lock:
+            return {
+                key: value
+                for (name, key), (_, value) in self._overlay.items()
+                if name == collection
+            }
+
+    def get_record(self, collection: str, key: str) -> Optional[Dict[str, Any]]:
+        with self._overlay_lock:
+            pending = self._overlay.get((collection, key))
+        if pending is not None:
+            return pending[1]
+        spec = self._spec(collection)
+        with STORE_SECONDS.time("sqlite", "read"):
+            row = self._read_conn.execute(
+                f"SELECT {spec.key}, {', '.join(spec.columns)}, extra FROM {spec.name} "
+                f"WHERE {spec.key} = ?",
+                (int(key),),
+            ).fetchone()
+        return self._row_to_record(spec, row)[1] if row else None
+
+    def keys_where(self, collection: str, field: str, value: Any) -> List[str]:
+        spec = self._spec(collection)
+        if field not in spec.columns:
+            raise ValueError(f"{collection}.{field} is not a column")
+        keys = {
+            str(key)
+            for (key,) in self._read_conn.execute(
+                f"SELECT {spec.key} FROM {spec.name} WHERE {field} = ?", (value,)
+            )
+        }
+        for key, record in self._pending(collection).items():
+            if record is not None and record.get(field) == value:
+                keys.add(key)
+            else:
+                keys.discard(key)
+        return sorted(keys, key=int)
+
+    def keys_below(self, collection: str, field: str, bound: Any, limit: int) -> List[str]:
+        spec = self._spec(collection)
+        if field not in spec.columns:
+            raise ValueError(f"{collection}.{field} is not a column")
+        rows = {
+            str(key): value
+            for key, value in self._read_conn.execute(
+                f"SELECT {spec.key}, {field} FROM {spec.name} WHERE {field} < ? "
+                f"ORDER BY {field} LIMIT ?",
+                (bound, limit),
+            )
+        }
+        for key, record in self._pending(collection).items():
+            if record is not None and record.get(field) is not None and record[field] < bound:
+                rows[key] = record[field]
+            else:
+                rows.pop(key, None)
+        return sorted(rows, key=rows.__getitem__)[:limit]
+
+    def iter_records(self, collection: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        spec = self._spec(collection)
+        pending = self._pending(collection)
+        cursor = self._read_conn.execute(
+            f"SELECT {spec.key}, {', '.join(spec.columns)}, extra FROM {spec.name}"
+        )
+        for row in cursor:
+            key, record = self._row_to_record(spec, row)
+            if key in pending:
+                continue
+            yield key, record
+        for key, record in pending.items():
+            if record is not None:
+                yield key, record
+
+    def load(self) -> Dict[str, Any]:
+        return {name: dict(self.iter_records(name)) for name in TABLES}
+
+    def persist(self, payload: Dict[str, Any]) -> None:
+        statements: List[Statement] = []
+        for collection, records in payload.items():
+            spec = self._spec(collection)
+            statements.append((f"DELETE FROM {spec.name}", ()))
+            statements.extend(self._upsert(spec, key, record) for key, record in records.items())
+        if self._writer is not None:
+            self._writer.drain()
+        self._execute(statements, [])
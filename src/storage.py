@@ -1,34 +1,137 @@
+import asyncio
 import json
+import logging
+import os
+from contextlib import contextmanager
+from functools import partial
 from pathlib import Path
-from threading import Lock
-from typing import Any, Dict
+from queue import Queue
+from threading import Lock, Thread
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
+from .metrics import STORE_SECONDS
 
-class JsonStore:
-    def __init__(self, path: Path, default_payload: Dict[str, Any]):
+Mutation = Dict[str, Any]
+Snapshot = Callable[[], Dict[str, Any]]
+
+logger = logging.getLogger(__name__)
+
+
+def set_mutation(path: Sequence[str], value: Any) -> Mutation:
+    return {"op": "set", "path": list(path), "value": value}
+
+
+def delete_mutation(path: Sequence[str]) -> Mutation:
+    return {"op": "del", "path": list(path)}
+
+
+def apply_mutation(payload: Dict[str, Any], mutation: Mutation) -> None:
+    *parents, leaf = mutation["path"]
+    node = payload
+    for key in parents:
+        node = node.setdefault(key, {})
+    if mutation["op"] == "set":
+        node[leaf] = mutation["value"]
+    elif mutation["op"] == "del":
+        node.pop(leaf, None)
+    else:
+        raise ValueError(f"Unknown mutation op: {mutation['op']}")
+
+
+class StateStore:
+    """Interface the managers persist through."""
+
+    lazy = False
+    shared = False
+
+    def load(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def persist(self, payload: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def commit(self, snapshot: Snapshot, mutations: Iterable[Mutation]) -> None:
+        raise NotImplementedError
+
+    def get_record(self, collection: str, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def keys_where(self, collection: str, field: str, value: Any) -> List[str]:
+        raise NotImplementedError
+
+    def keys_below(self, collection: str, field: str, bound: Any, limit: int) -> List[str]:
+        """Up to ``limit`` keys whose ``field`` is below ``bound``, smallest first."""
+        raise NotImplementedError
+
+    def iter_records(self, collection: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        raise NotImplementedError
+
+    def data_version(self) -> int:
+        return 0
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        yield
+
+
+class JsonStore(StateStore):
+    def __init__(
+        self,
+        path: Path,
+        default_payload: Dict[str, Any],
+        writer: Optional["StoreWriter"] = None,
+    ):
         self._path = path
         self._path.parent.mkdir(parents=True, exist_ok=True)
         self._lock = Lock()
         self._default = default_payload
+        self._writer = writer
         if not self._path.exists():
             self._write(self._default)
 
+    @property
+    def path(self) -> Path:
+        return self._path
+
     def _read_unlocked(self) -> Dict[str, Any]:
         with self._path.open("r", encoding="utf-8") as handle:
             return json.load(handle)
 
+    def _encode(self, payload: Dict[str, Any]) -> str:
+        return json.dumps(payload, ensure_ascii=False, indent=2)
+
     def _write(self, payload: Dict[str, Any]) -> None:
-        with self._path.open("w", encoding="utf-8") as handle:
-            json.dump(payload, handle, ensure_ascii=False, indent=2)
+        self._write_encoded(self._encode(payload))
 
-    def load(self) -> Dict[str, Any]:
+    def _write_encoded(self, data: str) -> None:
+        # Write next to the target and swap it in, so a crash never leaves a half-written file.
+        tmp_path = self._path.with_name(self._path.name + ".tmp")
+        with STORE_SECONDS.time("json", "write"):
+            with tmp_path.open("w", encoding="utf-8") as handle:
+                handle.write(data)
+                handle.flush()
+                os.fsync(handle.fileno())
+            os.replace(tmp_path, self._path)
+
+    def _persist_encoded(self, data: str) -> None:
         with self._lock:
+            self._write_encoded(data)
+
+    def load(self) -> Dict[str, Any]:
+        with self._lock, STORE_SECONDS.time("json", "load"):
             return self._read_unlocked()
 
     def persist(self, payload: Dict[str, Any]) -> None:
         with self._lock:
             self._write(payload)
 
+    def commit(self, snapshot: Snapshot, mutations: Iterable[Mutation]) -> None:
+        """Record that ``mutations`` were applied to the state returned by ``snapshot``."""
+        if self._writer is not None:
+            self._writer.submit_snapshot(self, snapshot)
+        else:
+            self.persist(snapshot())
+
     def update(self, mutator: Any) -> Dict[str, Any]:
         """
         Atomically apply a mutator function that receives the current payload and must return
@@ -40,3 +143,229 @@ class JsonStore:
             self._write(new_payload)
             return new_payload
 
+
+class JournalStore(JsonStore):
+    """JSON snapshot plus an append-only log of mutations, compacted in the background."""
+
+    def __init__(
+        self,
+        path: Path,
+        default_payload: Dict[str, Any],
+        compact_after: int = 1000,
+        writer: Optional["StoreWriter"] = None,
+    ):
+        self._log_path = path.with_name(path.name + ".log")
+        self._compacting_path = path.with_name(path.name + ".log.compacting")
+        self._compact_after = compact_after
+        self._log_records = 0
+        self._compactor: Optional[Thread] = None
+        self._snapshot_lock = Lock()
+        super().__init__(path, default_payload, writer)
+        if self._compacting_path.exists():
+            # Left over from an interrupted compaction: fold it in before a new one can replace it.
+            self._compact()
+
+    def _write_encoded(self, data: str) -> None:
+        with self._snapshot_lock:
+            super()._write_encoded(data)
+
+    def _replay(self, payload: Dict[str, Any], log_path: Path) -> int:
+        if not log_path.exists():
+            return 0
+        applied = 0
+        with log_path.open("r+b") as handle:
+            offset = 0
+            for line in handle:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("unterminated record")
+                    mutation = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-append: drop it so new records
+                    # are not glued onto it.
+                    handle.truncate(offset)
+                    break
+                apply_mutation(payload, mutation)
+                offset += len(line)
+                applied += 1
+        return applied
+
+    def _read_unlocked(self) -> Dict[str, Any]:
+        payload = super()._read_unlocked()
+        self._replay(payload, self._compacting_path)
+        self._log_records = self._replay(payload, self._log_path)
+        return payload
+
+    def _wait_for_compaction(self) -> None:
+        if self._compactor is not None:
+            self._compactor.join()
+            self._compactor = None
+
+    def _replace_unlocked(self, payload: Dict[str, Any]) -> None:
+        self._wait_for_compaction()
+        self._write(payload)
+        self._compacting_path.unlink(missing_ok=True)
+        self._log_path.unlink(missing_ok=True)
+        self._log_records = 0
+
+    def persist(self, payload: Dict[str, Any]) -> None:
+        with self._lock:
+            self._replace_unlocked(payload)
+
+    def update(self, mutator: Any) -> Dict[str, Any]:
+        with self._lock:
+            self._wait_for_compaction()
+            payload = self._read_unlocked()
+            new_payload = mutator(payload)
+            self._replace_unlocked(new_payload)
+            return new_payload
+
+    def commit(self, snapshot: Snapshot, mutations: Iterable[Mutation]) -> None:
+        lines = [json.dumps(mutation, ensure_ascii=False) + "\n" for mutation in mutations]
+        if not lines:
+            return
+        if self._writer is not None:
+            self._writer.submit(partial(self._append, lines))
+        else:
+            self._append(lines)
+
+    def _append(self, lines: List[str]) -> None:
+        with self._lock:
+            with STORE_SECONDS.time("journal", "append"):
+                with self._log_path.open("a", encoding="utf-8") as handle:
+                    handle.writelines(lines)
+            self._log_records += len(lines)
+            if self._log_records >= self._compact_after:
+                self._start_compaction()
+
+    def _start_compaction(self) -> None:
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._wait_for_compaction()
+        os.replace(self._log_path, self._compacting_path)
+        self._log_records = 0
+        self._compactor = Thread(target=self._compact, name="journal-compactor")
+        self._compactor.start()
+
+    def _compact(self) -> None:
+        with self._snapshot_lock:
+            payload = JsonStore._read_unlocked(self)
+        self._replay(payload, self._compacting_path)
+        self._write(payload)
+        self._compacting_path.unlink(missing_ok=True)
+
+    def compact(self) -> None:
+        with self._lock:
+            self._wait_for_compaction()
+            if self._log_path.exists():
+                self._start_compaction()
+            self._wait_for_compaction()
+
+
+class StoreWriter:
+    """Runs store writes in order on one background thread; ``close`` drains it."""
+
+    def __init__(self) -> None:
+        self._queue: "Queue[Optional[Tuple[Callable[[], None], Optional[Path], int]]]" = Queue()
+        self._generations: Dict[Path, int] = {}
+        self._generations_lock = Lock()
+        self._pending: Dict[JsonStore, Snapshot] = {}
+        self._flush_scheduled = False
+        self.written = 0
+        self.coalesced = 0
+        self.failed = 0
+        self._thread = Thread(target=self._run, name="store-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, job: Callable[[], None], coalesce_key: Optional[Path] = None) -> None:
+        generation = 0
+        if coalesce_key is not None:
+            with self._generations_lock:
+                generation = self._generations.get(coalesce_key, 0) + 1
+                self._generations[coalesce_key] = generation
+        self._queue.put((job, coalesce_key, generation))
+
+    def submit_snapshot(self, store: JsonStore, snapshot: Snapshot) -> None:
+        self._pending[store] = snapshot
+        if self._flush_scheduled:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush_pending()
+            return
+        self._flush_scheduled = True
+        loop.call_soon(self.flush_pending)
+
+    def flush_pending(self) -> None:
+        self._flush_scheduled = False
+        pending, self._pending = self._pending, {}
+        for store, snapshot in pending.items():
+            data = store._encode(snapshot())
+            self.submit(partial(store._persist_encoded, data), coalesce_key=store.path)
+
+    def _is_stale(self, key: Optional[Path], generation: int) -> bool:
+        if key is None:
+            return False
+        with self._generations_lock:
+            return generation != self._generations.get(key)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                job, key, generation = item
+                if self._is_stale(key, generation):
+                    self.coalesced += 1
+                    continue
+                try:
+                    job()
+                    self.written += 1
+                except Exception:
+                    self.failed += 1
+                    logger.exception("Store write failed")
+            finally:
+                self._queue.task_done()
+
+    def drain(self) -> None:
+        self.flush_pending()
+        self._queue.join()
+
+    def close(self) -> None:
+        self.drain()
+        self._queue.put(None)
+        self._thread.join()
+
+
+def create_store(
+    path: Path,
+    default_payload: Dict[str, Any],
+    mode: str = "json",
+    compact_after: int = 1000,
+    writer: Optional[StoreWriter] = None,
+) -> JsonStore:
+    if mode == "journal":
+        return JournalStore(path, default_payload, compact_after=compact_after, writer=writer)
+    if mode == "json":
+        return JsonStore(path, default_payload, writer=writer)
+    raise ValueError(f"Unknown storage mode: {mode}")
+
+
+__all__ = [
+    "JsonStore",
+    "StateStore",
+    "JournalStore",
+    "Mutation",
+    "Snapshot",
+    "StoreWriter",
+    "apply_mutation",
+    "create_store",
+    "delete_mutation",
+    "set_mutation",
+]
@@ -0,0 +1,254 @@
+"""
+Append-only transcripts of client conversations and a streaming export.
+
+    python -m src.transcripts --data-dir data --client 123456 > 123456.jsonl
+    python -m src.transcripts --data-dir data --since 2026-01-01 --format csv > all.csv
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+from collections import deque
+from pathlib import Path
+from queue import Empty, Queue
+from threading import Thread
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from telegram import Message
+
+from .managers import utcnow
+from .metrics import STORE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+SHARDS = 256
+WRITE_BATCH = 1000
+# Checked in order; a venue message also carries a location.
+MESSAGE_KINDS = (
+    "text",
+    "photo",
+    "video",
+    "document",
+    "audio",
+    "voice",
+    "video_note",
+    "animation",
+    "sticker",
+    "venue",
+    "location",
+    "contact",
+    "poll",
+    "dice",
+)
+EXPORT_FIELDS = ("client_id", "at", "role", "from", "message_id", "type", "text")
+
+
+def message_kind(message: Message) -> str:
+    for kind in MESSAGE_KINDS:
+        if getattr(message, kind, None):
+            return kind
+    return "other"
+
+
+class TranscriptLog:
+    """Per-client JSON-lines transcripts, appended in batches by a background thread."""
+
+    def __init__(self, root: Path, segment_bytes: int = 1 << 20):
+        self._root = root
+        self._segment_bytes = segment_bytes
+        self._queue: "Queue[Optional[Tuple[int, str]]]" = Queue()
+        self._thread: Optional[Thread] = None
+        self._shard_dirs: Set[Path] = set()
+        self.written = 0
+        self.failed = 0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def _shard(self, client_id: int) -> Path:
+        return self._root / f"{client_id % SHARDS:02x}"
+
+    def _active_path(self, client_id: int) -> Path:
+        return self._shard(client_id) / f"{client_id}.jsonl"
+
+    def _sealed_segments(self, client_id: int) -> List[Path]:
+        numbered = []
+        for path in self._shard(client_id).glob(f"{client_id}.*.jsonl"):
+            number = path.name.split(".")[1]
+            if number.isdigit():
+                numbered.append((int(number), path))
+        return [path for _, path in sorted(numbered)]
+
+    def segments(self, client_id: int) -> List[Path]:
+        """Oldest first; the active segment, if any, comes last."""
+        paths = self._sealed_segments(client_id)
+        active = self._active_path(client_id)
+        if active.exists():
+            paths.append(active)
+        return paths
+
+    def record(
+        self,
+        client_id: int,
+        role: str,
+        sender_id: int,
+        message_id: Optional[int],
+        kind: str,
+        text: Optional[str] = None,
+    ) -> None:
+        entry = {
+            "at": utcnow(),
+            "role": role,
+            "from": sender_id,
+            "message_id": message_id,
+            "type": kind,
+        }
+        if text:
+            entry["text"] = text
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name="transcript-writer", daemon=True)
+            self._thread.start()
+        self._queue.put((client_id, json.dumps(entry, ensure_ascii=False, separators=(",", ":"))))
+
+    def record_message(self, client_id: int, role: str, message: Message) -> None:
+        self.record(
+            client_id,
+            role,
+            message.chat_id,
+            message.message_id,
+            message_kind(message),
+            message.text or message.caption,
+        )
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            by_client: Dict[int, List[str]] = {}
+            for item in batch:
+                if item is not None:
+                    by_client.setdefault(item[0], []).append(item[1])
+            for client_id, lines in by_client.items():
+                try:
+                    with STORE_SECONDS.time("transcript", "append"):
+                        self._append(client_id, lines)
+                    self.written += len(lines)
+                except Exception:
+                    self.failed += len(lines)
+                    logger.exception("Failed to write the transcript of %s", client_id)
+            for _ in batch:
+                self._queue.task_done()
+            if None in batch:
+                return
+
+    def _append(self, client_id: int, lines: List[str]) -> None:
+        shard = self._shard(client_id)
+        if shard not in self._shard_dirs:
+            shard.mkdir(parents=True, exist_ok=True)
+            self._shard_dirs.add(shard)
+        path = self._active_path(client_id)
+        with open(path, "ab") as handle:
+            handle.write("".join(line + "\n" for line in lines).encode("utf-8"))
+            size = handle.tell()
+        if size >= self._segment_bytes:
+            sealed = self._sealed_segments(client_id)
+            number = int(sealed[-1].name.split(".")[1]) + 1 if sealed else 1
+            os.replace(path, shard / f"{client_id}.{number}.jsonl")
+
+    def drain(self) -> None:
+        self._queue.join()
+
+    def close(self) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    @staticmethod
+    def _read_segment(path: Path, since: Optional[str] = None) -> Iterator[Dict]:
+        with open(path, encoding="utf-8") as handle:
+            for line in handle:
+                if not line.endswith("\n"):  # the writer is in the middle of this line
+                    return
+                entry = json.loads(line)
+                if since is None or entry["at"] >= since:
+                    yield entry
+
+    def iter_transcript(self, client_id: int, since: Optional[str] = None) -> Iterator[Dict]:
+        """Entries oldest first, read one line at a time."""
+        done = 0
+        while True:
+            sealed = self._sealed_segments(client_id)
+            for path in sealed[done:]:
+                yield from self._read_segment(path, since)
+            done = len(sealed)
+            try:
+                yield from self._read_segment(self._active_path(client_id), since)
+                return
+            except FileNotFoundError:
+                # Either there is no active segment or it was sealed after we listed.
+                if len(self._sealed_segments(client_id)) == done:
+                    return
+
+    def tail(self, client_id: int, limit: int) -> List[Dict]:
+        """The last ``limit`` entries, reading only the newest segments."""
+        while True:
+            collected: List[Dict] = []
+            try:
+                for path in reversed(self.segments(client_id)):
+                    chunk = deque(self._read_segment(path), maxlen=limit - len(collected))
+                    collected[:0] = chunk
+                    if len(collected) >= limit:
+                        break
+                return collected
+            except FileNotFoundError:
+                # The active segment was sealed after we listed; its entries, the newest
+                # ones, are now in a segment the listing lacks.
+                continue
+
+    def clients(self) -> Iterator[int]:
+        if not self._root.exists():
+            return
+        for shard in sorted(self._root.iterdir()):
+            if shard.is_dir():
+                yield from sorted({int(path.name.split(".")[0]) for path in shard.glob("*.jsonl")})
+
+    def export(
+        self, client_ids: Optional[Sequence[int]] = None, since: Optional[str] = None
+    ) -> Iterator[Dict]:
+        for client_id in client_ids if client_ids else self.clients():
+            for entry in self.iter_transcript(client_id, since):
+                yield {"client_id": client_id, **entry}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export conversation transcripts.")
+    parser.add_argument("--data-dir", type=Path, default=Path("data"))
+    parser.add_argument("--dir", type=Path, default=None, help="default: <data-dir>/transcripts")
+    parser.add_argument("--client", type=int, action="append", help="repeat for several clients")
+    parser.add_argument("--since", default=None, help="ISO timestamp, e.g. 2026-01-01")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    args = parser.parse_args()
+    log = TranscriptLog(args.dir or args.data_dir / "transcripts")
+    entries = log.export(args.client, args.since)
+    if args.format == "csv":
+        writer = csv.DictWriter(sys.stdout, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(entries)
+    else:
+        for entry in entries:
+            sys.stdout.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+from .managers import utcnow
+from .storage import Mutation, StateStore, delete_mutation, set_mutation
+
+# One copy_messages call takes at most 100 messages.
+MESSAGE_IDS_LIMIT = 100
+
+
+class WaitingQueue:
+    """Persistent FIFO of clients that found no free operator, ordered by ticket number."""
+
+    def __init__(self, store: StateStore, announce_top: int = 3, eta_samples: int = 20):
+        self._store = store
+        self._announce_top = announce_top
+        self._version = store.data_version()
+        self._entries: Dict[int, Dict] = {}
+        self._tickets: List[int] = []
+        self._by_ticket: Dict[int, int] = {}
+        self._read_entries()
+        self._dispatched: Deque[float] = deque(maxlen=eta_samples)
+
+    def _load_state(self) -> Dict[str, Dict]:
+        if self._store.lazy:
+            return {"waiting": dict(self._store.iter_records("waiting"))}
+        payload = self._store.load()
+        if "waiting" not in payload:
+            payload = {"waiting": {}}
+            self._store.persist(payload)
+        return payload
+
+    def _read_entries(self) -> None:
+        self._entries = {int(key): record for key, record in self._load_state()["waiting"].items()}
+        self._by_ticket = {int(record["ticket"]): key for key, record in self._entries.items()}
+        self._tickets = sorted(self._by_ticket)
+
+    def sync(self) -> None:
+        """Re-read the queue if another process has written to a shared store."""
+        if not self._store.shared:
+            return
+        version = self._store.data_version()
+        if version != self._version:
+            self._version = version
+            self._read_entries()
+
+    def _snapshot(self) -> Dict[str, Dict]:
+        return {"waiting": {str(key): record for key, record in self._entries.items()}}
+
+    def _commit(self, *mutations: Mutation) -> None:
+        if mutations:
+            self._store.commit(self._snapshot, mutations)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, client_chat_id: int) -> bool:
+        return client_chat_id in self._entries
+
+    def enqueue(
+        self,
+        client_chat_id: int,
+        client_name: str,
+        front: bool = False,
+        tags: Sequence[str] = (),
+        message_id: Optional[int] = None,
+    ) -> Tuple[int, bool]:
+        """Returns the position and whether this call added the client."""
+        record = self._entries.get(client_chat_id)
+        if record is not None:
+            message_ids = record.setdefault("message_ids", [])
+            # An edited message arrives again with the same id.
+            if (
+                message_id is not None
+                and message_id not in message_ids
+                and len(message_ids) < MESSAGE_IDS_LIMIT
+            ):
+                message_ids.append(message_id)
+                self._commit(
+                    set_mutation(
+                        ("waiting", str(client_chat_id), "message_ids"), list(message_ids)
+                    )
+                )
+            return self.position(client_chat_id), False
+        if front:
+            ticket = self._tickets[0] - 1 if self._tickets else 1
+        else:
+            ticket = self._tickets[-1] + 1 if self._tickets else 1
+        position = 1 if front else len(self._entries) + 1
+        record = {
+            "client_name": client_name,
+            "ticket": ticket,
+            "enqueued_at": utcnow(),
+            "notified_position": position,
+        }
+        if tags:
+            record["tags"] = list(tags)
+        if message_id is not None:
+            record["message_ids"] = [message_id]
+        self._entries[client_chat_id] = record
+        self._by_ticket[ticket] = client_chat_id
+        if front:
+            self._tickets.insert(0, ticket)
+        else:
+            self._tickets.append(ticket)
+        self._commit(set_mutation(("waiting", str(client_chat_id)), record))
+        return position, True
+
+    def position(self, client_chat_id: int) -> Optional[int]:
+        record = self._entries.get(client_chat_id)
+        if record is None:
+            return None
+        return bisect_left(self._tickets, int(record["ticket"])) + 1
+
+    def clients(self) -> List[int]:
+        """Waiting clients in queue order."""
+        return [self._by_ticket[ticket] for ticket in self._tickets]
+
+    def tags(self, client_chat_id: int) -> List[str]:
+        record = self._entries.get(client_chat_id)
+        return list(record.get("tags") or []) if record else []
+
+    def head(self) -> Optional[Tuple[int, str]]:
+        if not self._tickets:
+            return None
+        client_chat_id = self._by_ticket[self._tickets[0]]
+        return client_chat_id, self._entries[client_chat_id]["client_name"]
+
+    def remove(self, client_chat_id: int) -> Optional[Dict]:
+        record = self._entries.pop(client_chat_id, None)
+        if record is None:
+            return None
+        ticket = int(record["ticket"])
+        del self._tickets[bisect_left(self._tickets, ticket)]
+        del self._by_ticket[ticket]
+        self._dispatched.append(time.monotonic())
+        self._commit(delete_mutation(("waiting", str(client_chat_id))))
+        return record
+
+    def eta_seconds(self, position: int) -> Optional[float]:
+        """Expected wait from the recent dispatch rate; None until there is enough history."""
+        if len(self._dispatched) < 2:
+            return None
+        span = self._dispatched[-1] - self._dispatched[0]
+        if span < 1.0:  # a single batch says nothing about the rate
+            return None
+        return position * span / (len(self._dispatched) - 1)
+
+    def position_updates(self) -> List[Tuple[int, int]]:
+        """(client, position) pairs that deserve a notice after the queue moved."""
+        updates: List[Tuple[int, int]] = []
+        mutations: List[Mutation] = []
+        for position, ticket in enumerate(self._tickets, start=1):
+            client_chat_id = self._by_ticket[ticket]
+            record = self._entries[client_chat_id]
+            last = record.get("notified_position") or position
+            if position <= last // 2 or (position <= self._announce_top and position < last):
+                record["notified_position"] = position
+                updates.append((client_chat_id, position))
+                mutations.append(
+                    set_mutation(("waiting", str(client_chat_id), "notified_position"), position)
+                )
+        self._commit(*mutations)
+        return updates
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+}
+
+
+@dataclass
+class WebhookStats:
+    received: int = 0
+    rejected: int = 0
+
+
+class WebhookServer:
+    """Minimal HTTP/1.1 server that puts Telegram webhook updates on ``update_queue``."""
+
+    def __init__(
+        self,
+        application: Application,
+        listen: str = "127.0.0.1",
+        port: int = 8080,
+        path: str = "/telegram",
+        secret_token: str = "",
+        max_body: int = 1 << 20,
+        reuse_port: bool = False,
+        idle_timeout: float = 30.0,
+    ):
+        self._application = application
+        self._listen = listen
+        self._port = port
+        self._path = path
+        self._secret_token = secret_token
+        self._max_body = max_body
+        self._reuse_port = reuse_port
+        self._idle_timeout = idle_timeout
+        self._server: Optional[asyncio.base_events.Server] = None
+        self.stats = WebhookStats()
+
+    @property
+    def port(self) -> int:
+        if self._server and self._server.sockets:
+            return self._server.sockets[0].getsockname()[1]
+        return self._port
+
+    async def start(self) -> None:
+        # reuse_port lets several worker processes accept on the same port.
+        self._server = await asyncio.start_server(
+            self._handle, self._listen, self._port, reuse_port=self._reuse_port or None
+        )
+        logger.info("Webhook listening on %s:%s%s", self._listen, self.port, self._path)
+
+    async def stop(self) -> None:
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _read_request(
+        self, reader: asyncio.StreamReader
+    ) -> Optional[Tuple[str, str, Dict[str, str]]]:
+        request_line = await asyncio.wait_for(reader.readline(), self._idle_timeout)
+        if not request_line.strip():
+            return None
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        headers: Dict[str, str] = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self._idle_timeout)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return method, target, headers
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                method, target, headers = request
+                length = int(headers.get("content-length", "0"))
+                if length > self._max_body:
+                    await self._respond(writer, 413, keep_alive=False)
+                    break
+                body = (
+                    await asyncio.wait_for(reader.readexactly(length), self._idle_timeout)
+                    if length
+                    else b""
+                )
+                status = await self._dispatch(method, target, headers, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self._respond(writer, status, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, target: str, headers: Dict[str, str], body: bytes) -> int:
+        if target.split("?", 1)[0] != self._path:
+            status = 404
+        elif method != "POST":
+            status = 405
+        elif self._secret_token and not hmac.compare_digest(
+            headers.get(SECRET_HEADER, ""), self._secret_token
+        ):
+            status = 403
+        else:
+            try:
+                update = Update.de_json(json.loads(body), self._application.bot)
+            except (ValueError, TypeError, KeyError, AttributeError):
+                update = None
+            if update is None:
+                status = 400
+            else:
+                await self._application.update_queue.put(update)
+                self.stats.received += 1
+                return 200
+        self.stats.rejected += 1
+        return status
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, keep_alive: bool) -> None:
+        connection = "keep-alive" if keep_alive else "close"
+        writer.write(
+            (
+                f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                "Content-Length: 0\r\n"
+                f"Connection: {connection}\r\n\r\n"
+            ).encode("latin-1")
+        )
+        await writer.drain()
+
+
+async def run_webhook(
+    application: Application,
+    server: WebhookServer,
+    webhook_url: str,
+    allowed_updates: List[str],
+    secret_token: str = "",
+) -> None:
+    """``Application.run_polling`` for our own server, until SIGINT/SIGTERM."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: Ctrl+C cancels the main task instead.
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        try:
+            await application.bot.set_webhook(
+                url=webhook_url,
+                allowed_updates=allowed_updates,
+                secret_token=secret_token or None,
+            )
+            await application.start()
+            await server.start()
+            await stop_event.wait()
+        finally:
+            await server.stop()
+            if application.running:
+                await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    finally:
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
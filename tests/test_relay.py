@@ -0,0 +1,42 @@
+import asyncio
+
+from telegram.error import BadRequest
+
+from src.relay import Relay
+
+
+class FakeSender:
+    def __init__(self, missing=()):
+        self.missing = set(missing)
+        self.calls = []
+
+    async def send_message(self, **kwargs):
+        self.calls.append(("send_message", kwargs["text"]))
+
+    async def copy_messages(self, **kwargs):
+        self.calls.append(("copy_messages", kwargs["message_ids"]))
+        if self.missing or kwargs["message_ids"] != sorted(set(kwargs["message_ids"])):
+            raise BadRequest("Message to copy not found")
+
+    async def copy_message(self, **kwargs):
+        self.calls.append(("copy_message", kwargs["message_id"]))
+        if kwargs["message_id"] in self.missing:
+            raise BadRequest("Message to copy not found")
+
+
+def test_relay_messages_drops_repeated_ids():
+    sender = FakeSender()
+    asyncio.run(Relay(sender).relay_messages(20, 10, [7, 5, 7], "📨 client"))
+    assert sender.calls == [("send_message", "📨 client"), ("copy_messages", [5, 7])]
+
+
+def test_relay_messages_falls_back_to_single_copies():
+    sender = FakeSender(missing={5})
+    errors = []
+
+    async def on_error(error):
+        errors.append(error)
+
+    asyncio.run(Relay(sender).relay_messages(20, 10, [5, 7, 9], "📨 client", on_error))
+    assert sender.calls[2:] == [("copy_message", 5), ("copy_message", 7), ("copy_message", 9)]
+    assert len(errors) == 1
@@ -0,0 +1,16 @@
+from src.routing import KeywordRules, tags_from_start_payload
+
+
+def test_keyword_rules_match_whole_words_ignoring_case():
+    rules = KeywordRules({"cards": ["карта", "card"], "vip": ["VIP"]})
+    assert rules.tags_for("Моя КАРТА и vip-статус") == ["cards", "vip"]
+    assert rules.tags_for("cardholder") == []
+
+
+def test_keyword_rules_match_that_does_not_casefold_to_the_keyword():
+    rules = KeywordRules({"lang": ["istanbul"]})
+    assert rules.tags_for("İSTANBUL tour") == ["lang"]
+
+
+def test_tags_from_start_payload():
+    assert tags_from_start_payload("ru-Cards-vip-ru") == ["ru", "cards", "vip"]
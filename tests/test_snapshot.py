@@ -0,0 +1,14 @@
+from src.snapshot import decode_snapshot, encode_snapshot
+
+
+def test_snapshot_round_trip():
+    payload = {
+        "conversations": {
+            "20": {"operator_id": 10, "last_activity": "2026-01-01T12:00:00.250931+00:00"},
+            "-5": {"last_activity": "2026-01-01T00:00:00+00:00", "tags": ["vip"]},
+            "42": {"operator_id": None, "last_activity": "1969-12-31T23:59:59.500000+00:00"},
+        },
+        "waiting": {"007": {"enqueued_at": "2026-01-01T00:00:00+03:00", "rate": 1.5}},
+        "meta": {"next_ticket": 3},
+    }
+    assert decode_snapshot(encode_snapshot(payload)) == payload
@@ -0,0 +1,14 @@
+from src.sqlite_storage import SqliteStore
+from src.storage import set_mutation
+
+
+def test_transaction_only_locks_shared_stores(tmp_path):
+    store = SqliteStore(tmp_path / "local.sqlite3")
+    with store.transaction():
+        assert not store._write_conn.in_transaction
+        store.commit(None, [set_mutation(("operators", "1"), {"name": "a"})])
+    assert store.get_record("operators", "1")["name"] == "a"
+
+    shared = SqliteStore(tmp_path / "shared.sqlite3", shared=True)
+    with shared.transaction():
+        assert shared._write_conn.in_transaction
@@ -0,0 +1,13 @@
+from src.storage import JsonStore
+from src.waiting import WaitingQueue
+
+
+def test_edited_message_while_waiting_is_stored_once(tmp_path):
+    queue = WaitingQueue(JsonStore(tmp_path / "waiting.json", {"waiting": {}}))
+    assert queue.enqueue(20, "client", message_id=5) == (1, True)
+    assert queue.enqueue(20, "client", message_id=7) == (1, False)
+    # The edit of message 5 carries the same message_id.
+    assert queue.enqueue(20, "client", message_id=5) == (1, False)
+
+    reloaded = WaitingQueue(JsonStore(tmp_path / "waiting.json", {"waiting": {}}))
+    assert reloaded.remove(20)["message_ids"] == [5, 7]
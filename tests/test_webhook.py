@@ -0,0 +1,13 @@
+import asyncio
+from types import SimpleNamespace
+
+from src.webhook import WebhookServer
+
+
+def test_empty_update_is_rejected():
+    application = SimpleNamespace(update_queue=asyncio.Queue(), bot=None)
+    server = WebhookServer(application)
+    status = asyncio.run(server._dispatch("POST", "/telegram", {}, b"{}"))
+    assert status == 400
+    assert application.update_queue.empty()
+    assert (server.stats.received, server.stats.rejected) == (0, 1)